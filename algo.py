@@ -3,7 +3,9 @@
 
 from __future__ import annotations
 
+import json
 import math
+import os
 import random
 import collections
 from typing import DefaultDict, Dict, List, Optional
@@ -35,6 +37,11 @@ class WordPredictor:
         "quiz": 1 / (60 * 60 * 24 * 7),       # half-life ≈ 1 week
     }
     LEARNING_RATE: float = 0.05
+    # starting coefficients of a new word; modes without an entry use THETA
+    THETA: float = 0.80
+    THETA_S_PRIOR: Dict[str, float] = {}
+    THETA_F_PRIOR: Dict[str, float] = {}
+    THETA_0_PRIOR: float = -1.5
     # -------------------------------------
 
     def __init__(self,
@@ -50,9 +57,11 @@ class WordPredictor:
         self.F: DefaultDict[str, float] = collections.defaultdict(float)
 
         # logistic coefficients and bias
-        self.theta_S: Dict[str, float] = {m: 0.80 for m in self.modes}
-        self.theta_F: Dict[str, float] = {m: 0.80 for m in self.modes}
-        self.theta_0: float = -1.5
+        self.theta_S: Dict[str, float] = {
+            m: self.THETA_S_PRIOR.get(m, self.THETA) for m in self.modes}
+        self.theta_F: Dict[str, float] = {
+            m: self.THETA_F_PRIOR.get(m, self.THETA) for m in self.modes}
+        self.theta_0: float = self.THETA_0_PRIOR
 
         # last-updated timestamp for decay bookkeeping
         self.last_update_ts: float = 0.0
@@ -82,8 +91,8 @@ class WordPredictor:
             self.lambda_[mode] = self.lambda_.get(mode, 1 / (60 * 60 * 24))
             self.S[mode] = 0.0
             self.F[mode] = 0.0
-            self.theta_S[mode] = 0.80
-            self.theta_F[mode] = 0.80
+            self.theta_S[mode] = self.THETA_S_PRIOR.get(mode, self.THETA)
+            self.theta_F[mode] = self.THETA_F_PRIOR.get(mode, self.THETA)
 
         # 1) decay tallies up to event_ts
         self._decay_to(event_ts)
@@ -109,6 +118,72 @@ class WordPredictor:
             self.theta_S[m] += lr * error * self.S[m]
             self.theta_F[m] -= lr * error * self.F[m]
 
+    # ----------------------------------------------------------
+    # Hyper-parameters
+    # ----------------------------------------------------------
+
+    @classmethod
+    def configure(cls, params: Optional[Dict[str, object]] = None) -> None:
+        """Use the hyper-parameters in *params* for every predictor.
+
+        *params* has the layout written by ``train_predictor.py``: the keys
+        ``lambda``, ``theta_S``, ``theta_F`` (per mode), ``theta_0`` and
+        ``learning_rate``, all optional.  Missing values fall back to the
+        built-in defaults; ``configure()`` restores all of them.  Stored
+        states keep their learned coefficients, only new words start from
+        the priors, so replay the log (``/recalculate``) afterwards.
+        """
+        params = params or {}
+        cls.DEFAULT_LAMBDA = {**_BUILTIN["lambda"], **params.get("lambda", {})}
+        cls.THETA_S_PRIOR = dict(params.get("theta_S", {}))
+        cls.THETA_F_PRIOR = dict(params.get("theta_F", {}))
+        cls.THETA_0_PRIOR = float(params.get("theta_0", _BUILTIN["theta_0"]))
+        cls.LEARNING_RATE = float(params.get("learning_rate", _BUILTIN["learning_rate"]))
+
+    @classmethod
+    def params(cls) -> Dict[str, object]:
+        """Return the hyper-parameters in use, in the layout of :meth:`configure`."""
+        return {
+            "lambda": dict(cls.DEFAULT_LAMBDA),
+            "theta_S": dict(cls.THETA_S_PRIOR),
+            "theta_F": dict(cls.THETA_F_PRIOR),
+            "theta_0": cls.THETA_0_PRIOR,
+            "learning_rate": cls.LEARNING_RATE,
+        }
+
+    # ----------------------------------------------------------
+    # Persistence
+    # ----------------------------------------------------------
+
+    def to_dict(self) -> Dict[str, object]:
+        """Return the learned state as JSON-serialisable data."""
+        return {
+            "modes": list(self.modes),
+            "S": {m: self.S[m] for m in self.modes},
+            "F": {m: self.F[m] for m in self.modes},
+            "theta_S": dict(self.theta_S),
+            "theta_F": dict(self.theta_F),
+            "theta_0": self.theta_0,
+            "last_update_ts": self.last_update_ts,
+        }
+
+    @classmethod
+    def from_dict(cls,
+                  data: Dict[str, object],
+                  lambdas: Optional[Dict[str, float]] = None) -> "WordPredictor":
+        """Rebuild a predictor from the output of :meth:`to_dict`."""
+        wp = cls(modes=list(data["modes"]), lambdas=lambdas)
+        for m in wp.modes:
+            # modes added on the fly decay with a one-day half-life
+            wp.lambda_.setdefault(m, 1 / (60 * 60 * 24))
+        wp.S.update(data["S"])
+        wp.F.update(data["F"])
+        wp.theta_S.update(data["theta_S"])
+        wp.theta_F.update(data["theta_F"])
+        wp.theta_0 = float(data["theta_0"])
+        wp.last_update_ts = float(data["last_update_ts"])
+        return wp
+
     # ----------------------------------------------------------
     # Private helpers
     # ----------------------------------------------------------
@@ -140,6 +215,53 @@ class WordPredictor:
         return random.random() < self.probability(now_ts, cur_ctx)
 
 
+_BUILTIN: Dict[str, object] = {
+    "lambda": dict(WordPredictor.DEFAULT_LAMBDA),
+    "theta_0": WordPredictor.THETA_0_PRIOR,
+    "learning_rate": WordPredictor.LEARNING_RATE,
+}
+
+
+# ----------------------------------------------------------------------
+# Parameter files
+# ----------------------------------------------------------------------
+
+_params_stamp: Dict[str, Optional[int]] = {}
+
+
+def load_params(path: str) -> Dict[str, object]:
+    """Read a parameter file written by ``train_predictor.py``."""
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def params_key() -> str:
+    """Return a fingerprint of the hyper-parameters in use.
+
+    States replayed under other parameters (e.g. checkpoints) are stale
+    once it changes.
+    """
+    return json.dumps(WordPredictor.params(), sort_keys=True)
+
+
+def use_params(path: str) -> bool:
+    """Configure :class:`WordPredictor` from *path* if the file changed.
+
+    Meant to be called often: it costs one ``stat`` while the file is
+    unchanged.  A missing file restores the built-in defaults.  Returns
+    True when the parameters were (re)loaded.
+    """
+    try:
+        stamp: Optional[int] = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        stamp = None
+    if path in _params_stamp and _params_stamp[path] == stamp:
+        return False
+    WordPredictor.configure(load_params(path) if stamp is not None else None)
+    _params_stamp[path] = stamp
+    return True
+
+
 # ----------------------------------------------------------------------
 # Stand-alone demo
 # ----------------------------------------------------------------------
@@ -1,19 +1,297 @@
 import glob
-from collections import Counter
 import argparse
+import codecs
+import hashlib
 import json
+import os
+import sqlite3
+from pathlib import Path
+from typing import Callable, Iterable, Optional
 
+import numpy as np
 
-def analyze_stories(pattern: str) -> tuple[int, list[tuple[str, int]]]:
+from db import connection
+from schema import ensure_migrated
+
+
+DEFAULT_DB_PATH = "chinese_words.db"
+DEFAULT_FREQUENCY_PATH = "frequency_list.tsv"
+PATTERNS = {
+    "stories": "stories/story*.txt",
+    "lessons": "lessons/Lesson*.txt",
+}
+CHUNK_BYTES = 1 << 20
+COVERAGE_TOPS = (100, 500, 1000, 2000)
+
+# every code point for which str.isspace() is true
+_WHITESPACE = np.array(
+    [c for c in range(0x3001) if chr(c).isspace()], dtype=np.uint32
+)
+
+
+def count_chunk(text: str) -> np.ndarray:
+    """Return per-code-point counts of the non-whitespace characters in *text*."""
+    cps = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+    cps = cps[~np.isin(cps, _WHITESPACE)]
+    return np.bincount(cps)
+
+
+def _merge(total: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    if len(counts) > len(total):
+        total, counts = counts, total
+    total = total.copy()
+    total[: len(counts)] += counts
+    return total
+
+
+def count_file(path: str) -> tuple[str, np.ndarray, np.ndarray]:
+    """Count the characters of *path*, reading it in ``CHUNK_BYTES`` pieces.
+
+    Returns the file's SHA-1 and the sorted code points that occur with
+    their counts.
+    """
+    digest = hashlib.sha1()
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    total = np.zeros(0, dtype=np.int64)
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(CHUNK_BYTES)
+            digest.update(data)
+            text = decoder.decode(data, final=not data)
+            if text:
+                total = _merge(total, count_chunk(text))
+            if not data:
+                break
+    cps = np.flatnonzero(total).astype(np.uint32)
+    return digest.hexdigest(), cps, total[cps]
+
+
+class CharacterCounter:
+    """Character counts of many files, recounting only files that changed.
+
+    Per-file counts are kept in the ``char_counts`` table of *db_path*
+    keyed by path and stamped with the file's mtime, size and SHA-1.  A
+    file whose mtime and size are unchanged is not read at all.  With
+    ``db_path=None`` only an in-process cache is used.
+
+    New counts are stored with ``write("char_counts", rows)``; the server
+    passes its ``run_write`` so request handlers never write themselves.
+    Without *write* they are stored in a ``BEGIN IMMEDIATE`` transaction.
+    """
+
+    def __init__(
+        self,
+        db_path: Optional[str] = DEFAULT_DB_PATH,
+        write: Optional[Callable[..., object]] = None,
+    ) -> None:
+        self.db_path = db_path
+        self._write = write or self._write_local
+        self._memory: dict[str, tuple[int, int, str, np.ndarray, np.ndarray]] = {}
+
+    def _write_local(self, op: str, rows: list) -> None:
+        with connection(self.db_path, immediate=True) as conn:
+            store_char_counts(conn, rows)
+
+    def _stored(self, conn: Optional[sqlite3.Connection], path: str):
+        entry = self._memory.get(path)
+        if entry is None and conn is not None:
+            row = conn.execute(
+                "SELECT mtime_ns, size, content_hash, codepoints, counts "
+                "FROM char_counts WHERE path = ?",
+                (path,),
+            ).fetchone()
+            if row:
+                entry = (
+                    row[0], row[1], row[2],
+                    np.frombuffer(row[3], dtype=np.uint32),
+                    np.frombuffer(row[4], dtype=np.int64),
+                )
+        return entry
+
+    def file_counts(self, paths: Iterable[str]) -> dict[str, tuple[np.ndarray, np.ndarray]]:
+        """Return ``{path: (codepoints, counts)}`` for *paths*."""
+        paths = list(paths)
+        result = {}
+        changed = []
+        if self.db_path:
+            with connection(self.db_path) as conn:
+                stored = {path: self._stored(conn, path) for path in paths}
+        else:
+            stored = {path: self._memory.get(path) for path in paths}
+        for path in paths:
+            st = os.stat(path)
+            entry = stored[path]
+            if entry is None or (entry[0], entry[1]) != (st.st_mtime_ns, st.st_size):
+                digest, cps, counts = count_file(path)
+                entry = (st.st_mtime_ns, st.st_size, digest, cps, counts)
+                # plain lists, so the rows can be sent to the writer process
+                changed.append([path, *entry[:3], cps.tolist(), counts.tolist()])
+            self._memory[path] = entry
+            result[path] = (entry[3], entry[4])
+        if changed and self.db_path:
+            self._write("char_counts", changed)
+        return result
+
+    def counts(self, paths: Iterable[str]) -> tuple[np.ndarray, np.ndarray]:
+        """Return the summed ``(codepoints, counts)`` of *paths*, most frequent first.
+
+        Characters with equal counts are ordered by code point.
+        """
+        per_file = list(self.file_counts(paths).values())
+        if not per_file:
+            return np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.int64)
+        cps = np.concatenate([c for c, _ in per_file])
+        counts = np.concatenate([n for _, n in per_file])
+        uniq, inverse = np.unique(cps, return_inverse=True)
+        summed = np.bincount(inverse, weights=counts).astype(np.int64)
+        order = np.lexsort((uniq, -summed))
+        return uniq[order], summed[order]
+
+
+def store_char_counts(conn: sqlite3.Connection, rows: list) -> None:
+    """Store ``[path, mtime_ns, size, content_hash, codepoints, counts]`` rows."""
+    conn.executemany(
+        "INSERT OR REPLACE INTO char_counts"
+        "(path, mtime_ns, size, content_hash, codepoints, counts) "
+        "VALUES (?,?,?,?,?,?)",
+        [
+            (
+                path, mtime_ns, size, digest,
+                np.asarray(cps, dtype=np.uint32).tobytes(),
+                np.asarray(counts, dtype=np.int64).tobytes(),
+            )
+            for path, mtime_ns, size, digest, cps, counts in rows
+        ],
+    )
+
+
+_ranks_cache: dict[str, tuple[int, dict[str, int]]] = {}
+
+
+def general_character_ranks(frequency_path: str = DEFAULT_FREQUENCY_PATH) -> dict[str, int]:
+    """Rank characters by their summed count over the words of *frequency_path*.
+
+    The ranking is cached until the file's mtime changes.
+    """
+    mtime = os.stat(frequency_path).st_mtime_ns
+    cached = _ranks_cache.get(frequency_path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    totals: dict[str, int] = {}
+    with open(frequency_path, "r", encoding="utf-8") as f:
+        for line in f:
+            parts = line.rstrip("\n").split("\t")
+            if len(parts) < 3:
+                continue
+            try:
+                count = int(parts[2])
+            except ValueError:
+                continue
+            for ch in parts[1]:
+                totals[ch] = totals.get(ch, 0) + count
+    ranked = sorted(totals, key=lambda ch: (-totals[ch], ch))
+    ranks = {ch: rank for rank, ch in enumerate(ranked, start=1)}
+    _ranks_cache[frequency_path] = (mtime, ranks)
+    return ranks
+
+
+def coverage(
+    sorted_counts: list[tuple[str, int]],
+    ranks: dict[str, int],
+    tops: Iterable[int] = COVERAGE_TOPS,
+) -> dict:
+    """Compare text character counts with the general character ranking.
+
+    For every *top* it reports which share of the *top* most frequent
+    general characters occur in the texts (``general``) and which share of
+    the texts' characters are among them (``text``).  ``in_general_list``
+    is the share of the texts' characters that occur in the general list
+    at all.  All values are percentages.
+    """
+    total = sum(count for _, count in sorted_counts) or 1
+    rank = np.array([ranks.get(ch, 0) for ch, _ in sorted_counts], dtype=np.int64)
+    counts = np.array([count for _, count in sorted_counts], dtype=np.int64)
+    listed = rank > 0
+    result = []
+    for top in tops:
+        within = listed & (rank <= top)
+        result.append(
+            {
+                "top": top,
+                "general": int(within.sum()) / min(top, len(ranks) or 1) * 100,
+                "text": int(counts[within].sum()) / total * 100,
+            }
+        )
+    return {
+        "in_general_list": int(counts[listed].sum()) / total * 100,
+        "top": result,
+    }
+
+
+def _initialised(db_path: str) -> bool:
+    """Return whether *db_path* is a words database made by ``import_words.py``.
+
+    Opened read-only, so a missing file is not created.
+    """
+    if not os.path.isfile(db_path):
+        return False
+    try:
+        conn = sqlite3.connect(Path(db_path).resolve().as_uri() + "?mode=ro", uri=True)
+    except sqlite3.Error:
+        return False
+    try:
+        return conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'word_interactions'"
+        ).fetchone() is not None
+    except sqlite3.Error:
+        return False
+    finally:
+        conn.close()
+
+
+def analyze_stories(
+    pattern: str, db_path: Optional[str] = DEFAULT_DB_PATH
+) -> tuple[int, list[tuple[str, int]]]:
+    """Count the non-whitespace characters of all files matching *pattern*.
+
+    Unchanged files are served from the ``char_counts`` cache in *db_path*
+    (no persistent cache when it is None or not an imported database).
+    """
     files = sorted(glob.glob(pattern))
-    counter = Counter()
-    for path in files:
-        with open(path, 'r', encoding='utf-8') as f:
-            for ch in f.read():
-                if not ch.isspace():
-                    counter[ch] += 1
-    total = sum(counter.values())
-    return total, counter.most_common()
+    if db_path and not _initialised(db_path):
+        db_path = None
+    if db_path:
+        ensure_migrated(db_path)
+    cps, counts = CharacterCounter(db_path).counts(files)
+    total = int(counts.sum())
+    return total, [(chr(c), int(n)) for c, n in zip(cps.tolist(), counts.tolist())]
+
+
+def character_report(
+    total: int,
+    sorted_counts: list[tuple[str, int]],
+    frequency_path: Optional[str] = DEFAULT_FREQUENCY_PATH,
+    top: Optional[int] = None,
+) -> dict:
+    """Build the JSON statistics, with coverage when *frequency_path* is given.
+
+    *top* limits the per-character entries; coverage always uses all.
+    """
+    data = {
+        "total": total,
+        "unique": len(sorted_counts),
+        "stats": [
+            {
+                "character": ch,
+                "count": count,
+                "frequency": count / total * 100,
+            }
+            for ch, count in sorted_counts[:top]
+        ],
+    }
+    if frequency_path:
+        data["coverage"] = coverage(sorted_counts, general_character_ranks(frequency_path))
+    return data
 
 
 def print_stats(total: int, sorted_counts: list[tuple[str, int]], top: int) -> None:
@@ -28,35 +306,48 @@ def print_stats(total: int, sorted_counts: list[tuple[str, int]], top: int) -> N
         print(f"{ch:^10} {count:>10} {freq:>9.2f}%")
 
 
-def write_json(total: int, sorted_counts: list[tuple[str, int]], path: str) -> None:
-    data = {
-        "total": total,
-        "stats": [
-            {
-                "character": ch,
-                "count": count,
-                "frequency": count / total * 100,
-            }
-            for ch, count in sorted_counts
-        ],
-    }
+def print_coverage(cov: dict) -> None:
+    print(f"\nCharacters found in the general list: {cov['in_general_list']:.2f}%")
+    header = f"{'Top':>6} {'General seen':>13} {'Text share':>11}"
+    print(header)
+    print('-' * len(header))
+    for row in cov["top"]:
+        print(f"{row['top']:>6} {row['general']:>12.2f}% {row['text']:>10.2f}%")
+
+
+def write_json(
+    total: int,
+    sorted_counts: list[tuple[str, int]],
+    path: str,
+    frequency_path: Optional[str] = None,
+) -> None:
+    data = character_report(total, sorted_counts, frequency_path)
     with open(path, "w", encoding="utf-8") as f:
         json.dump(data, f, ensure_ascii=False, indent=2)
 
 
 def main() -> None:
     parser = argparse.ArgumentParser(description="Analyze story character frequencies")
-    parser.add_argument('-p', '--pattern', default='stories/story*.txt',
+    parser.add_argument('-p', '--pattern', default=PATTERNS["stories"],
                         help='Glob pattern for story files')
+    parser.add_argument('--lessons', action='store_true',
+                        help=f'Analyze the lessons ({PATTERNS["lessons"]})')
     parser.add_argument('-t', '--top', type=int, default=10,
                         help='Number of top characters to display')
     parser.add_argument('-j', '--json', help='Write full statistics to JSON file')
+    parser.add_argument('-f', '--frequency', default=DEFAULT_FREQUENCY_PATH,
+                        help='General frequency list for coverage ("" to skip)')
+    parser.add_argument('--db', default=DEFAULT_DB_PATH,
+                        help='Database caching per-file counts ("" for none)')
     args = parser.parse_args()
 
-    total, counts = analyze_stories(args.pattern)
+    pattern = PATTERNS["lessons"] if args.lessons else args.pattern
+    total, counts = analyze_stories(pattern, args.db or None)
     print_stats(total, counts, args.top)
+    if args.frequency:
+        print_coverage(coverage(counts, general_character_ranks(args.frequency)))
     if args.json:
-        write_json(total, counts, args.json)
+        write_json(total, counts, args.json, args.frequency or None)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,399 @@
+# Vectorised replay of WordPredictor over the whole interaction log.
+
+from __future__ import annotations
+
+import json
+import sqlite3
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from algo import WordPredictor, params_key
+
+
+# ----------------------------------------------------------------------
+# Columnar interaction log
+# ----------------------------------------------------------------------
+
+def iter_log(conn: sqlite3.Connection,
+             where: str = "",
+             params: Sequence[object] = ()) -> Iterator[Tuple[str, str, Optional[int], float, int]]:
+    """Yield ``(simplified, interaction, known, timestamp, count)`` history rows.
+
+    The history is ``interaction_rollup`` (compacted events, *count* each)
+    followed in time by the raw ``word_interactions`` rows (count 1), per
+    word in replay order.  *where* is an optional ``WHERE`` clause on
+    these columns (and ``src``, 0 for rollup rows); the rows are named
+    ``log``.
+    """
+    has_rollup = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'interaction_rollup'"
+    ).fetchone()
+    rollup = (
+        "SELECT simplified, interaction, known, timestamp, count, 0 AS src, rowid AS id "
+        "FROM interaction_rollup UNION ALL " if has_rollup else ""
+    )
+    return conn.execute(
+        "SELECT simplified, interaction, known, timestamp, count FROM ("
+        f"{rollup}SELECT simplified, interaction, known, timestamp, 1 AS count, 1 AS src, id "
+        f"FROM word_interactions) AS log {where} "
+        "ORDER BY simplified, timestamp, src, id",
+        params,
+    )
+
+
+class InteractionLog:
+    """The ``word_interactions`` table as parallel NumPy arrays.
+
+    ``words[i]`` is the word with id ``i`` and ``modes[j]`` the mode with
+    id ``j``; every event is described by one entry of ``word_idx``,
+    ``mode_idx``, ``outcome`` and ``timestamp``.  The mode of an
+    interaction is the part of its name before the first underscore, as
+    in ``/recalculate`` (``read_known`` → ``read``).
+    """
+
+    def __init__(self,
+                 words: List[str],
+                 modes: List[str],
+                 word_idx: np.ndarray,
+                 mode_idx: np.ndarray,
+                 outcome: np.ndarray,
+                 timestamp: np.ndarray) -> None:
+        self.words = words
+        self.modes = modes
+        self.word_idx = word_idx
+        self.mode_idx = mode_idx
+        self.outcome = outcome
+        self.timestamp = timestamp
+
+    def __len__(self) -> int:
+        return len(self.word_idx)
+
+    @classmethod
+    def from_rows(cls,
+                  rows: Iterable[Tuple],
+                  modes: Optional[List[str]] = None,
+                  words: Optional[List[str]] = None) -> "InteractionLog":
+        """Build a log from ``(simplified, interaction, known, timestamp)`` rows.
+
+        A fifth ``count`` column, as yielded by :func:`iter_log`, repeats
+        the event that many times.  Events keep their relative order,
+        which decides how events with equal timestamps are replayed.
+        Modes not listed in *modes* and words not listed in *words* are
+        appended in order of first appearance.
+        """
+        modes = list(modes) if modes else list(WordPredictor().modes)
+        word_ids: Dict[str, int] = {w: i for i, w in enumerate(words or [])}
+        mode_ids: Dict[str, int] = {m: i for i, m in enumerate(modes)}
+        w_col: List[int] = []
+        m_col: List[int] = []
+        o_col: List[int] = []
+        t_col: List[float] = []
+        n_col: List[int] = []
+        for word, interaction, known, ts, *count in rows:
+            wid = word_ids.get(word)
+            if wid is None:
+                wid = word_ids[word] = len(word_ids)
+            mode = interaction.split("_")[0]
+            mid = mode_ids.get(mode)
+            if mid is None:
+                mid = mode_ids[mode] = len(modes)
+                modes.append(mode)
+            w_col.append(wid)
+            m_col.append(mid)
+            o_col.append(int(known or 0))
+            t_col.append(ts)
+            n_col.append(count[0] if count else 1)
+        repeat = np.array(n_col, dtype=np.int64)
+        return cls(
+            list(word_ids),
+            modes,
+            np.repeat(np.array(w_col, dtype=np.int64), repeat),
+            np.repeat(np.array(m_col, dtype=np.int64), repeat),
+            np.repeat(np.array(o_col, dtype=np.float64), repeat),
+            np.repeat(np.array(t_col, dtype=np.float64), repeat),
+        )
+
+    @classmethod
+    def from_db(cls, conn: sqlite3.Connection) -> "InteractionLog":
+        """Load the whole history: rolled-up and raw interactions."""
+        return cls.from_rows(iter_log(conn))
+
+
+def replay_history(conn: sqlite3.Connection,
+                   where: str = "",
+                   params: Sequence[object] = (),
+                   until: Optional[float] = None,
+                   ) -> Tuple[List[str], "BatchPredictor", Dict[str, Dict[str, object]]]:
+    """Replay the history of the words selected by *where* and return their predictors.
+
+    *where* is a ``WHERE`` clause on ``simplified`` only.  A word with a
+    ``predictor_checkpoint`` made with the current hyper-parameters
+    starts from it and replays only the raw events from its horizon on,
+    so the cost follows the raw tail rather than the whole history.  For
+    a checkpoint made with other parameters the rolled-up history is
+    replayed and the checkpoint recomputed on the way; those states are
+    returned, so callers that may write can store them.  With *until*
+    only events before that time are replayed.
+    """
+    key = params_key()
+    checkpoints = conn.execute(
+        f"SELECT simplified, state, horizon, params FROM predictor_checkpoint {where}", params
+    ).fetchall()
+    valid = {word: json.loads(state) for word, state, _, p in checkpoints if p == key}
+    stale = {word: horizon for word, _, horizon, p in checkpoints if p != key}
+    conds = [
+        "NOT EXISTS (SELECT 1 FROM predictor_checkpoint AS c WHERE c.simplified = log.simplified "
+        "AND c.params = ? AND c.horizon > log.timestamp)"
+    ]
+    args = [*params, key]
+    if until is not None:
+        conds.append("timestamp < ?")
+        args.append(until)
+    clause = " AND ".join(conds)
+    rows = iter_log(conn, f"{where} AND {clause}" if where else f"WHERE {clause}", args).fetchall()
+
+    words = list(dict.fromkeys([*valid, *(r[0] for r in rows)]))
+    modes = list(dict.fromkeys(
+        [*WordPredictor().modes, *(m for st in valid.values() for m in st["modes"])]
+    ))
+    before = [r for r in rows if r[3] < stale.get(r[0], -np.inf)]
+    after = [r for r in rows if not r[3] < stale.get(r[0], -np.inf)]
+    head = InteractionLog.from_rows(before, modes, words)
+    tail = InteractionLog.from_rows(after, head.modes, words)
+    bp = BatchPredictor(tail.modes, n_words=len(words))
+    for i, word in enumerate(words):
+        if word in valid:
+            bp.set_state(i, valid[word])
+    bp.replay(head.word_idx, head.mode_idx, head.outcome, head.timestamp)
+    refreshed = {
+        word: bp.predictor(i).to_dict()
+        for i, word in enumerate(words)
+        if word in stale and (until is None or stale[word] <= until)
+    }
+    bp.replay(tail.word_idx, tail.mode_idx, tail.outcome, tail.timestamp)
+    return words, bp, refreshed
+
+
+def current_states(conn: sqlite3.Connection) -> Tuple[Dict[str, Dict[str, object]], List[str]]:
+    """Return the ``WordPredictor.to_dict`` state of every practised word.
+
+    States come from ``predictor_state``; words with history but no
+    stored state (e.g. logged before the table existed) are replayed with
+    :func:`replay_history`.  Also returns those replayed words, so
+    callers that may write can store their states.
+    """
+    states = {
+        word: json.loads(state)
+        for word, state in conn.execute("SELECT simplified, state FROM predictor_state")
+    }
+    words, bp, _ = replay_history(
+        conn, "WHERE simplified NOT IN (SELECT simplified FROM predictor_state)"
+    )
+    for i, word in enumerate(words):
+        states[word] = bp.predictor(i).to_dict()
+    return states, words
+
+
+# ----------------------------------------------------------------------
+# Batch predictor
+# ----------------------------------------------------------------------
+
+class BatchPredictor:
+    """Run :class:`WordPredictor` for every word of a log at once.
+
+    State mirrors the attributes of ``WordPredictor`` with a leading word
+    axis: ``S``/``F``/``theta_S``/``theta_F`` have shape
+    ``(n_words, n_modes)`` and ``theta_0``/``last_update_ts`` shape
+    ``(n_words,)``.  Words are replayed in lock-step, one event per word
+    per step, so the Python loop runs once per event of the busiest word
+    rather than once per event.
+    """
+
+    def __init__(self,
+                 modes: List[str],
+                 lambdas: Optional[Dict[str, float]] = None,
+                 n_words: int = 0) -> None:
+        self.modes = list(modes)
+        lam = dict(WordPredictor.DEFAULT_LAMBDA)
+        if lambdas:
+            lam.update(lambdas)
+        # modes unknown to WordPredictor decay with a one-day half-life
+        self.lambda_ = np.array(
+            [lam.get(m, 1 / (60 * 60 * 24)) for m in self.modes], dtype=np.float64
+        )
+        self.learning_rate = WordPredictor.LEARNING_RATE
+        self.reset(n_words)
+
+    @classmethod
+    def from_log(cls,
+                 log: InteractionLog,
+                 lambdas: Optional[Dict[str, float]] = None) -> "BatchPredictor":
+        """Return a predictor that has replayed every event of *log*."""
+        bp = cls(log.modes, lambdas, len(log.words))
+        bp.replay(log.word_idx, log.mode_idx, log.outcome, log.timestamp)
+        return bp
+
+    @classmethod
+    def from_states(cls,
+                    states: Iterable[Dict[str, object]],
+                    lambdas: Optional[Dict[str, float]] = None) -> "BatchPredictor":
+        """Load one predictor per state saved with ``WordPredictor.to_dict``.
+
+        The modes are the union of the states' modes; a word without a
+        mode has zero tallies for it.
+        """
+        states = list(states)
+        modes: Dict[str, int] = {}
+        for st in states:
+            for m in st["modes"]:
+                modes.setdefault(m, len(modes))
+        bp = cls(list(modes), lambdas, len(states))
+        for i, st in enumerate(states):
+            bp.set_state(i, st)
+        return bp
+
+    def set_state(self, i: int, state: Dict[str, object]) -> None:
+        """Load a state saved with ``WordPredictor.to_dict`` into word *i*.
+
+        Every mode of *state* must be one of ``modes``.
+        """
+        for m in state["modes"]:
+            j = self.modes.index(m)
+            self.S[i, j] = state["S"].get(m, 0.0)
+            self.F[i, j] = state["F"].get(m, 0.0)
+            self.theta_S[i, j] = state["theta_S"][m]
+            self.theta_F[i, j] = state["theta_F"][m]
+        self.theta_0[i] = state["theta_0"]
+        self.last_update_ts[i] = state["last_update_ts"]
+
+    def reset(self, n_words: int) -> None:
+        """Start *n_words* fresh predictors with the ``WordPredictor`` prior."""
+        n_modes = len(self.modes)
+        self.S = np.zeros((n_words, n_modes))
+        self.F = np.zeros((n_words, n_modes))
+        wp = WordPredictor
+        self.theta_S = np.tile(
+            [wp.THETA_S_PRIOR.get(m, wp.THETA) for m in self.modes], (n_words, 1))
+        self.theta_F = np.tile(
+            [wp.THETA_F_PRIOR.get(m, wp.THETA) for m in self.modes], (n_words, 1))
+        self.theta_0 = np.full(n_words, wp.THETA_0_PRIOR)
+        self.last_update_ts = np.zeros(n_words)
+
+    # ----------------------------------------------------------
+    # Public API
+    # ----------------------------------------------------------
+
+    def replay(self,
+               word_idx: np.ndarray,
+               mode_idx: np.ndarray,
+               outcome: np.ndarray,
+               timestamp: np.ndarray) -> None:
+        """Apply a batch of events, like calling ``update`` for each one.
+
+        Events of one word are applied in timestamp order; events with
+        equal timestamps keep the order they have in the input.
+        """
+        if len(word_idx) == 0:
+            return
+        order = np.lexsort((np.arange(len(word_idx)), timestamp, word_idx))
+        word_idx = word_idx[order]
+        mode_idx = mode_idx[order]
+        outcome = outcome[order]
+        timestamp = timestamp[order]
+
+        n_words = len(self.theta_0)
+        counts = np.bincount(word_idx, minlength=n_words)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+        # busiest words first: at step k the active words are a prefix
+        perm = np.argsort(-counts, kind="stable")
+        counts_p = counts[perm]
+        starts_p = starts[perm]
+        S, F = self.S[perm], self.F[perm]
+        theta_S, theta_F = self.theta_S[perm], self.theta_F[perm]
+        theta_0, last = self.theta_0[perm], self.last_update_ts[perm]
+
+        lam = self.lambda_
+        lr = self.learning_rate
+        rows = np.arange(n_words)
+        # number of words with more than k events, for every k
+        n_active = np.searchsorted(-counts_p, -np.arange(counts_p[0]), side="left")
+        n_active = n_active.tolist()
+
+        with np.errstate(over="ignore"):
+            for k in range(int(counts_p[0])):
+                n = n_active[k]
+                ev = starts_p[:n] + k
+                ts = timestamp[ev]
+                out = outcome[ev]
+                m = mode_idx[ev]
+                r = rows[:n]
+                s, f = S[:n], F[:n]
+
+                # 1) decay tallies up to the event
+                dt = ts - last[:n]
+                fwd = dt > 0
+                factor = np.exp(-lam * np.where(fwd, dt, 0.0)[:, None])
+                s *= factor
+                f *= factor
+                last[:n] = np.where(fwd, ts, last[:n])
+
+                # 2) count the outcome
+                hit = out == 1
+                s[r, m] += hit
+                f[r, m] += ~hit
+
+                # 3) prediction before update, 4) SGD step
+                logit = (theta_0[:n]
+                         + (theta_S[:n] * s).sum(axis=1)
+                         - (theta_F[:n] * f).sum(axis=1))
+                error = out - 1.0 / (1.0 + np.exp(-logit))
+                theta_0[:n] += lr * error
+                theta_S[:n] += lr * error[:, None] * s
+                theta_F[:n] -= lr * error[:, None] * f
+
+        inv = np.empty_like(perm)
+        inv[perm] = rows
+        self.S, self.F = S[inv], F[inv]
+        self.theta_S, self.theta_F = theta_S[inv], theta_F[inv]
+        self.theta_0, self.last_update_ts = theta_0[inv], last[inv]
+
+    def probability(self, now_ts: float) -> np.ndarray:
+        """Return recall probabilities of all words at *now_ts*.
+
+        Unlike ``WordPredictor.probability`` the stored tallies are not
+        decayed in place.
+        """
+        return self.forecast([now_ts])[:, 0]
+
+    def forecast(self, times: Sequence[float]) -> np.ndarray:
+        """Return recall probabilities of all words at each of *times*.
+
+        The result has shape ``(n_words, len(times))``.  Tallies decay in
+        closed form, ``S * exp(-lambda * dt)``, so every word and time is
+        one array expression and the state is left untouched.  Times
+        before a word's last update give its probability at that update.
+        """
+        times = np.asarray(times, dtype=np.float64)
+        dt = np.maximum(times[None, :] - self.last_update_ts[:, None], 0.0)
+        # per-mode weight of the (decaying) tallies in the logit
+        weight = self.theta_S * self.S - self.theta_F * self.F
+        logit = np.repeat(self.theta_0[:, None], len(times), axis=1)
+        for j, lam in enumerate(self.lambda_.tolist()):
+            logit += weight[:, j, None] * np.exp(-lam * dt)
+        with np.errstate(over="ignore"):
+            return 1.0 / (1.0 + np.exp(-logit))
+
+    def predictor(self, i: int) -> WordPredictor:
+        """Return a ``WordPredictor`` holding the state of word *i*."""
+        wp = WordPredictor(modes=list(self.modes),
+                           lambdas=dict(zip(self.modes, self.lambda_.tolist())))
+        for j, m in enumerate(self.modes):
+            wp.S[m] = float(self.S[i, j])
+            wp.F[m] = float(self.F[i, j])
+            wp.theta_S[m] = float(self.theta_S[i, j])
+            wp.theta_F[m] = float(self.theta_F[i, j])
+        wp.theta_0 = float(self.theta_0[i])
+        wp.last_update_ts = float(self.last_update_ts[i])
+        return wp
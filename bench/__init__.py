@@ -0,0 +1,7 @@
+"""Reproducible benchmarks for the segmentation, ingestion and server hot paths.
+
+Run ``python -m bench run`` from the repository root to build a synthetic
+corpus and interaction log in a temporary directory, time every hot path and
+write a JSON report.  ``python -m bench compare old.json new.json`` reports
+regressions between two runs.
+"""
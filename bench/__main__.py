@@ -0,0 +1,213 @@
+"""Command line entry point: ``python -m bench run|compare``."""
+
+from __future__ import annotations
+
+import argparse
+import json
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from bench.synthetic import (
+    generate_stories,
+    load_interactions,
+    prepare_database,
+    simulate_learner,
+)
+from search_words import Segmenter, contains_chinese, segment_text
+
+
+def timeit(
+    fn: Callable[[], object],
+    repeat: int,
+    warmup: int = 1,
+    check: Callable[[object], None] | None = None,
+) -> Dict[str, float]:
+    """Run *fn* and summarise the wall time of each run in milliseconds.
+
+    *check* is called with the result of every warm-up run and should
+    raise when the case did not do its work, so failures are not timed.
+    """
+    for _ in range(max(warmup, 1 if check else 0)):
+        result = fn()
+        if check is not None:
+            check(result)
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        runs.append((time.perf_counter() - start) * 1000)
+    return {
+        "runs": repeat,
+        "min_ms": min(runs),
+        "median_ms": statistics.median(runs),
+        "mean_ms": statistics.fmean(runs),
+    }
+
+
+def expect_ok(response) -> None:
+    """Raise unless *response* is a successful reply of the server."""
+    if response.status_code != 200:
+        raise RuntimeError(f"{response.request.path} returned {response.status}")
+    body = response.get_json(silent=True)
+    if isinstance(body, dict) and body.get("status") == "error":
+        raise RuntimeError(f"{response.request.path} failed: {body.get('msg')}")
+
+
+def _git_commit() -> str | None:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip()
+
+
+def run(args: argparse.Namespace, workdir: Path) -> dict:
+    """Build the synthetic data set in *workdir* and time every case."""
+    import server
+    from token_cache import TokenCache
+
+    rng = random.Random(args.seed)
+    db_path = str(workdir / "bench.db")
+    stories_dir = workdir / "stories"
+
+    setup = time.perf_counter()
+    words = prepare_database(args.db, db_path)
+    names = generate_stories(words, stories_dir, args.stories, args.story_tokens, rng)
+    events = load_interactions(
+        db_path, simulate_learner(words, args.events, rng, start_ts=time.time() - 365 * 86400)
+    )
+    setup_s = time.perf_counter() - setup
+
+    # point the server at the synthetic data
+    server.DB_PATH = db_path
+    server.STORIES_DIR = stories_dir
+    server._token_cache = TokenCache(stories_dir, db_path)
+    server._lesson_cache = TokenCache(workdir / "lessons", db_path, pattern="Lesson*.txt", prefix="lessons/")
+    client = server.app.test_client()
+
+    texts = [(stories_dir / f"{n}.txt").read_text(encoding="utf-8") for n in names]
+    segmenter = Segmenter(words)
+    story = names[0]
+    story_words = [t for t in segmenter.segment(texts[0]) if contains_chinese(t)]
+
+    def read(response):
+        response.get_data()  # time the whole body, not just the headers
+        return response
+
+    def get(url: str) -> Callable[[], object]:
+        return lambda: read(client.get(url))
+
+    # errors here abort the run instead of being timed as fast responses
+    expect_ok(client.post("/recalculate"))
+    expect_ok(client.get("/next_word?restart=1"))
+    cases: Dict[str, Callable[[], object]] = {
+        "segmenter_compile": lambda: Segmenter(words),
+        "segment_text": lambda: [segment_text(t, segmenter) for t in texts],
+        "update_user_progress": lambda: server.update_user_progress(story_words, [], db_path),
+        "recalculate": lambda: read(client.post("/recalculate")),
+        "next_word": get("/next_word"),
+        "next_word_restart": get("/next_word?restart=1"),
+        "unknown_words": get(f"/unknown_words/{story}"),
+        "stats_data": get("/stats_data"),
+    }
+    requests = {"recalculate", "next_word", "next_word_restart", "unknown_words", "stats_data"}
+    only = set(args.only or cases)
+    results = {
+        name: timeit(fn, args.repeat, check=expect_ok if name in requests else None)
+        for name, fn in cases.items()
+        if name in only
+    }
+    return {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "seed": args.seed,
+            "vocabulary": len(words),
+            "stories": args.stories,
+            "story_tokens": args.story_tokens,
+            "events": events,
+            "setup_s": setup_s,
+        },
+        "results": results,
+    }
+
+
+def compare(old: dict, new: dict, threshold: float) -> List[str]:
+    """Print per-case ratios and return the names that got slower."""
+    regressions = []
+    print(f"{'case':<22} {'old ms':>10} {'new ms':>10} {'ratio':>7}")
+    for name, new_res in new["results"].items():
+        old_res = old["results"].get(name)
+        if not old_res:
+            print(f"{name:<22} {'-':>10} {new_res['median_ms']:>10.2f} {'new':>7}")
+            continue
+        ratio = new_res["median_ms"] / max(old_res["median_ms"], 1e-9)
+        flag = ""
+        if ratio > 1 + threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<22} {old_res['median_ms']:>10.2f} {new_res['median_ms']:>10.2f} {ratio:>6.2f}x{flag}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m bench", description=__doc__)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_run = sub.add_parser("run", help="Build synthetic data and time the hot paths")
+    p_run.add_argument("--db", default="chinese_words.db", help="Source of the vocabulary")
+    p_run.add_argument("-o", "--out", default="bench_report.json", help="JSON report path")
+    p_run.add_argument("--seed", type=int, default=1, help="Random seed")
+    p_run.add_argument("--stories", type=int, default=50, help="Number of synthetic stories")
+    p_run.add_argument("--story-tokens", type=int, default=2000, help="Words per story")
+    p_run.add_argument("--events", type=int, default=200_000, help="Simulated interactions")
+    p_run.add_argument("--repeat", type=int, default=5, help="Timed runs per case")
+    p_run.add_argument("--only", nargs="*", help="Run only these cases")
+    p_run.add_argument("--keep", action="store_true", help="Keep the synthetic data directory")
+
+    p_cmp = sub.add_parser("compare", help="Compare two JSON reports")
+    p_cmp.add_argument("old")
+    p_cmp.add_argument("new")
+    p_cmp.add_argument("--threshold", type=float, default=0.2,
+                       help="Relative slow-down reported as a regression")
+
+    args = parser.parse_args()
+    if args.cmd == "run":
+        workdir = Path(tempfile.mkdtemp(prefix="chinese-bench-"))
+        try:
+            report = run(args, workdir)
+        finally:
+            if args.keep:
+                print(f"Synthetic data kept in {workdir}")
+            else:
+                shutil.rmtree(workdir, ignore_errors=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        for name, res in report["results"].items():
+            print(f"{name:<22} {res['median_ms']:>10.2f} ms")
+        print(f"Wrote {args.out}")
+    else:
+        with open(args.old, encoding="utf-8") as f:
+            old = json.load(f)
+        with open(args.new, encoding="utf-8") as f:
+            new = json.load(f)
+        if compare(old, new, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Synthetic stories and interaction logs built from the real vocabulary."""
+
+from __future__ import annotations
+
+import random
+import sqlite3
+from pathlib import Path
+from typing import Iterator, List, Tuple
+
+from algo import WordPredictor
+from schema import migrate
+
+
+# tables whose rows are derived from the interaction log or the texts
+DERIVED_TABLES = (
+    "word_interactions",
+    "interaction_rollup",
+    "word_stats",
+    "predictor_state",
+    "predictor_checkpoint",
+    "story_tokens",
+    "story_vocab",
+    "flashcard_queue",
+)
+
+
+def zipf_weights(n: int, s: float = 1.0) -> List[float]:
+    """Return Zipf weights for ranks ``1..n``."""
+    return [1.0 / (rank ** s) for rank in range(1, n + 1)]
+
+
+def prepare_database(source_db: str, target_db: str) -> List[str]:
+    """Copy *source_db* to *target_db* without any learner history.
+
+    The vocabulary is kept, every derived table is emptied and all
+    probabilities are reset.  Returns the vocabulary ordered by rowid,
+    which serves as the frequency rank.
+    """
+    with sqlite3.connect(source_db) as src, sqlite3.connect(target_db) as dst:
+        src.backup(dst)
+    with sqlite3.connect(target_db) as conn:
+        migrate(conn)
+        tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        for table in DERIVED_TABLES:
+            if table in tables:
+                conn.execute(f"DELETE FROM {table}")
+        conn.execute("UPDATE user_words SET known_probability = 0.0, number_in_texts = 0")
+        words = [r[0] for r in conn.execute("SELECT simplified FROM words ORDER BY rowid")]
+    return words
+
+
+def generate_stories(
+    words: List[str],
+    out_dir: Path,
+    count: int,
+    tokens_per_story: int,
+    rng: random.Random,
+) -> List[str]:
+    """Write *count* stories of Zipf-distributed words and return their names."""
+    out_dir.mkdir(parents=True, exist_ok=True)
+    weights = zipf_weights(len(words))
+    names = []
+    for i in range(1, count + 1):
+        picks = rng.choices(words, weights=weights, k=tokens_per_story)
+        parts = []
+        for j, word in enumerate(picks, start=1):
+            parts.append(word)
+            if j % 12 == 0:
+                parts.append("。\n" if j % 60 == 0 else "，")
+        name = f"story{i}"
+        (out_dir / f"{name}.txt").write_text("".join(parts) + "。\n", encoding="utf-8")
+        names.append(name)
+    return names
+
+
+def simulate_learner(
+    words: List[str],
+    events: int,
+    rng: random.Random,
+    start_ts: float,
+    days: float = 365.0,
+) -> Iterator[Tuple[str, str, int, int]]:
+    """Yield ``(word, interaction, known, timestamp)`` rows of one learner.
+
+    Each practised word has its own ``WordPredictor`` acting as the
+    learner's memory: the outcome of every encounter is drawn with
+    ``recall`` and then fed back with ``update``.  Words are met with Zipf
+    frequencies, mostly while reading and sometimes as flashcards.
+    """
+    # WordPredictor.recall draws from the global random module
+    random.seed(rng.getrandbits(64))
+    weights = zipf_weights(len(words))
+    memory: dict[str, WordPredictor] = {}
+    step = days * 24 * 3600 / max(events, 1)
+    ts = start_ts
+    batch = 1024
+    emitted = 0
+    while emitted < events:
+        for word in rng.choices(words, weights=weights, k=min(batch, events - emitted)):
+            ts += rng.expovariate(1.0 / step)
+            wp = memory.get(word)
+            if wp is None:
+                wp = memory[word] = WordPredictor()
+            known = 1 if wp.recall(ts) else 0
+            if rng.random() < 0.1:
+                mode, interaction = "flashcard", "flashcard"
+            else:
+                mode, interaction = "read", "read_known" if known else "read_unknown"
+            wp.update(mode, known, ts)
+            emitted += 1
+            yield word, interaction, known, int(ts)
+
+
+def load_interactions(db_path: str, rows: Iterator[Tuple[str, str, int, int]]) -> int:
+    """Bulk insert simulated rows into ``word_interactions``."""
+    with sqlite3.connect(db_path) as conn:
+        cur = conn.executemany(
+            "INSERT INTO word_interactions(simplified, interaction, known, timestamp) "
+            "VALUES (?,?,?,?)",
+            rows,
+        )
+        return cur.rowcount
@@ -0,0 +1,218 @@
+"""Roll old interactions up into per-word, per-bucket aggregates.
+
+Every word a story contains is logged once per occurrence, so
+``word_interactions`` grows by thousands of rows per text read.  This
+job moves events older than ``--keep-days`` into ``interaction_rollup``:
+one row per word, interaction, outcome and time bucket holding the number
+of events and their mean timestamp.  Recent events stay raw.
+
+Each compacted word gets a ``predictor_checkpoint``: its predictor
+replayed exactly up to the horizon.  Later replays start there and only
+apply the raw events, so their cost does not grow with the history.
+The rollup itself is only replayed after the hyper-parameters change;
+a rollup row then repeats its event *count* times at the mean
+timestamp, which is exact when the events shared a timestamp (one
+reading session) and an approximation otherwise.  Before anything is
+written, the history of every affected word is replayed both ways with
+:class:`~batch_predictor.BatchPredictor`; words whose recall probability
+now or at any of ``TOLERANCE_DAYS`` ahead would move by more than
+``--tolerance`` keep their raw events.  The stored ``predictor_state``
+and the ``word_stats`` counts are not touched, because the rolled-up
+events remain part of the history.
+
+Freed pages are returned to the file system with incremental vacuum;
+the first run switches the database to ``auto_vacuum=INCREMENTAL``,
+which takes one full ``VACUUM``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sqlite3
+import time
+from typing import List, NamedTuple
+
+import numpy as np
+
+from algo import params_key, use_params
+from batch_predictor import BatchPredictor, InteractionLog, iter_log, replay_history
+from db import BUSY_TIMEOUT_MS, connection
+from schema import create_word_stats_delete_trigger, ensure_migrated
+
+
+DEFAULT_DB_PATH = "chinese_words.db"
+DEFAULT_PARAMS_PATH = os.environ.get("CHINESE_PREDICTOR_PARAMS", "predictor_params.json")
+DEFAULT_KEEP_DAYS = 30
+DEFAULT_BUCKET = 3600
+DEFAULT_TOLERANCE = 0.01
+# days after now at which the rollup replay must stay within the tolerance
+TOLERANCE_DAYS = (0, 1, 7, 30)
+VACUUM_STEP = 1000
+
+
+class CompactionReport(NamedTuple):
+    events: int  # raw events moved into the rollup
+    rows: int  # rollup rows written
+    words: int  # words compacted
+    kept_raw: List[str]  # words left raw because replay would change too much
+    max_error: float  # largest probability change among compacted words
+
+
+def _replay(rows, times: list[float]) -> dict[str, np.ndarray]:
+    log = InteractionLog.from_rows(rows)
+    probs = BatchPredictor.from_log(log).forecast(times)
+    return dict(zip(log.words, probs))
+
+
+def compact(
+    conn: sqlite3.Connection,
+    now_ts: float,
+    keep_days: float = DEFAULT_KEEP_DAYS,
+    bucket: int = DEFAULT_BUCKET,
+    tolerance: float = DEFAULT_TOLERANCE,
+    dry_run: bool = False,
+) -> CompactionReport:
+    """Roll up the raw events older than *keep_days* in *bucket*-second buckets.
+
+    The horizon is aligned to a bucket boundary, so a bucket is never
+    split between the rollup and the raw log.  Only words whose recall
+    probability at *now_ts* and ``TOLERANCE_DAYS`` later stays within
+    *tolerance* of the exact replay are compacted; they are checkpointed
+    at the horizon.  Must run inside a write transaction.
+    """
+    horizon = int(now_ts - keep_days * 86400) // bucket * bucket
+    new_rows = conn.execute(
+        "SELECT simplified, interaction, known, CAST(timestamp / ? AS INTEGER) AS b, "
+        "COUNT(*), AVG(timestamp), MIN(timestamp), MAX(timestamp) "
+        "FROM word_interactions WHERE timestamp < ? "
+        "GROUP BY simplified, interaction, known, b "
+        "ORDER BY simplified, AVG(timestamp)",
+        (bucket, horizon),
+    ).fetchall()
+    words = sorted({r[0] for r in new_rows})
+    if not words:
+        return CompactionReport(0, 0, 0, [], 0.0)
+    where = "WHERE simplified IN (SELECT value FROM json_each(?))"
+    words_json = json.dumps(words, ensure_ascii=False)
+
+    # the affected words' history now, and as it would be after compaction
+    history = iter_log(conn, where, (words_json,)).fetchall()
+    compacted = conn.execute(
+        "SELECT simplified, interaction, known, timestamp, count "
+        f"FROM interaction_rollup {where}",
+        (words_json,),
+    ).fetchall()
+    compacted += [(w, i, k, ts, n) for w, i, k, _, n, ts, _, _ in new_rows]
+    compacted += conn.execute(
+        "SELECT simplified, interaction, known, timestamp, 1 FROM word_interactions "
+        f"{where} AND timestamp >= ? ORDER BY id",
+        (words_json, horizon),
+    ).fetchall()
+    # stable sort keeps rollups before raw events with the same timestamp,
+    # as iter_log orders them
+    compacted.sort(key=lambda r: (r[0], r[3]))
+    times = [now_ts + days * 86400 for days in TOLERANCE_DAYS]
+    exact = _replay(history, times)
+    approx = _replay(compacted, times)
+    error = {w: float(np.abs(exact[w] - approx[w]).max()) for w in words}
+    kept_raw = sorted(w for w in words if error[w] > tolerance)
+    skip = set(kept_raw)
+    rows = [r for r in new_rows if r[0] not in skip]
+    report = CompactionReport(
+        sum(r[4] for r in rows),
+        len(rows),
+        len(words) - len(kept_raw),
+        kept_raw,
+        max((e for w, e in error.items() if w not in skip), default=0.0),
+    )
+    if dry_run or not rows:
+        return report
+
+    # exact states at the horizon, from the previous checkpoints and raw events
+    done = json.dumps(sorted({r[0] for r in rows}), ensure_ascii=False)
+    ck_words, bp, _ = replay_history(conn, where, (done,), until=horizon)
+    key = params_key()
+    conn.executemany(
+        "INSERT OR REPLACE INTO predictor_checkpoint(simplified, horizon, params, state) "
+        "VALUES (?,?,?,?)",
+        [
+            (word, horizon, key, json.dumps(bp.predictor(i).to_dict()))
+            for i, word in enumerate(ck_words)
+        ],
+    )
+    conn.executemany(
+        "INSERT INTO interaction_rollup"
+        "(simplified, interaction, known, bucket, count, timestamp, first_ts, last_ts) "
+        "VALUES (?,?,?,?,?,?,?,?)",
+        rows,
+    )
+    # the events stay in word_stats: they only change tables
+    conn.execute("DROP TRIGGER IF EXISTS word_stats_delete")
+    conn.execute(
+        "DELETE FROM word_interactions WHERE timestamp < ? "
+        "AND simplified NOT IN (SELECT value FROM json_each(?))",
+        (horizon, json.dumps(kept_raw, ensure_ascii=False)),
+    )
+    create_word_stats_delete_trigger(conn)
+    return report
+
+
+def reclaim_space(db_path: str, step: int = VACUUM_STEP) -> int:
+    """Return free pages to the file system and the number of pages freed.
+
+    Pages are released *step* at a time in short transactions, so other
+    connections are only briefly blocked.  A database not yet in
+    ``auto_vacuum=INCREMENTAL`` mode is converted with a full ``VACUUM``.
+    """
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+    try:
+        before = conn.execute("PRAGMA page_count").fetchone()[0]
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+        else:
+            while conn.execute("PRAGMA freelist_count").fetchone()[0]:
+                conn.execute(f"PRAGMA incremental_vacuum({int(step)})").fetchall()
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return before - conn.execute("PRAGMA page_count").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compact the interaction log")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="Path to words database")
+    parser.add_argument("--keep-days", type=float, default=DEFAULT_KEEP_DAYS,
+                        help="Keep raw events of this many recent days")
+    parser.add_argument("--bucket", type=int, default=DEFAULT_BUCKET,
+                        help="Rollup bucket width in seconds")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Largest allowed change of a recall probability")
+    parser.add_argument("--params", default=DEFAULT_PARAMS_PATH,
+                        help="Predictor parameters the checkpoints are replayed with")
+    parser.add_argument("--dry-run", action="store_true", help="Only report")
+    parser.add_argument("--no-vacuum", action="store_true", help="Do not reclaim space")
+    args = parser.parse_args()
+
+    ensure_migrated(args.db)
+    use_params(args.params)
+    start = time.perf_counter()
+    with connection(args.db, immediate=True) as conn:
+        report = compact(conn, time.time(), args.keep_days, args.bucket,
+                         args.tolerance, args.dry_run)
+        if args.dry_run:
+            conn.rollback()
+    action = "Would roll" if args.dry_run else "Rolled"
+    print(f"{action} {report.events} events of {report.words} words into "
+          f"{report.rows} rows in {time.perf_counter() - start:.1f}s "
+          f"(largest probability change {report.max_error:.2e})")
+    if report.kept_raw:
+        print(f"{len(report.kept_raw)} words kept raw (change above {args.tolerance})")
+    if not args.dry_run and not args.no_vacuum:
+        print(f"Freed {reclaim_space(args.db)} pages")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Segment a directory of texts in parallel and aggregate word counts."""
+
+from __future__ import annotations
+
+import os
+import sqlite3
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Sequence
+
+from search_words import Segmenter, contains_chinese, load_words
+
+
+DEFAULT_DB_PATH = "chinese_words.db"
+
+# compiled once per worker process by _init_worker
+_segmenter: Optional[Segmenter] = None
+
+
+class CorpusStats(NamedTuple):
+    files: int
+    tokens: int
+    counts: Counter[str]
+
+
+def _init_worker(words: Sequence[str]) -> None:
+    global _segmenter
+    _segmenter = Segmenter(words)
+
+
+def _count_file(path: str) -> tuple[int, Counter[str]]:
+    """Return the number of Chinese tokens and their counts in *path*."""
+    assert _segmenter is not None
+    text = Path(path).read_text(encoding="utf-8")
+    counts = Counter(t for t in _segmenter.segment(text) if contains_chinese(t))
+    return sum(counts.values()), counts
+
+
+def iter_counts(
+    paths: Iterable[Path | str],
+    words: Sequence[str],
+    workers: Optional[int] = None,
+) -> Iterator[tuple[int, Counter[str]]]:
+    """Yield ``(tokens, counts)`` for every file in *paths* as it is segmented.
+
+    Files are distributed over a pool of *workers* processes (default:
+    one per core).  Each worker compiles the segmenter from *words* once
+    when it starts, so only file names and per-file counts cross process
+    boundaries.  With a single worker or file everything runs in-process.
+    """
+    files = [str(p) for p in paths]
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(files))
+    if workers <= 1:
+        _init_worker(words)
+        for path in files:
+            yield _count_file(path)
+        return
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(list(words),)) as pool:
+        chunksize = max(1, len(files) // (workers * 4))
+        yield from pool.map(_count_file, files, chunksize=chunksize)
+
+
+def process_corpus(
+    text_dir: Path | str,
+    pattern: str = "*.txt",
+    db_path: str = DEFAULT_DB_PATH,
+    workers: Optional[int] = None,
+) -> CorpusStats:
+    """Segment every file matching *pattern* in *text_dir* in one pass.
+
+    The vocabulary is read from *db_path* once; the per-file counts are
+    merged as the workers return them.
+    """
+    paths: List[Path] = sorted(Path(text_dir).glob(pattern))
+    words = load_words(db_path)
+    total: Counter[str] = Counter()
+    tokens = 0
+    for n, counts in iter_counts(paths, words, workers):
+        tokens += n
+        total.update(counts)
+    return CorpusStats(len(paths), tokens, total)
+
+
+def store_text_counts(counts: Counter[str], db_path: str = DEFAULT_DB_PATH) -> None:
+    """Replace ``user_words.number_in_texts`` with *counts*."""
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("UPDATE user_words SET number_in_texts = 0")
+        conn.executemany(
+            "UPDATE user_words SET number_in_texts = ? WHERE simplified = ?",
+            [(count, word) for word, count in counts.items()],
+        )
@@ -31,18 +31,33 @@ async function loadSchema() {
     });
 }
 
-async function loadTable(name) {
-    const res = await fetch(`/table/${name}`);
-    const rows = await res.json();
+const PAGE_SIZE = 200;
+let pageTable = null;
+let pageCursors = [];
+
+async function loadTable(name, cursorIndex = 0) {
+    if (name !== pageTable) {
+        pageTable = name;
+        pageCursors = [0];
+    }
+    const after = pageCursors[cursorIndex];
+    const res = await fetch(`/table/${name}?after=${after}&limit=${PAGE_SIZE}`);
+    const page = await res.json();
+    const rows = page.rows || [];
     const thead = document.querySelector('#data-table thead');
     const tbody = document.querySelector('#data-table tbody');
     thead.innerHTML = '';
     tbody.innerHTML = '';
+    pageCursors.length = cursorIndex + 1;
+    if (page.next !== null && page.next !== undefined) {
+        pageCursors.push(page.next);
+    }
+    updatePager(name, cursorIndex);
     if (!rows.length) {
         return;
     }
     const headerRow = document.createElement('tr');
-    Object.keys(rows[0]).forEach(col => {
+    page.columns.forEach(col => {
         const th = document.createElement('th');
         th.textContent = col;
         headerRow.append(th);
@@ -50,13 +65,24 @@ async function loadTable(name) {
     thead.append(headerRow);
     rows.forEach(row => {
         const tr = document.createElement('tr');
-        Object.values(row).forEach(val => {
+        page.columns.forEach(col => {
             const td = document.createElement('td');
-            td.textContent = val;
+            td.textContent = row[col];
             tr.append(td);
         });
         tbody.append(tr);
     });
 }
 
+function updatePager(name, cursorIndex) {
+    const prev = document.getElementById('page-prev');
+    const next = document.getElementById('page-next');
+    const label = document.getElementById('page-label');
+    label.textContent = `${name} – page ${cursorIndex + 1}`;
+    prev.disabled = cursorIndex === 0;
+    next.disabled = cursorIndex + 1 >= pageCursors.length;
+    prev.onclick = () => loadTable(name, cursorIndex - 1);
+    next.onclick = () => loadTable(name, cursorIndex + 1);
+}
+
 loadSchema();
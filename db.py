@@ -0,0 +1,141 @@
+"""Shared SQLite connections for the web server.
+
+Every thread (and therefore every gunicorn worker thread) keeps one open
+connection per database file instead of reconnecting on each request.
+Pooled connections run in WAL mode so readers are not blocked by the
+writers behind ``/update_words`` and ``/record_flashcard``.
+
+Set ``CHINESE_DB_POOL=0`` (or call :func:`set_pooling`) to fall back to a
+plain ``sqlite3.connect`` per request, e.g. to compare both modes under
+load with ``python db.py``.
+"""
+
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+import metrics
+
+
+DEFAULT_DB_PATH = "chinese_words.db"
+STATEMENT_CACHE_SIZE = 256
+MMAP_SIZE = 256 * 1024 * 1024
+BUSY_TIMEOUT_MS = int(os.environ.get("CHINESE_BUSY_TIMEOUT_MS", 5000))
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    f"PRAGMA mmap_size={MMAP_SIZE}",
+    "PRAGMA temp_store=MEMORY",
+    f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}",
+)
+
+_pooling = os.environ.get("CHINESE_DB_POOL", "1") != "0"
+_local = threading.local()
+
+
+def set_pooling(enabled: bool) -> None:
+    """Switch between pooled connections and one connection per request."""
+    global _pooling
+    _pooling = enabled
+
+
+def pooling_enabled() -> bool:
+    return _pooling
+
+
+def open_connection(db_path: str = DEFAULT_DB_PATH) -> sqlite3.Connection:
+    """Open a new connection with the pool's pragmas applied."""
+    conn = sqlite3.connect(db_path, cached_statements=STATEMENT_CACHE_SIZE)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def _pooled(db_path: str) -> sqlite3.Connection:
+    conns = getattr(_local, "conns", None)
+    # connections must not cross a fork (e.g. gunicorn --preload)
+    if conns is None or _local.pid != os.getpid():
+        conns = _local.conns = {}
+        _local.pid = os.getpid()
+    conn = conns.get(db_path)
+    if conn is None:
+        conn = conns[db_path] = open_connection(db_path)
+    return conn
+
+
+@contextmanager
+def connection(db_path: str = DEFAULT_DB_PATH, immediate: bool = False) -> Iterator[sqlite3.Connection]:
+    """Yield a connection to *db_path* inside a transaction.
+
+    The transaction is committed when the block exits normally and
+    rolled back on error, like ``with sqlite3.connect(...)``.  Callers
+    must not change connection-wide settings such as ``row_factory``;
+    set it on a cursor instead.
+
+    Blocks that read before they write should pass ``immediate=True``:
+    the write lock is then taken up front with ``BEGIN IMMEDIATE``, which
+    waits up to the busy timeout, instead of failing with ``database is
+    locked`` when a read transaction cannot be upgraded in WAL mode.
+    """
+    pooled = _pooling
+    if pooled:
+        conn = _pooled(db_path)
+    else:
+        conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT_MS / 1000)
+    try:
+        with conn:
+            if immediate and not conn.in_transaction:
+                conn.execute("BEGIN IMMEDIATE")
+            yield metrics.instrument(conn)
+    finally:
+        if not pooled:
+            conn.close()
+
+
+def close_all() -> None:
+    """Close the calling thread's pooled connections."""
+    conns = getattr(_local, "conns", None) or {}
+    for conn in conns.values():
+        conn.close()
+    conns.clear()
+
+
+def _bench(db_path: str, threads: int, queries: int) -> float:
+    """Return queries per second for *threads* concurrent readers."""
+    import time
+
+    def worker() -> None:
+        for i in range(queries):
+            with connection(db_path) as conn:
+                conn.execute(
+                    "SELECT known_probability FROM user_words WHERE rowid = ?",
+                    (i % 1000 + 1,),
+                ).fetchone()
+        close_all()
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return threads * queries / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare pooled and per-request connections")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="Path to words database")
+    parser.add_argument("-t", "--threads", type=int, default=8, help="Concurrent readers")
+    parser.add_argument("-n", "--queries", type=int, default=2000, help="Queries per thread")
+    args = parser.parse_args()
+    for enabled in (False, True):
+        set_pooling(enabled)
+        qps = _bench(args.db, args.threads, args.queries)
+        print(f"{'pooled' if enabled else 'per-request':>12}: {qps:10.0f} queries/s")
@@ -0,0 +1,273 @@
+"""Full-text dictionary search with prefix autocompletion.
+
+``words`` and the general ``frequency_list`` are indexed together in the
+FTS5 table ``search_index``, one document per distinct word with four
+columns: the characters, tone-stripped pinyin, bopomofo without tone
+marks and the glosses of both sources.  Multi-syllable readings are also
+indexed with their syllables joined, so ``nihao``, ``ni hao`` and
+``ni3 hao3`` all find 你好.
+
+Readings match as a phrase whose last syllable is a prefix, glosses
+match when every term prefixes some word of them.  Results are ranked by
+frequency rank (the better of ``words.frequency`` and the general list),
+boosted by the learner's ``known_probability`` the way an input method
+favours words the user already types, with exact matches of the
+characters first.  Pinyin, bopomofo and meaning are read from the
+vocabulary snapshot, so a query touches no table but the index,
+``user_words`` and ``frequency_list``.
+
+``search_entries`` keys each document by word with a digest of its
+text, so :func:`refresh_search_index` only rewrites the documents whose
+source rows changed.  The index is stamped with the ``vocab_version`` it
+was built from.  It is built by schema migration 6, and
+``import_words.py`` and ``load_frequency_list`` refresh it in their own
+transaction; searching never writes.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import math
+import re
+import sqlite3
+import unicodedata
+from typing import NamedTuple
+
+from search_words import ensure_vocab_version, vocab_version
+from vocab_snapshot import VocabSnapshot
+
+
+DEFAULT_LIMIT = 20
+KNOWN_BOOST = 1.0
+MAX_RANK = 1_000_000
+# shorter gloss terms match whole words only; as prefixes they hit most glosses
+MIN_GLOSS_PREFIX = 3
+# bopomofo tone marks: first tone, second, third, fourth, neutral
+_TONE_MARKS = dict.fromkeys(map(ord, "ˉˊˇˋ˙"))
+_TONE_NUMBER = re.compile(r"(?<=[a-z])[1-5]")
+_TERM = re.compile(r"\w+")
+
+
+class IndexReport(NamedTuple):
+    added: int
+    updated: int
+    removed: int
+
+
+def fold(text: str) -> str:
+    """Lower-case *text* and strip pinyin tone marks and numbers and bopomofo tones."""
+    text = unicodedata.normalize("NFD", text.lower())
+    text = "".join(ch for ch in text if unicodedata.category(ch) != "Mn")
+    return _TONE_NUMBER.sub("", text.translate(_TONE_MARKS))
+
+
+def _readings(*values: str | None) -> str:
+    """Fold readings and add each multi-syllable one with its syllables joined."""
+    out: list[str] = []
+    for value in values:
+        if not value:
+            continue
+        for reading in re.split(r"[/,;]", fold(value)):
+            syllables = reading.split()
+            out.append(" ".join(syllables))
+            if len(syllables) > 1:
+                out.append("".join(syllables))
+    return " ".join(dict.fromkeys(r for r in out if r))
+
+
+def ensure_search_index(conn: sqlite3.Connection) -> None:
+    """Create ``search_entries`` and the FTS5 table ``search_index``."""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS search_entries (
+            id INTEGER PRIMARY KEY,
+            simplified TEXT NOT NULL UNIQUE,
+            rank INTEGER,
+            weight REAL NOT NULL,
+            digest TEXT NOT NULL
+        )
+        """
+    )
+    conn.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+        "simplified, pinyin, bopomofo, gloss, "
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '1 2 3')"
+    )
+
+
+def _has_table(conn: sqlite3.Connection, name: str) -> bool:
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+    ).fetchone() is not None
+
+
+def _weight(rank: int | None) -> float:
+    """Map a frequency rank to a ranking weight, 1 for unranked words."""
+    rank = min(max(rank or MAX_RANK, 1), MAX_RANK)
+    return 1.0 + math.log(MAX_RANK / rank)  # SQLite may lack log()
+
+
+def _documents(conn: sqlite3.Connection):
+    """Yield ``(document, rank, weight, digest)`` for every distinct word of both sources."""
+    # two plain scans merged here: words is not necessarily indexed on
+    # simplified, which makes joining it against frequency_list slow
+    general = {}
+    if _has_table(conn, "frequency_list"):
+        general = {
+            word: (rank, pinyin, gloss)
+            for word, rank, pinyin, gloss in conn.execute(
+                "SELECT simplified, rank, pinyin, gloss FROM frequency_list"
+            )
+        }
+    seen = set()
+    rows = conn.execute(
+        "SELECT simplified, frequency, pinyin, bopomofo, meaning FROM words "
+        "WHERE simplified IS NOT NULL ORDER BY rowid"
+    ).fetchall()
+    rows += [(w, None, None, None, None) for w in general]
+    for word, rank, pinyin, bopomofo, meaning in rows:
+        if word in seen:
+            continue
+        seen.add(word)
+        g_rank, g_pinyin, gloss = general.get(word, (None, None, None))
+        ranks = [r for r in (rank, g_rank) if isinstance(r, int)]
+        doc = (
+            word,
+            _readings(pinyin, g_pinyin),
+            _readings(bopomofo),
+            " ".join(g for g in (meaning, gloss) if g),
+        )
+        rank = min(ranks, default=None)
+        digest = hashlib.sha1(f"{doc}\0{rank}".encode("utf-8")).hexdigest()
+        yield doc, rank, _weight(rank), digest
+
+
+def refresh_search_index(conn: sqlite3.Connection) -> IndexReport:
+    """Bring the search index in line with ``words`` and ``frequency_list``.
+
+    Only documents whose text or frequency changed are rewritten, and
+    words gone from both tables are removed.  Changes are written with
+    one ``executemany`` per statement.  Stamps the index with the
+    current ``vocab_version``.
+    """
+    ensure_search_index(conn)
+    ensure_vocab_version(conn)
+    existing = {
+        word: (id_, digest)
+        for id_, word, digest in conn.execute("SELECT id, simplified, digest FROM search_entries")
+    }
+    next_id = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM search_entries").fetchone()[0]
+    added: list[tuple] = []
+    updated: list[tuple] = []
+    for doc, rank, weight, digest in _documents(conn):
+        old = existing.pop(doc[0], None)
+        if old is None:
+            added.append((next_id, doc, rank, weight, digest))
+            next_id += 1
+        elif old[1] != digest:
+            updated.append((old[0], doc, rank, weight, digest))
+    conn.executemany(
+        "INSERT INTO search_entries(id, simplified, rank, weight, digest) VALUES (?,?,?,?,?)",
+        ((id_, doc[0], rank, weight, digest) for id_, doc, rank, weight, digest in added),
+    )
+    conn.executemany(
+        "UPDATE search_entries SET rank = ?, weight = ?, digest = ? WHERE id = ?",
+        ((rank, weight, digest, id_) for id_, doc, rank, weight, digest in updated),
+    )
+    gone = [(id_,) for id_, _ in existing.values()]
+    conn.executemany(
+        "DELETE FROM search_index WHERE rowid = ?",
+        [(u[0],) for u in updated] + gone,
+    )
+    conn.executemany(
+        "INSERT INTO search_index(rowid, simplified, pinyin, bopomofo, gloss) "
+        "VALUES (?,?,?,?,?)",
+        ((id_, *doc) for id_, doc, *_ in added + updated),
+    )
+    conn.executemany("DELETE FROM search_entries WHERE id = ?", gone)
+    conn.execute(
+        "INSERT OR REPLACE INTO db_meta(key, value) VALUES ('search_version', ?)",
+        (vocab_version(conn),),
+    )
+    return IndexReport(len(added), len(updated), len(gone))
+
+
+def search_index_stale(conn: sqlite3.Connection) -> bool:
+    """Return whether ``words`` changed since the index was last refreshed."""
+    try:
+        row = conn.execute("SELECT value FROM db_meta WHERE key = 'search_version'").fetchone()
+    except sqlite3.OperationalError:
+        return True
+    return row is None or row[0] != vocab_version(conn)
+
+
+def match_expression(query: str) -> str | None:
+    """Turn free text into an FTS5 expression for :func:`search`.
+
+    The characters, pinyin and bopomofo columns must contain the terms as
+    consecutive tokens, the last one as a prefix; the glosses must
+    contain each term in any order, as a word prefix if it has at least
+    :data:`MIN_GLOSS_PREFIX` characters.
+    """
+    terms = _TERM.findall(fold(query))
+    if not terms:
+        return None
+    phrase = '"' + " ".join(terms) + '"*'
+    words = " AND ".join(
+        f'"{term}"*' if len(term) >= MIN_GLOSS_PREFIX else f'"{term}"' for term in terms
+    )
+    return f"{{simplified pinyin bopomofo}} : {phrase} OR gloss : ({words})"
+
+
+def search(
+    conn: sqlite3.Connection,
+    query: str,
+    vocab: VocabSnapshot,
+    limit: int = DEFAULT_LIMIT,
+) -> list[dict]:
+    """Return up to *limit* dictionary entries matching *query*, best first.
+
+    *vocab* is the current snapshot of ``words``; entries only in the
+    general frequency list take pinyin and gloss from there.
+    """
+    expression = match_expression(query)
+    if expression is None:
+        return []
+    exact = query.strip()
+    rows = conn.execute(
+        "SELECT e.simplified, e.rank, COALESCE(u.known_probability, 0) AS known "
+        "FROM search_index JOIN search_entries AS e ON e.id = search_index.rowid "
+        "LEFT JOIN user_words AS u ON u.simplified = e.simplified "
+        "WHERE search_index MATCH ? "
+        "ORDER BY e.simplified = ? DESC, e.weight * (1 + ? * known) DESC, "
+        "length(e.simplified), e.simplified "
+        "LIMIT ?",
+        (expression, exact, KNOWN_BOOST, limit),
+    ).fetchall()
+    general = {}
+    if rows and _has_table(conn, "frequency_list"):
+        general = {
+            word: (pinyin, gloss)
+            for word, pinyin, gloss in conn.execute(
+                "SELECT simplified, pinyin, gloss FROM frequency_list "
+                "WHERE simplified IN (SELECT value FROM json_each(?))",
+                (json.dumps([r[0] for r in rows], ensure_ascii=False),),
+            )
+        }
+    results = []
+    for word, rank, known in rows:
+        i = vocab.id(word)
+        pinyin, gloss = general.get(word, (None, None))
+        results.append(
+            {
+                "word": word,
+                "pinyin": vocab.get("pinyin", i) if i is not None else pinyin,
+                "bopomofo": vocab.get("bopomofo", i) if i is not None else None,
+                "meaning": vocab.get("meaning", i) if i is not None else None,
+                "gloss": gloss,
+                "rank": rank,
+                "known_probability": known,
+            }
+        )
+    return results
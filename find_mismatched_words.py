@@ -2,10 +2,92 @@ import sqlite3
 import csv
 from typing import List, Tuple
 
+from dictionary_search import refresh_search_index
+from import_words import ensure_import_state, file_hash, record_import, stored_hash
+
+
+DEFAULT_FREQUENCY_PATH = "frequency_list.tsv"
+
+
+def load_frequency_list(
+    conn: sqlite3.Connection,
+    frequency_path: str = DEFAULT_FREQUENCY_PATH,
+    force: bool = False,
+) -> bool:
+    """Load the general frequency list into the ``frequency_list`` table.
+
+    The TSV columns are rank, word, count, a cumulative share, pinyin and
+    gloss.  The file is only parsed when its hash differs from the one
+    recorded in ``import_state`` (or *force* is set), and a rebuild
+    refreshes the dictionary search index.  Returns whether the table was
+    rebuilt.
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS frequency_list (
+            simplified TEXT PRIMARY KEY,
+            rank INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            pinyin TEXT,
+            gloss TEXT
+        )
+        """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS frequency_list_by_count "
+        "ON frequency_list(count DESC)"
+    )
+    ensure_import_state(conn)
+    digest = file_hash(frequency_path)
+    if not force and stored_hash(conn, "frequency_list") == digest:
+        return False
+    rows = []
+    with open(frequency_path, "r", encoding="utf-8") as f:
+        for row in csv.reader(f, delimiter="\t", quoting=csv.QUOTE_NONE):
+            if len(row) < 3:
+                continue
+            try:
+                rank, count = int(row[0]), int(row[2])
+            except ValueError:
+                continue
+            pinyin = row[4] if len(row) > 4 else None
+            gloss = row[5] if len(row) > 5 else None
+            rows.append((row[1], rank, count, pinyin, gloss))
+    conn.execute("DELETE FROM frequency_list")
+    # the first (best ranked) entry wins for repeated words
+    conn.executemany(
+        "INSERT OR IGNORE INTO frequency_list(simplified, rank, count, pinyin, gloss) "
+        "VALUES (?,?,?,?,?)",
+        rows,
+    )
+    record_import(conn, "frequency_list", digest)
+    refresh_search_index(conn)
+    return True
+
+
+def mismatched_words(
+    conn: sqlite3.Connection, *, min_freq: int = 300, limit: int = 50
+) -> List[Tuple[str, int, int, int, str, str]]:
+    """Rank words by general count relative to the user's encounters.
+
+    Runs as one join of ``frequency_list`` and ``user_words``; rows are
+    ``(word, general_count, user_count, rank, pinyin, gloss)`` ordered by
+    ``general_count / (user_count + 1)``.  Words the user has never
+    encountered are ignored.
+    """
+    return conn.execute(
+        "SELECT f.simplified, f.count, u.number_in_texts, f.rank, f.pinyin, f.gloss "
+        "FROM frequency_list AS f JOIN user_words AS u ON u.simplified = f.simplified "
+        "WHERE f.count >= ? AND u.number_in_texts > 0 "
+        "ORDER BY f.count * 1.0 / (u.number_in_texts + 1) DESC, f.rank "
+        "LIMIT ?",
+        (min_freq, limit),
+    ).fetchall()
+
 
 def find_mismatched_words(
     db_path: str = "chinese_words.db",
-    frequency_path: str = "frequency_list.tsv",
+    frequency_path: str = DEFAULT_FREQUENCY_PATH,
     *,
     min_freq: int = 300,
     limit: int = 50,
@@ -21,46 +103,17 @@ def find_mismatched_words(
     frequency_path:
         TSV file with general frequency information. The file is expected to
         have the word as the second column and its count as the third column.
+        It is loaded into the ``frequency_list`` table when it changed.
     min_freq:
         Ignore entries from ``frequency_path`` whose frequency is below this
         value.
     limit:
         Number of results to return.
     """
-    # Load general frequency list
-    general: list[tuple[str, int]] = []
-    with open(frequency_path, "r", encoding="utf-8") as f:
-        reader = csv.reader(f, delimiter="\t")
-        for row in reader:
-            if len(row) < 3:
-                continue
-            try:
-                freq = int(row[2])
-            except ValueError:
-                continue
-            if freq < min_freq:
-                continue
-            word = row[1]
-            general.append((word, freq))
-
-    # Load user encounter counts
     with sqlite3.connect(db_path) as conn:
-        rows = conn.execute(
-            "SELECT simplified, number_in_texts FROM user_words"
-        ).fetchall()
-    user_counts = {w: c for w, c in rows}
-
-    discrepancies: list[tuple[str, int, int, float]] = []
-    for word, freq in general:
-        count = user_counts.get(word, 0)
-        if count == 0:
-            continue
-        score = freq / (count + 1)
-        discrepancies.append((word, freq, count, score))
-
-    discrepancies.sort(key=lambda x: x[3], reverse=True)
-    top = [d[:3] for d in discrepancies[:limit]]
-    return top
+        load_frequency_list(conn, frequency_path)
+        rows = mismatched_words(conn, min_freq=min_freq, limit=limit)
+    return [row[:3] for row in rows]
 
 
 def print_mismatched_words() -> None:
@@ -1,4 +1,4 @@
-let index = 0;
+let restart = true;
 let currentWord = null;
 
 async function loadWord() {
@@ -6,9 +6,12 @@ async function loadWord() {
     card.classList.add('flip');
     setTimeout(() => card.classList.remove('flip'), 600);
 
-    const res = await fetch(`/next_word?offset=${index}`);
+    const res = await fetch(restart ? '/next_word?restart=1' : '/next_word');
+    restart = false;
     const data = await res.json();
     if (!data.word) {
+        // every due card was answered: the session is over
+        currentWord = null;
         document.getElementById('word').textContent = 'No more words';
         document.getElementById('pinyin').textContent = '';
         document.getElementById('meaning').textContent = '';
@@ -38,7 +41,6 @@ async function record(known) {
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ word: currentWord, known })
     });
-    index++;
     loadWord();
 }
 
@@ -1,6 +1,6 @@
 import argparse
 import json
-from search_words import load_words, segment_text
+from search_words import Segmenter
 
 
 def main() -> None:
@@ -10,10 +10,10 @@ def main() -> None:
     parser.add_argument("-d", "--db", default="chinese_words.db", help="Path to words database")
     args = parser.parse_args()
 
-    words = load_words(args.db)
+    segmenter = Segmenter.from_db(args.db)
     with open(args.path, "r", encoding="utf-8") as f:
         text = f.read()
-    tokens = segment_text(text, words)
+    tokens = segmenter.segment(text)
 
     with open(args.out, "w", encoding="utf-8") as f:
         json.dump(tokens, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,62 @@
+"""gunicorn settings for serving the app with several worker processes.
+
+Run ``gunicorn -c gunicorn.conf.py``.  Before the workers start, the
+master runs pending migrations, maps the vocabulary snapshot (see
+``vocab_snapshot.py``) and forks one writer process (see
+``writer.py``) that performs every database write; the workers find it
+through ``CHINESE_WRITER_SOCKET`` and only read on their own.
+"""
+
+import multiprocessing
+import os
+import tempfile
+
+wsgi_app = "server:app"
+bind = os.environ.get("CHINESE_BIND", "127.0.0.1:5000")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "gthread"
+threads = int(os.environ.get("CHINESE_THREADS", 4))
+# /recalculate replays the whole interaction log
+timeout = 120
+preload_app = True
+
+# inherited by the workers, which send their writes to this socket
+os.environ.setdefault(
+    "CHINESE_WRITER_SOCKET",
+    os.path.join(tempfile.gettempdir(), f"chinese-writer-{os.getpid()}.sock"),
+)
+
+_writer_process = None
+
+
+def on_starting(arbiter):
+    global _writer_process
+    import db
+    import server
+    import writer
+    from schema import ensure_migrated
+    from vocab_snapshot import vocabulary
+
+    ensure_migrated(server.DB_PATH)
+    # mapped here, so the forked workers share the snapshot's pages
+    vocabulary(server.DB_PATH).get()
+    db.close_all()
+    ctx = multiprocessing.get_context("fork")
+    ready = ctx.Event()
+    _writer_process = ctx.Process(
+        target=writer.serve,
+        args=(os.environ["CHINESE_WRITER_SOCKET"], server.DB_PATH, server.WRITE_OPS),
+        kwargs={"ready": ready},
+        name="chinese-writer",
+    )
+    _writer_process.start()
+    if not ready.wait(10):
+        raise RuntimeError("writer process did not start")
+    arbiter.log.info("writer process %s started", _writer_process.pid)
+
+
+def on_exit(arbiter):
+    if _writer_process is not None and _writer_process.is_alive():
+        # SIGTERM makes the writer commit pending requests and exit
+        _writer_process.terminate()
+        _writer_process.join(30)
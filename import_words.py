@@ -1,19 +1,171 @@
-"""Create an SQLite database from the bopomofo Excel data."""
+"""Create or refresh the SQLite vocabulary from the bopomofo Excel data."""
 
 from __future__ import annotations
 
 import argparse
+import hashlib
+import json
 import sqlite3
-from pathlib import Path
+import time
+from typing import Iterator, NamedTuple, Optional, Sequence
 
-import pandas as pd
+from openpyxl import load_workbook
+
+from dictionary_search import refresh_search_index
+from schema import migrate
+from search_words import ensure_vocab_version
 
 
 DEFAULT_DB_PATH = "chinese_words.db"
+BATCH_SIZE = 1000
+
+
+class ImportReport(NamedTuple):
+    inserted: int
+    updated: int
+    removed: int
+    skipped: bool = False
+
+
+def file_hash(path: str) -> str:
+    """Return the SHA-1 of the file at *path*."""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_rows(excel_path: str) -> tuple[list[str], Iterator[tuple]]:
+    """Stream the first sheet of *excel_path* as ``(header, rows)``.
+
+    The workbook is opened in read-only mode, so rows are parsed lazily
+    instead of loading the whole sheet.  Trailing empty columns and rows
+    without a ``simplified`` value are dropped.
+    """
+    wb = load_workbook(excel_path, read_only=True, data_only=True)
+    rows = wb.worksheets[0].iter_rows(values_only=True)
+    header = [str(c) for c in next(rows, ()) if c is not None]
+    if "simplified" not in header:
+        wb.close()
+        raise ValueError(f"{excel_path}: no 'simplified' column in the header")
+    key = header.index("simplified")
+
+    def gen() -> Iterator[tuple]:
+        try:
+            for row in rows:
+                row = tuple(row[: len(header)]) + (None,) * (len(header) - len(row))
+                if row[key] not in (None, ""):
+                    yield row
+        finally:
+            wb.close()
+
+    return header, gen()
+
+
+def _ensure_tables(conn: sqlite3.Connection, header: Sequence[str]) -> None:
+    """Create ``words``, ``user_words`` and ``word_interactions`` as needed.
+
+    ``words`` gets one column per spreadsheet column and a unique index on
+    ``simplified`` for the upserts; databases written by the old pandas
+    importer are upgraded in place.
+    """
+    columns = [r[1] for r in conn.execute("PRAGMA table_info(words)")]
+    if not columns:
+        # main table with vocabulary
+        defs = ", ".join(
+            '"simplified" TEXT NOT NULL' if c == "simplified"
+            else f'"{c}" INTEGER' if c == "frequency" else f'"{c}" TEXT'
+            for c in header
+        )
+        conn.execute(f"CREATE TABLE words ({defs})")
+    else:
+        for c in header:
+            if c not in columns:
+                conn.execute(f'ALTER TABLE words ADD COLUMN "{c}"')
+        conn.execute(
+            "DELETE FROM words WHERE rowid NOT IN "
+            "(SELECT MAX(rowid) FROM words GROUP BY simplified)"
+        )
+    conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS words_simplified ON words(simplified)"
+    )
+    # the triggers stamp every changed row in db_meta.vocab_version
+    ensure_vocab_version(conn)
+    # secondary table tracking a user's knowledge of each word
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS user_words (
+            simplified TEXT PRIMARY KEY,
+            user_knows_word INTEGER DEFAULT 0,
+            known_probability REAL DEFAULT 0.0,
+            number_in_texts INTEGER DEFAULT 0,
+            FOREIGN KEY(simplified) REFERENCES words(simplified)
+        )
+        """
+    )
+    # table recording every single interaction with a word
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS word_interactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            simplified TEXT NOT NULL,
+            interaction TEXT NOT NULL,
+            known INTEGER,
+            timestamp INTEGER NOT NULL,
+            FOREIGN KEY(simplified) REFERENCES words(simplified)
+        )
+        """
+    )
+    ensure_import_state(conn)
+
+
+def ensure_import_state(conn: sqlite3.Connection) -> None:
+    """Create the table remembering the file hash of each imported source."""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS import_state (
+            source TEXT PRIMARY KEY,
+            content_hash TEXT NOT NULL,
+            imported_at INTEGER NOT NULL
+        )
+        """
+    )
+
+
+def stored_hash(conn: sqlite3.Connection, source: str) -> Optional[str]:
+    """Return the file hash recorded by the last import of *source*."""
+    try:
+        row = conn.execute(
+            "SELECT content_hash FROM import_state WHERE source = ?", (source,)
+        ).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else None
+
+
+def record_import(conn: sqlite3.Connection, source: str, digest: str) -> None:
+    """Remember that *source* was imported from a file with hash *digest*."""
+    conn.execute(
+        "INSERT OR REPLACE INTO import_state(source, content_hash, imported_at) "
+        "VALUES (?, ?, ?)",
+        (source, digest, int(time.time())),
+    )
 
 
-def import_excel(excel_path: str, db_path: str = DEFAULT_DB_PATH) -> None:
-    """Read the Excel file and store its contents in an SQLite database.
+def import_excel(
+    excel_path: str, db_path: str = DEFAULT_DB_PATH, force: bool = False
+) -> ImportReport:
+    """Bring the ``words`` table in line with the Excel file.
+
+    Rows are streamed from the workbook and upserted in batches of
+    :data:`BATCH_SIZE`; only new or changed rows are written, and words no
+    longer in the sheet are removed.  Everything happens in one
+    transaction, so a failed import leaves the previous vocabulary.  When
+    the file's SHA-1 equals the one recorded by the last import nothing
+    is read at all unless *force* is set.  ``user_words`` gets a row for
+    every new word; existing progress is kept.  The dictionary search
+    index is refreshed for the changed words in the same transaction.
 
     Parameters
     ----------
@@ -21,48 +173,69 @@ def import_excel(excel_path: str, db_path: str = DEFAULT_DB_PATH) -> None:
         Path to ``bopomofo_translated.xlsx``.
     db_path:
         Location of the SQLite database to create or update.
+    force:
+        Import even if the spreadsheet is unchanged.
+
+    Returns
+    -------
+    ImportReport
+        Number of inserted, updated and removed words.
     """
-    df = pd.read_excel(excel_path)
+    digest = file_hash(excel_path)
     with sqlite3.connect(db_path) as conn:
-        # main table with vocabulary
-        df.to_sql("words", conn, index=False, if_exists="replace")
-        # secondary table tracking a user's knowledge of each word
-        conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS user_words (
-                simplified TEXT PRIMARY KEY,
-                user_knows_word INTEGER DEFAULT 0,
-                known_probability REAL DEFAULT 0.0,
-                number_in_texts INTEGER DEFAULT 0,
-                FOREIGN KEY(simplified) REFERENCES words(simplified)
-            )
-            """
-        )
-        # table recording every single interaction with a word
-        conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS word_interactions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                simplified TEXT NOT NULL,
-                interaction TEXT NOT NULL,
-                known INTEGER,
-                timestamp INTEGER NOT NULL,
-                FOREIGN KEY(simplified) REFERENCES words(simplified)
-            )
-            """
-        )
-        # prepopulate user_words with the word list if not already present
-        existing = {
-            row[0]
-            for row in conn.execute(
-                "SELECT simplified FROM user_words"
-            )
-        }
-        to_insert = [(w,) for w in df["simplified"] if w not in existing]
-        if to_insert:
-            conn.executemany(
-                "INSERT INTO user_words(simplified) VALUES (?)", to_insert
+        if not force and stored_hash(conn, "words") == digest:
+            return ImportReport(0, 0, 0, skipped=True)
+
+        header, rows = read_rows(excel_path)
+        _ensure_tables(conn, header)
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS import_seen (simplified TEXT PRIMARY KEY)")
+        conn.execute("DELETE FROM import_seen")
+
+        cols = ", ".join(f'"{c}"' for c in header)
+        values = ", ".join("?" * len(header))
+        others = [c for c in header if c != "simplified"]
+        assign = ", ".join(f'"{c}" = excluded."{c}"' for c in others)
+        differs = " OR ".join(f'"{c}" IS NOT excluded."{c}"' for c in others)
+        upsert = f"INSERT INTO words ({cols}) VALUES ({values}) ON CONFLICT(simplified) "
+        upsert += f"DO UPDATE SET {assign} WHERE {differs}" if others else "DO NOTHING"
+        key = header.index("simplified")
+
+        inserted = updated = 0
+        batch: dict[str, tuple] = {}
+
+        def flush() -> None:
+            nonlocal inserted, updated
+            keys = json.dumps(list(batch), ensure_ascii=False)
+            existing = conn.execute(
+                "SELECT COUNT(*) FROM words WHERE simplified IN (SELECT value FROM json_each(?))",
+                (keys,),
+            ).fetchone()[0]
+            changed = conn.executemany(upsert, batch.values()).rowcount
+            conn.execute(
+                "INSERT OR IGNORE INTO import_seen SELECT value FROM json_each(?)", (keys,)
             )
+            inserted += len(batch) - existing
+            updated += changed - (len(batch) - existing)
+            batch.clear()
+
+        for row in rows:
+            batch[row[key]] = row
+            if len(batch) >= BATCH_SIZE:
+                flush()
+        if batch:
+            flush()
+
+        removed = conn.execute(
+            "DELETE FROM words WHERE simplified NOT IN (SELECT simplified FROM import_seen)"
+        ).rowcount
+        conn.execute("DROP TABLE import_seen")
+        # prepopulate user_words with new words
+        conn.execute("INSERT OR IGNORE INTO user_words(simplified) SELECT simplified FROM words")
+        record_import(conn, "words", digest)
+        # indexes, aggregate tables and triggers added since
+        migrate(conn)
+        refresh_search_index(conn)
+    return ImportReport(inserted, updated, removed)
 
 
 def main() -> None:
@@ -74,9 +247,18 @@ def main() -> None:
     parser.add_argument(
         "--db", default=DEFAULT_DB_PATH, help="Output SQLite database path"
     )
+    parser.add_argument(
+        "--force", action="store_true", help="Import even if the file is unchanged"
+    )
     args = parser.parse_args()
-    import_excel(args.excel, args.db)
-    print(f"Database written to {args.db}")
+    report = import_excel(args.excel, args.db, args.force)
+    if report.skipped:
+        print(f"{args.excel} unchanged since the last import")
+    else:
+        print(
+            f"Database written to {args.db}: {report.inserted} inserted, "
+            f"{report.updated} updated, {report.removed} removed"
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,342 @@
+"""Opt-in request, SQL and compute instrumentation in Prometheus format.
+
+Enable with ``CHINESE_METRICS=1`` (or :func:`enable`).  While disabled
+every hook returns after a single flag check and connections are not
+wrapped, so the overhead is negligible.  When enabled the server records
+
+* per-route request latency histograms,
+* the number of SQL statements per route with their execute and fetch
+  time, measured by wrapping the connections handed out by
+  :func:`db.connection`,
+* the duration of story segmentation and predictor replays,
+
+and exposes them at ``/metrics``.  Setting ``CHINESE_SLOW_REQUEST_MS``
+additionally logs every slower request with its per-statement breakdown.
+"""
+
+from __future__ import annotations
+
+import bisect
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+log = logging.getLogger(__name__)
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_enabled = os.environ.get("CHINESE_METRICS") == "1"
+_slow_ms: Optional[float] = (
+    float(os.environ["CHINESE_SLOW_REQUEST_MS"])
+    if os.environ.get("CHINESE_SLOW_REQUEST_MS") else None
+)
+
+
+def enable(slow_request_ms: Optional[float] = None) -> None:
+    """Turn instrumentation on, optionally logging requests slower than *slow_request_ms*."""
+    global _enabled, _slow_ms
+    _enabled = True
+    if slow_request_ms is not None:
+        _slow_ms = slow_request_ms
+
+
+def disable() -> None:
+    global _enabled
+    _enabled = False
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+# ----------------------------------------------------------------------
+# Metric storage
+# ----------------------------------------------------------------------
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by label set."""
+
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = BUCKETS) -> None:
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        self._series: Dict[Labels, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # one counter per bucket, then +Inf, sum and count
+                series = self._series[key] = [0.0] * (len(self.buckets) + 3)
+            series[idx] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted(self._series.items())
+            items = [(k, list(v)) for k, v in items]
+        for labels, series in items:
+            base = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+            sep = "," if base else ""
+            cumulative = 0.0
+            for bound, n in zip(self.buckets + (float("inf"),), series):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{self.name}_bucket{{{base}{sep}le="{le}"}} {cumulative:g}')
+            lines.append(f"{self.name}_sum{{{base}}} {series[-2]!r}")
+            lines.append(f"{self.name}_count{{{base}}} {series[-1]:g}")
+        return lines
+
+
+class Counter:
+    """Monotonic counter keyed by label set."""
+
+    def __init__(self, name: str, help_text: str) -> None:
+        self.name = name
+        self.help = help_text
+        self._series: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._series[key] = self._series.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._series.items())
+        for labels, value in items:
+            base = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+            lines.append(f"{self.name}{{{base}}} {value:g}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "Request latency by route.")
+SQL_SECONDS = Histogram("sql_statement_duration_seconds", "SQL execute time by route.")
+SQL_FETCH_SECONDS = Counter("sql_fetch_seconds_total", "Time spent fetching SQL result rows by route.")
+SQL_STATEMENTS = Counter("sql_statements_total", "SQL statements executed by route.")
+COMPUTE_SECONDS = Histogram("compute_duration_seconds", "Segmentation and predictor replay time.")
+METRICS = (REQUEST_SECONDS, SQL_SECONDS, SQL_FETCH_SECONDS, SQL_STATEMENTS, COMPUTE_SECONDS)
+
+
+def render() -> str:
+    """Return all metrics in the Prometheus text exposition format."""
+    lines: List[str] = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def reset() -> None:
+    """Forget all recorded samples."""
+    for metric in METRICS:
+        metric._series.clear()
+
+
+# ----------------------------------------------------------------------
+# Per-request context
+# ----------------------------------------------------------------------
+
+_local = threading.local()
+
+
+class _RequestRecord:
+    __slots__ = ("route", "start", "queries")
+
+    def __init__(self, route: str) -> None:
+        self.route = route
+        self.start = time.perf_counter()
+        # statement text -> [count, seconds]
+        self.queries: Dict[str, List[float]] = {}
+
+
+def _current_route() -> str:
+    record = getattr(_local, "record", None)
+    return record.route if record is not None else "background"
+
+
+def _record_sql(sql: str, seconds: float, count: bool) -> None:
+    """Account *seconds* to *sql*; *count* is False for fetches of a statement."""
+    route = _current_route()
+    if count:
+        SQL_SECONDS.observe(seconds, route=route)
+        SQL_STATEMENTS.inc(route=route)
+    else:
+        SQL_FETCH_SECONDS.inc(seconds, route=route)
+    record = getattr(_local, "record", None)
+    if record is not None:
+        entry = record.queries.setdefault(sql, [0, 0.0])
+        entry[0] += count
+        entry[1] += seconds
+
+
+def begin_request(route: str) -> None:
+    if _enabled:
+        _local.record = _RequestRecord(route)
+
+
+def end_request(method: str, status: int) -> None:
+    record = getattr(_local, "record", None)
+    if record is None:
+        return
+    _local.record = None
+    elapsed = time.perf_counter() - record.start
+    REQUEST_SECONDS.observe(elapsed, route=record.route, method=method, status=str(status))
+    if _slow_ms is not None and elapsed * 1000 >= _slow_ms:
+        breakdown = sorted(record.queries.items(), key=lambda kv: kv[1][1], reverse=True)
+        log.warning(
+            "slow request %s %s: %.1f ms, %d statements, %.1f ms in SQL\n%s",
+            method, record.route, elapsed * 1000,
+            sum(int(c) for c, _ in record.queries.values()),
+            sum(s for _, s in record.queries.values()) * 1000,
+            "\n".join(
+                f"  {int(c):5d}x {s * 1000:8.2f} ms  {' '.join(sql.split())[:200]}"
+                for sql, (c, s) in breakdown[:10]
+            ),
+        )
+
+
+@contextmanager
+def timer(kind: str) -> Iterator[None]:
+    """Time a block of computation as ``compute_duration_seconds{kind=...}``."""
+    if not _enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        COMPUTE_SECONDS.observe(time.perf_counter() - start, kind=kind, route=_current_route())
+
+
+# ----------------------------------------------------------------------
+# Connection wrapper
+# ----------------------------------------------------------------------
+
+class _TimedCursor:
+    """Cursor proxy that adds fetch time to its statement's record."""
+
+    def __init__(self, cursor: sqlite3.Cursor, sql: str) -> None:
+        self._cursor = cursor
+        self._sql = sql
+
+    def _timed(self, fn, *args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            _record_sql(self._sql, time.perf_counter() - start, count=False)
+
+    def fetchone(self):
+        return self._timed(self._cursor.fetchone)
+
+    def fetchall(self):
+        return self._timed(self._cursor.fetchall)
+
+    def fetchmany(self, *args):
+        return self._timed(self._cursor.fetchmany, *args)
+
+    def __iter__(self):
+        it = iter(self._cursor)
+        spent = 0.0
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    row = next(it)
+                except StopIteration:
+                    return
+                finally:
+                    spent += time.perf_counter() - start
+                yield row
+        finally:
+            _record_sql(self._sql, spent, count=False)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._cursor, name)
+
+
+class InstrumentedConnection:
+    """Connection proxy that times ``execute`` and ``executemany``."""
+
+    def __init__(self, conn: sqlite3.Connection) -> None:
+        self._conn = conn
+
+    def _run(self, fn, sql: str, *args) -> _TimedCursor:
+        start = time.perf_counter()
+        try:
+            cursor = fn(sql, *args)
+        finally:
+            _record_sql(sql, time.perf_counter() - start, count=True)
+        return _TimedCursor(cursor, sql)
+
+    def execute(self, sql: str, *args) -> _TimedCursor:
+        return self._run(self._conn.execute, sql, *args)
+
+    def executemany(self, sql: str, *args) -> _TimedCursor:
+        return self._run(self._conn.executemany, sql, *args)
+
+    def commit(self) -> None:
+        start = time.perf_counter()
+        try:
+            self._conn.commit()
+        finally:
+            _record_sql("COMMIT", time.perf_counter() - start, count=True)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._conn.__exit__(*exc)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._conn, name)
+
+
+def instrument(conn: sqlite3.Connection) -> sqlite3.Connection:
+    """Return *conn* wrapped for timing if instrumentation is enabled."""
+    if not _enabled:
+        return conn
+    return InstrumentedConnection(conn)  # type: ignore[return-value]
+
+
+def init_app(app) -> None:
+    """Register request hooks and the ``/metrics`` route on a Flask app."""
+    from flask import Response, request
+
+    @app.before_request
+    def _metrics_begin() -> None:
+        if _enabled:
+            rule = request.url_rule.rule if request.url_rule else "unmatched"
+            begin_request(rule)
+
+    @app.after_request
+    def _metrics_end(response):
+        if _enabled:
+            end_request(request.method, response.status_code)
+        return response
+
+    @app.route("/metrics")
+    def metrics_route():
+        if not _enabled:
+            return Response("metrics disabled; set CHINESE_METRICS=1\n", status=404, mimetype="text/plain")
+        return Response(render(), mimetype="text/plain; version=0.0.4")
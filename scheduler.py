@@ -0,0 +1,82 @@
+"""Indexed flashcard queue ordered by predicted recall."""
+
+from __future__ import annotations
+
+import json
+import sqlite3
+from typing import Dict, Optional
+
+from algo import WordPredictor
+from batch_predictor import BatchPredictor, current_states
+
+
+RECALL_THRESHOLD = 0.7
+
+
+def rebuild_queue(conn: sqlite3.Connection, now_ts: float) -> int:
+    """Fill the queue with every word whose recall at *now_ts* is due.
+
+    Recall comes from each word's predictor (see ``current_states``)
+    decayed to *now_ts*; words never practised get the ``WordPredictor``
+    prior.  States replayed because ``predictor_state`` lacked them are
+    stored.  Returns the number of queued cards.
+    """
+    prior = WordPredictor().probability(now_ts)
+    recall: Dict[str, float] = {}
+    states, replayed = current_states(conn)
+    if states:
+        bp = BatchPredictor.from_states(states.values())
+        recall = dict(zip(states, bp.probability(now_ts).tolist()))
+    conn.executemany(
+        "INSERT OR IGNORE INTO predictor_state(simplified, state, last_update_ts) "
+        "VALUES (?,?,?)",
+        [(w, json.dumps(states[w]), states[w]["last_update_ts"]) for w in replayed],
+    )
+    rows = [
+        (word, recall.get(word, prior), freq, pinyin, meaning)
+        for word, freq, pinyin, meaning in conn.execute(
+            "SELECT u.simplified, w.frequency, w.pinyin, w.meaning "
+            "FROM user_words AS u JOIN words AS w ON w.simplified = u.simplified"
+        )
+    ]
+    conn.execute("DELETE FROM flashcard_queue")
+    conn.executemany(
+        "INSERT OR REPLACE INTO flashcard_queue"
+        "(simplified, pass, recall, frequency, pinyin, meaning) "
+        "VALUES (?, 0, ?, ?, ?, ?)",
+        [r for r in rows if r[1] < RECALL_THRESHOLD],
+    )
+    return conn.execute("SELECT COUNT(*) FROM flashcard_queue").fetchone()[0]
+
+
+def next_card(conn: sqlite3.Connection) -> Optional[tuple[str, str, str]]:
+    """Return ``(word, pinyin, meaning)`` of the next card of this session.
+
+    Only cards not yet answered since the queue was rebuilt are served,
+    lowest recall first, then more frequent words; the lookup is one
+    index seek.  None once every card was answered, which ends the
+    session until :func:`rebuild_queue` starts a new one.
+    """
+    return conn.execute(
+        "SELECT simplified, pinyin, meaning FROM flashcard_queue "
+        "WHERE pass = 0 ORDER BY recall, frequency LIMIT 1"
+    ).fetchone()
+
+
+def mark_answered(conn: sqlite3.Connection, word: str) -> None:
+    """Count *word* as answered in this session; :func:`next_card` skips it."""
+    conn.execute(
+        "UPDATE flashcard_queue SET pass = pass + 1 WHERE simplified = ?", (word,)
+    )
+
+
+def update_recall(conn: sqlite3.Connection, recall: Dict[str, float]) -> None:
+    """Re-key queued words by their new recall; drop those no longer due."""
+    conn.executemany(
+        "UPDATE flashcard_queue SET recall = ? WHERE simplified = ?",
+        [(p, w) for w, p in recall.items() if p < RECALL_THRESHOLD],
+    )
+    conn.executemany(
+        "DELETE FROM flashcard_queue WHERE simplified = ?",
+        [(w,) for w, p in recall.items() if p >= RECALL_THRESHOLD],
+    )
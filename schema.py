@@ -0,0 +1,334 @@
+"""Versioned schema migrations for the words database.
+
+Each migration brings the database from ``PRAGMA user_version`` *n - 1*
+to *n*.  :func:`migrate` applies the missing ones in order inside the
+caller's transaction, so it is cheap to call on every start-up.
+"""
+
+from __future__ import annotations
+
+import sqlite3
+import threading
+from typing import Callable, List
+
+from db import connection
+from dictionary_search import refresh_search_index
+from search_words import ensure_vocab_version
+
+
+_WORD_STATS_ADD = (
+    "INSERT INTO word_stats"
+    "(simplified, interactions, known_count, unknown_count, last_seen) "
+    "VALUES (NEW.simplified, 1, NEW.known IS 1, NEW.known IS 0, NEW.timestamp) "
+    "ON CONFLICT(simplified) DO UPDATE SET "
+    "interactions = interactions + 1, "
+    "known_count = known_count + excluded.known_count, "
+    "unknown_count = unknown_count + excluded.unknown_count, "
+    "last_seen = MAX(COALESCE(last_seen, 0), excluded.last_seen);"
+)
+# like the version 1 trigger, but rolled-up events still count for last_seen
+_WORD_STATS_REMOVE = (
+    "UPDATE word_stats SET "
+    "interactions = interactions - 1, "
+    "known_count = known_count - (OLD.known IS 1), "
+    "unknown_count = unknown_count - (OLD.known IS 0), "
+    "last_seen = (SELECT MAX(ts) FROM ("
+    "SELECT MAX(timestamp) AS ts FROM word_interactions WHERE simplified = OLD.simplified "
+    "UNION ALL "
+    "SELECT MAX(last_ts) FROM interaction_rollup WHERE simplified = OLD.simplified)) "
+    "WHERE simplified = OLD.simplified; "
+    "DELETE FROM word_stats WHERE simplified = OLD.simplified AND interactions <= 0;"
+)
+
+
+def create_word_stats_delete_trigger(conn: sqlite3.Connection) -> None:
+    """Create the trigger subtracting deleted interactions from ``word_stats``.
+
+    Compaction drops it while it moves events into ``interaction_rollup``,
+    because those events still belong to the history.
+    """
+    conn.execute(
+        "CREATE TRIGGER IF NOT EXISTS word_stats_delete "
+        f"AFTER DELETE ON word_interactions BEGIN {_WORD_STATS_REMOVE} END"
+    )
+
+
+def _v1_interaction_stats(conn: sqlite3.Connection) -> None:
+    """Index the interaction log and keep per-word aggregates in ``word_stats``."""
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS word_interactions_word_ts "
+        "ON word_interactions(simplified, timestamp)"
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS word_stats (
+            simplified TEXT PRIMARY KEY,
+            interactions INTEGER NOT NULL,
+            known_count INTEGER NOT NULL,
+            unknown_count INTEGER NOT NULL,
+            last_seen INTEGER,
+            FOREIGN KEY(simplified) REFERENCES words(simplified)
+        )
+        """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS word_stats_by_count "
+        "ON word_stats(interactions DESC, simplified)"
+    )
+    add = _WORD_STATS_ADD
+    remove = (
+        "UPDATE word_stats SET "
+        "interactions = interactions - 1, "
+        "known_count = known_count - (OLD.known IS 1), "
+        "unknown_count = unknown_count - (OLD.known IS 0), "
+        "last_seen = (SELECT MAX(timestamp) FROM word_interactions "
+        "WHERE simplified = OLD.simplified) "
+        "WHERE simplified = OLD.simplified; "
+        "DELETE FROM word_stats WHERE simplified = OLD.simplified AND interactions <= 0;"
+    )
+    conn.execute(
+        "CREATE TRIGGER IF NOT EXISTS word_stats_insert "
+        f"AFTER INSERT ON word_interactions BEGIN {add} END"
+    )
+    conn.execute(
+        "CREATE TRIGGER IF NOT EXISTS word_stats_delete "
+        f"AFTER DELETE ON word_interactions BEGIN {remove} END"
+    )
+    conn.execute(
+        "CREATE TRIGGER IF NOT EXISTS word_stats_update "
+        "AFTER UPDATE OF simplified, known, timestamp ON word_interactions "
+        f"BEGIN {remove} {add} END"
+    )
+    conn.execute("DELETE FROM word_stats")
+    conn.execute(
+        "INSERT INTO word_stats"
+        "(simplified, interactions, known_count, unknown_count, last_seen) "
+        "SELECT simplified, COUNT(*), SUM(known IS 1), SUM(known IS 0), MAX(timestamp) "
+        "FROM word_interactions GROUP BY simplified"
+    )
+
+
+def _v2_progress_version(conn: sqlite3.Connection) -> None:
+    """Stamp every change of ``user_words`` in ``db_meta.progress_version``."""
+    ensure_vocab_version(conn)
+    conn.execute(
+        "INSERT OR IGNORE INTO db_meta(key, value) VALUES ('progress_version', 0)"
+    )
+    bump = "UPDATE db_meta SET value = value + 1 WHERE key = 'progress_version';"
+    conn.execute(
+        "CREATE TRIGGER IF NOT EXISTS user_words_version_insert "
+        f"AFTER INSERT ON user_words BEGIN {bump} END"
+    )
+    conn.execute(
+        "CREATE TRIGGER IF NOT EXISTS user_words_version_delete "
+        f"AFTER DELETE ON user_words BEGIN {bump} END"
+    )
+    conn.execute(
+        "CREATE TRIGGER IF NOT EXISTS user_words_version_update "
+        "AFTER UPDATE OF known_probability ON user_words "
+        f"WHEN OLD.known_probability IS NOT NEW.known_probability BEGIN {bump} END"
+    )
+
+
+def _v3_interaction_rollup(conn: sqlite3.Connection) -> None:
+    """Add ``interaction_rollup``, the compacted part of the interaction log.
+
+    Each row stands for *count* identical events of one word in one time
+    bucket, replayed at their mean *timestamp*.  ``word_stats`` already
+    counts them, so only its delete triggers change: ``last_seen`` now
+    also looks at the rollup.
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS interaction_rollup (
+            simplified TEXT NOT NULL,
+            interaction TEXT NOT NULL,
+            known INTEGER,
+            bucket INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            timestamp REAL NOT NULL,
+            first_ts INTEGER NOT NULL,
+            last_ts INTEGER NOT NULL,
+            FOREIGN KEY(simplified) REFERENCES words(simplified)
+        )
+        """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS interaction_rollup_word_ts "
+        "ON interaction_rollup(simplified, timestamp)"
+    )
+    conn.execute("DROP TRIGGER IF EXISTS word_stats_delete")
+    conn.execute("DROP TRIGGER IF EXISTS word_stats_update")
+    create_word_stats_delete_trigger(conn)
+    conn.execute(
+        "CREATE TRIGGER word_stats_update "
+        "AFTER UPDATE OF simplified, known, timestamp ON word_interactions "
+        f"BEGIN {_WORD_STATS_REMOVE} {_WORD_STATS_ADD} END"
+    )
+
+
+def _v4_derived_tables(conn: sqlite3.Connection) -> None:
+    """Create the tables the server derives from the log, texts and audio.
+
+    They used to be created lazily on first use, which put DDL and a lock
+    upgrade on read-only requests.  Tokens cached before ``story_vocab``
+    existed have no vocabulary and are dropped.
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS predictor_state (
+            simplified TEXT PRIMARY KEY,
+            state TEXT NOT NULL,
+            last_update_ts REAL NOT NULL,
+            FOREIGN KEY(simplified) REFERENCES words(simplified)
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS flashcard_queue (
+            simplified TEXT PRIMARY KEY,
+            pass INTEGER NOT NULL DEFAULT 0,
+            recall REAL NOT NULL,
+            frequency INTEGER,
+            pinyin TEXT,
+            meaning TEXT,
+            FOREIGN KEY(simplified) REFERENCES words(simplified)
+        )
+        """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS flashcard_queue_order "
+        "ON flashcard_queue(pass, recall, frequency)"
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS story_tokens (
+            name TEXT PRIMARY KEY,
+            content_hash TEXT NOT NULL,
+            vocab_version INTEGER NOT NULL,
+            tokens TEXT NOT NULL
+        )
+        """
+    )
+    has_vocab = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'story_vocab'"
+    ).fetchone()
+    if not has_vocab:
+        conn.execute("DELETE FROM story_tokens")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS story_vocab (
+            name TEXT NOT NULL,
+            first_pos INTEGER NOT NULL,
+            simplified TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            pinyin TEXT,
+            gloss TEXT,
+            PRIMARY KEY (name, first_pos),
+            UNIQUE (name, simplified)
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS audio_clips (
+            key TEXT PRIMARY KEY,
+            voice TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            label TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            created INTEGER NOT NULL
+        )
+        """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS audio_clips_lookup "
+        "ON audio_clips(voice, kind, label)"
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS char_counts (
+            path TEXT PRIMARY KEY,
+            mtime_ns INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            content_hash TEXT NOT NULL,
+            codepoints BLOB NOT NULL,
+            counts BLOB NOT NULL
+        )
+        """
+    )
+
+
+def _v5_predictor_checkpoint(conn: sqlite3.Connection) -> None:
+    """Add ``predictor_checkpoint``, each word's predictor at its compaction horizon.
+
+    Replays start from it and only apply the raw events from *horizon*
+    on; *params* is the ``algo.params_key`` the state was replayed with.
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS predictor_checkpoint (
+            simplified TEXT PRIMARY KEY,
+            horizon REAL NOT NULL,
+            params TEXT NOT NULL,
+            state TEXT NOT NULL,
+            FOREIGN KEY(simplified) REFERENCES words(simplified)
+        )
+        """
+    )
+
+
+def _v6_search_index(conn: sqlite3.Connection) -> None:
+    """Build the dictionary search index.
+
+    ``/search`` used to build it on first use, a long write on a GET;
+    imports keep it current from here on.
+    """
+    refresh_search_index(conn)
+
+
+MIGRATIONS: List[Callable[[sqlite3.Connection], None]] = [
+    _v1_interaction_stats,
+    _v2_progress_version,
+    _v3_interaction_rollup,
+    _v4_derived_tables,
+    _v5_predictor_checkpoint,
+    _v6_search_index,
+]
+
+_migrated: set[str] = set()
+_lock = threading.Lock()
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def progress_version(conn: sqlite3.Connection) -> int:
+    """Return the ``user_words`` version stamp (0 before migration 2)."""
+    row = conn.execute(
+        "SELECT value FROM db_meta WHERE key = 'progress_version'"
+    ).fetchone()
+    return row[0] if row else 0
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """Apply all pending migrations and return the new schema version."""
+    version = schema_version(conn)
+    for number, step in enumerate(MIGRATIONS[version:], start=version + 1):
+        step(conn)
+        conn.execute(f"PRAGMA user_version = {number}")
+    return len(MIGRATIONS) if version < len(MIGRATIONS) else version
+
+
+def ensure_migrated(db_path: str) -> None:
+    """Run :func:`migrate` once per process for *db_path*."""
+    if db_path in _migrated:
+        return
+    with _lock:
+        if db_path in _migrated:
+            return
+        with connection(db_path, immediate=True) as conn:
+            migrate(conn)
+        _migrated.add(db_path)
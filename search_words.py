@@ -1,9 +1,137 @@
 import sqlite3
-from typing import List, Iterable
-import re
+from typing import Dict, List, Iterable, Union
 
 DB_PATH = 'chinese_words.db'
 
+# Character-class table for the BMP: 1 marks a CJK unified ideograph
+# (U+4E00..U+9FFF), the same range matched by the old per-character regex.
+_CJK_TABLE = bytes(1 if 0x4E00 <= cp <= 0x9FFF else 0 for cp in range(0x10000))
+# Trie key marking the end of a word.  Real keys are single characters,
+# so the empty string can never collide with one.
+_END = ''
+
+
+def is_chinese(ch: str) -> bool:
+    """Return True if the single character *ch* is a CJK ideograph."""
+    cp = ord(ch)
+    return cp < 0x10000 and _CJK_TABLE[cp] == 1
+
+
+def contains_chinese(token: str) -> bool:
+    """Return True if *token* contains at least one CJK ideograph."""
+    return any(is_chinese(ch) for ch in token)
+
+
+class Segmenter:
+    """Longest-match segmenter compiled once from a word list.
+
+    The vocabulary is stored in a character trie, so segmenting a text
+    costs time proportional to its length (times the longest word
+    length) regardless of vocabulary size.  There is no cap on the
+    length of a dictionary word.
+    """
+
+    def __init__(self, words: Iterable[str]) -> None:
+        self._root: Dict[str, dict] = {}
+        self.size = 0
+        for w in words:
+            self.add(w)
+
+    @classmethod
+    def from_db(cls, db_path: str = DB_PATH) -> 'Segmenter':
+        """Compile a segmenter from the ``words`` table."""
+        return cls(load_words(db_path))
+
+    def add(self, word: str) -> None:
+        """Insert *word* into the trie."""
+        if not word:
+            return
+        node = self._root
+        for ch in word:
+            node = node.setdefault(ch, {})
+        if _END not in node:
+            node[_END] = True
+            self.size += 1
+
+    def __contains__(self, word: str) -> bool:
+        node = self._root
+        for ch in word:
+            node = node.get(ch)
+            if node is None:
+                return False
+        return _END in node
+
+    def __len__(self) -> int:
+        return self.size
+
+    def segment(self, text: str) -> List[str]:
+        """Segment *text*; see :func:`segment_text` for the policy."""
+        root = self._root
+        table = _CJK_TABLE
+        n = len(text)
+        i = 0
+        result: List[str] = []
+        append = result.append
+        while i < n:
+            ch = text[i]
+            cp = ord(ch)
+            if cp >= 0x10000 or not table[cp]:
+                append(ch)
+                i += 1
+                continue
+
+            # walk the trie as far as the text allows, remembering the
+            # end of the longest complete word seen on the way
+            end = i + 1
+            node = root.get(ch)
+            j = i + 1
+            while node is not None:
+                if _END in node:
+                    end = j
+                if j >= n:
+                    break
+                node = node.get(text[j])
+                j += 1
+            append(text[i:end])
+            i = end
+        return result
+
+
+def ensure_vocab_version(conn: sqlite3.Connection) -> None:
+    """Create the ``db_meta`` table and the triggers stamping ``words`` edits.
+
+    Every insert, update or delete on ``words`` bumps the
+    ``vocab_version`` counter so caches derived from the vocabulary can
+    tell when they are stale without rescanning the table.  The triggers
+    are dropped together with ``words``, so this must be called again
+    whenever the table is recreated.
+    """
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS db_meta ("
+        "key TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+    )
+    conn.execute(
+        "INSERT OR IGNORE INTO db_meta(key, value) VALUES ('vocab_version', 0)"
+    )
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        conn.execute(
+            f"CREATE TRIGGER IF NOT EXISTS words_version_{event.lower()} "
+            f"AFTER {event} ON words BEGIN "
+            "UPDATE db_meta SET value = value + 1 WHERE key = 'vocab_version'; "
+            "END"
+        )
+
+
+def vocab_version(conn: sqlite3.Connection) -> int:
+    """Return the current ``words`` version stamp (0 if never stamped)."""
+    try:
+        row = conn.execute(
+            "SELECT value FROM db_meta WHERE key = 'vocab_version'"
+        ).fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] if row else 0
+
 
 def load_words(db_path: str = DB_PATH) -> List[str]:
     """Load all simplified words from the database."""
@@ -12,55 +140,30 @@ def load_words(db_path: str = DB_PATH) -> List[str]:
     return [r[0] for r in rows]
 
 
-def segment_text(text: str, words: Iterable[str]) -> List[str]:
+def segment_text(text: str, words: Union[Segmenter, Iterable[str]]) -> List[str]:
     """Segment *text* using known Chinese words.
 
     Non-Chinese characters are returned as-is. Chinese word matching
-    prefers longer words first (up to four characters).
+    prefers the longest dictionary word starting at each position.
+    *words* may be a compiled :class:`Segmenter`; passing a plain word
+    list compiles a temporary one, so callers segmenting many texts
+    should build the segmenter once and reuse it.
     """
-    by_len: dict[int, set[str]] = {}
-    for w in words:
-        by_len.setdefault(len(w), set()).add(w)
-    # Only consider word lengths up to 4 for efficiency
-    lengths = sorted([l for l in by_len.keys() if l <= 4], reverse=True)
-
-    i = 0
-    result: List[str] = []
-    chinese_re = re.compile(r"[\u4e00-\u9fff]+")
-    while i < len(text):
-        ch = text[i]
-        if not chinese_re.match(ch):
-            result.append(ch)
-            i += 1
-            continue
-
-        matched = False
-        for l in lengths:
-            if i + l <= len(text):
-                piece = text[i:i + l]
-                if piece in by_len.get(l, set()):
-                    result.append(piece)
-                    i += l
-                    matched = True
-                    break
-        if not matched:
-            # consume single Chinese character if no word matched
-            result.append(ch)
-            i += 1
-    return result
+    if not isinstance(words, Segmenter):
+        words = Segmenter(words)
+    return words.segment(text)
 
 
 if __name__ == '__main__':
     import sys
-    words = load_words()
     if len(sys.argv) < 2:
         print('Usage: python search_words.py <path>')
         sys.exit(1)
+    segmenter = Segmenter.from_db()
     with open(sys.argv[1], 'r', encoding='utf-8') as f:
         text = f.read()
-    segments = segment_text(text, words)
+    segments = segmenter.segment(text)
     # Only print tokens that contain Chinese characters
-    chinese_re = re.compile(r"[\u4e00-\u9fff]+")
     for w in segments:
-        if chinese_re.search(w):
+        if contains_chinese(w):
             print(w)
@@ -1,33 +1,78 @@
 from __future__ import annotations
 
 from collections import Counter
+import functools
+import glob
 import json
+import os
 import sqlite3
 import re
 import math
 import time
 from pathlib import Path
-from functools import lru_cache
-from flask import Flask, jsonify, request, send_from_directory
-from algo import WordPredictor
-from search_words import load_words, segment_text
+from typing import Iterable, Optional, Tuple
+import numpy as np
+from flask import Flask, Response, jsonify, request, send_file, send_from_directory, stream_with_context
+import metrics
+from algo import WordPredictor, params_key, use_params
+from analyze_characters import CharacterCounter, character_report, store_char_counts
+from batch_predictor import BatchPredictor, current_states, replay_history
+from db import connection
+from dictionary_search import search
+from find_mismatched_words import load_frequency_list, mismatched_words
+from schema import ensure_migrated, progress_version
+from scheduler import RECALL_THRESHOLD, mark_answered, next_card, rebuild_queue, update_recall
+from search_words import contains_chinese
+from story_bundle import StoryBundles
+from token_cache import TokenCache, forget_stories, store_story_tokens
+from vocab_snapshot import vocabulary
+from tts import DEFAULT_VOICE as TTS_DEFAULT_VOICE, AudioCache, story_clip, voice_id, word_clips
+from write_behind import WriteBehindQueue
+from writer import WriterClient
 
 
 DB_PATH = "chinese_words.db"
 STORIES_DIR = Path("stories")
 
-@lru_cache
-def _word_list() -> list[str]:
-    return load_words(DB_PATH)
+LESSONS_DIR = Path("lessons")
+FREQUENCY_PATH = "frequency_list.tsv"
+# hyper-parameters fitted by train_predictor.py; built-in defaults without it
+PREDICTOR_PARAMS = os.environ.get("CHINESE_PREDICTOR_PARAMS", "predictor_params.json")
+
+_token_cache = TokenCache(STORIES_DIR, DB_PATH, write=lambda op, *args: run_write(op, *args))
+_lesson_cache = TokenCache(
+    LESSONS_DIR, DB_PATH, pattern="Lesson*.txt", prefix="lessons/",
+    write=lambda op, *args: run_write(op, *args),
+)
+AUDIO_DIR = Path("audio")
+TTS_VOICE = voice_id(TTS_DEFAULT_VOICE)
+_audio_cache = AudioCache(os.environ.get("CHINESE_AUDIO_CACHE", "audio_cache"))
+
+
+def story_audio_url(name: str) -> Optional[str]:
+    """Return the URL of the pre-synthesised audio of story *name*, if any."""
+    try:
+        text = (STORIES_DIR / f"{name}.txt").read_text(encoding="utf-8")
+    except OSError:
+        return None
+    with connection(DB_PATH) as conn:
+        key = story_clip(conn, TTS_VOICE, text)
+    if key is None or key not in _audio_cache:
+        return None
+    return f"/audio_cache/{key}.wav"
+
+
+_bundles = StoryBundles(_token_cache, AUDIO_DIR, audio_lookup=story_audio_url)
+_frequency_loaded = False
+_char_counter = CharacterCounter(DB_PATH, write=lambda op, *args: run_write(op, *args))
+CHARACTER_PATTERNS = {
+    "stories": str(STORIES_DIR / "story*.txt"),
+    "lessons": str(LESSONS_DIR / "Lesson*.txt"),
+}
+
 
-@lru_cache
 def get_story_tokens(name: str) -> list[str]:
-    path = STORIES_DIR / f"{name}.txt"
-    if not path.exists():
-        return []
-    with open(path, "r", encoding="utf-8") as f:
-        text = f.read()
-    return segment_text(text, _word_list())
+    return _token_cache.tokens(name)
 
 def list_stories() -> list[str]:
     stories = [p.stem for p in STORIES_DIR.glob("*.txt")]
@@ -40,6 +85,19 @@ def list_stories() -> list[str]:
 app = Flask(__name__, static_url_path="", static_folder=".")
 
 
+@app.before_request
+def _migrate_schema() -> None:
+    ensure_migrated(DB_PATH)
+
+
+@app.before_request
+def _predictor_params() -> None:
+    use_params(PREDICTOR_PARAMS)
+
+
+metrics.init_app(app)
+
+
 @app.route("/")
 def index():
     return send_from_directory(".", "index.html")
@@ -64,52 +122,128 @@ def stories_list_route():
 def bopomofo_mapping(name: str):
     """Return a mapping from words in the given story to their bopomofo."""
     tokens = get_story_tokens(name)
-    chinese_re = re.compile(r"[\u4e00-\u9fff]+")
-    words = {t for t in tokens if chinese_re.search(t)}
+    words = {t for t in tokens if contains_chinese(t)}
     if not words:
         return jsonify({})
-    placeholders = ",".join(["?"] * len(words))
-    with sqlite3.connect(DB_PATH) as conn:
-        rows = conn.execute(
-            f"SELECT simplified, bopomofo FROM words WHERE simplified IN ({placeholders})",
-            list(words),
-        ).fetchall()
-    mapping = {w: b for w, b in rows}
-    return jsonify(mapping)
+    return jsonify(vocabulary(DB_PATH).get().lookup(words, "bopomofo"))
+
+
+@app.route("/story_bundle/<name>")
+def story_bundle(name: str):
+    """Return tokens, bopomofo, audio and unknown words of a story at once.
+
+    Tokens are encoded as a table of distinct ``words`` plus a ``tokens``
+    index array.  The response carries a strong ETag and is served
+    gzip-compressed when the client accepts it; a matching
+    ``If-None-Match`` yields 304 without rebuilding anything.
+    """
+    current = _bundles.etag(name)
+    if current is None:
+        return jsonify({"status": "error", "msg": "unknown story"})
+    suffix = "-gz" if "gzip" in request.accept_encodings else ""
+    if request.if_none_match.contains(current + suffix):
+        response = Response(status=304)
+    else:
+        bundle = _bundles.get(name, current)
+        if bundle is None:
+            return jsonify({"status": "error", "msg": "unknown story"})
+        # the bundle's own tag: the story may have changed since `current`
+        current = bundle.etag
+        response = Response(bundle.gzipped if suffix else bundle.body, mimetype="application/json")
+        if suffix:
+            response.headers["Content-Encoding"] = "gzip"
+    response.set_etag(current + suffix)
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+@app.route("/audio_manifest/<name>")
+def audio_manifest(name: str):
+    """List the available audio of a story and of its words.
+
+    Audio is only ever pre-generated by ``tts.py``; words and stories
+    without a cached clip are simply missing from the manifest.
+    """
+    if (AUDIO_DIR / f"{name}.wav").is_file():
+        story = f"/{AUDIO_DIR.name}/{name}.wav"
+    else:
+        story = story_audio_url(name)
+    with connection(DB_PATH) as conn:
+        clips = word_clips(conn, TTS_VOICE, name)
+    return jsonify(
+        {
+            "voice": TTS_VOICE,
+            "story": story,
+            "words": {word: f"/audio_cache/{key}.wav" for word, key in clips.items()},
+        }
+    )
+
+
+@app.route("/audio_cache/<key>.wav")
+def audio_clip(key: str):
+    """Serve a cached clip; supports Range requests and never changes."""
+    if not re.fullmatch(r"[0-9a-f]{64}", key) or key not in _audio_cache:
+        return Response(status=404)
+    # send_file resolves relative paths against the app, not the working directory
+    path = _audio_cache.path(key).resolve()
+    response = send_file(path, mimetype="audio/wav", conditional=True)
+    response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response
 
 
 @app.route("/unknown_words/<name>")
 def unknown_words(name: str):
-    tokens = get_story_tokens(name)
-    chinese_re = re.compile(r"[\u4e00-\u9fff]+")
-    words = {t for t in tokens if chinese_re.search(t)}
-    if not words:
-        return jsonify([])
-    placeholders = ",".join(["?"] * len(words))
-    with sqlite3.connect(DB_PATH) as conn:
+    """Return the story's words the user probably does not know, in story order."""
+    # make sure the story's tokens and vocabulary are current
+    get_story_tokens(name)
+    with connection(DB_PATH) as conn:
         rows = conn.execute(
-            f"SELECT simplified, known_probability FROM user_words WHERE simplified IN ({placeholders})",
-            list(words),
-        ).fetchall()
-    unknown = [w for w, p in rows if p <= 0.30]
-    if not unknown:
-        return jsonify([])
-
-    placeholders = ",".join(["?"] * len(unknown))
-    with sqlite3.connect(DB_PATH) as conn:
-        details = conn.execute(
-            f"SELECT simplified, pinyin, meaning FROM words WHERE simplified IN ({placeholders})",
-            unknown,
+            "SELECT v.simplified, v.pinyin, v.gloss "
+            "FROM story_vocab AS v JOIN user_words AS u ON u.simplified = v.simplified "
+            "WHERE v.name = ? AND u.known_probability <= 0.30 "
+            "ORDER BY v.first_pos",
+            (name,),
         ).fetchall()
+    return jsonify(
+        [{"word": word, "pinyin": pinyin, "meaning": gloss} for word, pinyin, gloss in rows]
+    )
 
-    result = []
-    for word, pinyin, meaning in details:
-        first = meaning.split(';')[0].split(',')[0].strip().rstrip('.')
-        result.append({"word": word, "pinyin": pinyin, "meaning": first})
 
-    # preserve original order
-    result.sort(key=lambda x: unknown.index(x["word"]))
-    return jsonify(result)
+@app.route("/comprehensibility")
+def comprehensibility():
+    """Rank stories and lessons by the share of tokens the user likely knows.
+
+    ``coverage`` weights every word's ``known_probability`` by its number
+    of occurrences; tokens missing from ``user_words`` count as unknown.
+    ``unknown`` is the number of distinct words at or below the
+    ``/unknown_words`` threshold.  The index is refreshed from the files
+    first, which only re-segments texts that changed.
+    """
+    _token_cache.refresh()
+    _lesson_cache.refresh()
+    with connection(DB_PATH) as conn:
+        rows = conn.execute(
+            "SELECT v.name, "
+            "SUM(v.count * COALESCE(u.known_probability, 0)) / SUM(v.count), "
+            "SUM(v.count), COUNT(*), "
+            "SUM(COALESCE(u.known_probability, 0) <= 0.30) "
+            "FROM story_vocab AS v LEFT JOIN user_words AS u ON u.simplified = v.simplified "
+            "GROUP BY v.name ORDER BY 2 DESC, v.name"
+        ).fetchall()
+    return jsonify(
+        [
+            {
+                "name": name.rpartition("/")[2],
+                "kind": "lesson" if name.startswith("lessons/") else "story",
+                "coverage": coverage,
+                "tokens": tokens,
+                "words": words,
+                "unknown": unknown,
+            }
+            for name, coverage, tokens, words, unknown in rows
+        ]
+    )
 
 
 @app.route("/text_selection.js")
@@ -139,16 +273,16 @@ def flashcard_js():
 
 @app.route("/next_word")
 def next_word():
-    """Return the next flashcard word ordered by frequency."""
-    offset = int(request.args.get("offset", 0))
-    with sqlite3.connect(DB_PATH) as conn:
-        row = conn.execute(
-            "SELECT w.simplified, w.pinyin, w.meaning "
-            "FROM words AS w JOIN user_words AS u ON w.simplified = u.simplified "
-            "WHERE u.known_probability < 0.7 "
-            "ORDER BY w.frequency LIMIT 1 OFFSET ?",
-            (offset,),
-        ).fetchone()
+    """Return the flashcard at the head of the review queue.
+
+    ``restart=1`` rebuilds the queue from the current recall predictions,
+    which starts a new session.  Every due card is served once per
+    session; an empty object means the session is over.
+    """
+    if request.args.get("restart") == "1":
+        run_write("rebuild_queue", time.time())
+    with connection(DB_PATH) as conn:
+        row = next_card(conn)
     if not row:
         return jsonify({})
     return jsonify({"word": row[0], "pinyin": row[1], "meaning": row[2]})
@@ -163,60 +297,197 @@ def record_flashcard():
     if not word:
         return jsonify({"status": "error", "msg": "missing word"})
     flag = 1 if known else 0
-    with sqlite3.connect(DB_PATH) as conn:
-        record_interaction(conn, word, "flashcard", flag)
-        conn.commit()
+    run_write("mark_answered", word)
+    submit_interactions([(word, "flashcard", flag, 1, int(time.time()))], DB_PATH)
     return jsonify({"status": "ok"})
 
 
 @app.route("/stats_data")
 def stats_data():
-    """Return basic statistics derived from interaction logs."""
-    with sqlite3.connect(DB_PATH) as conn:
+    """Return basic statistics derived from interaction logs.
+
+    Reads the trigger-maintained ``word_stats`` aggregates, so the cost
+    grows with the number of words rather than the number of events.
+    """
+    with connection(DB_PATH) as conn:
         rows = conn.execute(
-            "SELECT w.simplified, u.known_probability, COUNT(*) "
-            "FROM word_interactions AS w "
-            "JOIN user_words AS u ON w.simplified = u.simplified "
-            "GROUP BY w.simplified ORDER BY COUNT(*) DESC, w.simplified"
+            "SELECT s.simplified, u.known_probability, s.interactions, "
+            "s.known_count, s.unknown_count, s.last_seen "
+            "FROM word_stats AS s "
+            "JOIN user_words AS u ON s.simplified = u.simplified "
+            "ORDER BY s.interactions DESC, s.simplified"
         ).fetchall()
     data = [
         {
             "word": word,
             "probability": prob,
             "interactions": count,
+            "known": known,
+            "unknown": unknown,
+            "last_seen": last_seen,
         }
-        for word, prob, count in rows
+        for word, prob, count, known, unknown, last_seen in rows
     ]
     return jsonify(data)
 
 
+FORECAST_MAX_DAYS = 365
+# (cache key, words, predictors) of the last /forecast
+_forecaster: tuple[tuple, list[str], BatchPredictor] | None = None
+
+
+def load_forecaster(conn: sqlite3.Connection) -> tuple[list[str], BatchPredictor]:
+    """Return every practised word and its predictor (see ``current_states``).
+
+    Words without stored state are replayed but not stored, so the route
+    stays read-only.  The states are parsed once and reused until
+    ``progress_version`` or any predictor parameter (decay rates, priors,
+    learning rate; see ``params_key``) changes.
+    """
+    global _forecaster
+    key = (progress_version(conn), params_key())
+    cached = _forecaster
+    if cached is not None and cached[0] == key:
+        return cached[1], cached[2]
+    states, _ = current_states(conn)
+    words = list(states)
+    bp = BatchPredictor.from_states(states.values())
+    _forecaster = (key, words, bp)
+    return words, bp
+
+
+@app.route("/forecast")
+def forecast():
+    """Project the recall of every practised word into the future.
+
+    ``days`` (default 30, at most 365) is sampled at ``points`` evenly
+    spaced times (default one per day) starting now.  For each time the
+    response holds the expected number of known words and the number at
+    or above the flashcard threshold; ``words=a,b`` adds the curves of
+    those words.  Nothing is written and no predictor is replayed.
+    """
+    try:
+        days = min(max(float(request.args.get("days", 30)), 0), FORECAST_MAX_DAYS)
+        points = int(request.args.get("points", int(days) + 1))
+        points = min(max(points, 1), FORECAST_MAX_DAYS + 1)
+    except ValueError:
+        return jsonify({"status": "error", "msg": "bad days or points"})
+    now = time.time()
+    times = np.linspace(now, now + days * 86400, points)
+    with connection(DB_PATH) as conn:
+        words, bp = load_forecaster(conn)
+    with metrics.timer("forecast"):
+        probs = bp.forecast(times)
+    data = {
+        "times": times.tolist(),
+        "threshold": RECALL_THRESHOLD,
+        "words_total": len(words),
+        "expected_known": probs.sum(axis=0).tolist(),
+        "above_threshold": (probs >= RECALL_THRESHOLD).sum(axis=0).tolist(),
+    }
+    wanted = [w for w in request.args.get("words", "").split(",") if w]
+    if wanted:
+        index = {w: i for i, w in enumerate(words)}
+        data["words"] = {w: probs[index[w]].tolist() for w in wanted if w in index}
+    return jsonify(data)
+
+
+@app.route("/character_stats")
+def character_stats():
+    """Return character frequencies of the stories or lessons with coverage.
+
+    ``source`` is ``stories`` (default) or ``lessons``; ``top`` limits the
+    per-character list (default 100).  Only files changed since the last
+    call are recounted.
+    """
+    source = request.args.get("source", "stories")
+    if source not in CHARACTER_PATTERNS:
+        return jsonify({"status": "error", "msg": "unknown source"})
+    try:
+        top = max(int(request.args.get("top", 100)), 0)
+    except ValueError:
+        return jsonify({"status": "error", "msg": "bad top"})
+    files = sorted(glob.glob(CHARACTER_PATTERNS[source]))
+    with metrics.timer("character_count"):
+        cps, counts = _char_counter.counts(files)
+    sorted_counts = [(chr(c), n) for c, n in zip(cps.tolist(), counts.tolist())]
+    return jsonify(character_report(int(counts.sum()), sorted_counts, FREQUENCY_PATH, top))
+
+
+def load_general_frequencies() -> None:
+    """Load ``frequency_list.tsv`` into its table once per process.
+
+    The file is only parsed again when it changed since the last load,
+    which also refreshes the search index.
+    """
+    global _frequency_loaded
+    if not _frequency_loaded:
+        run_write("frequency_list", FREQUENCY_PATH)
+        _frequency_loaded = True
+
+
+@app.route("/mismatched_words")
+def mismatched_words_route():
+    """Return words frequent in general texts but rare in the user's texts.
+
+    ``min_freq`` (default 300) drops rarer entries of the general list and
+    ``limit`` (default 50, at most 1000) caps the result.  The frequency
+    list is loaded into its indexed table on the first call.
+    """
+    try:
+        min_freq = int(request.args.get("min_freq", 300))
+        limit = min(max(int(request.args.get("limit", 50)), 1), 1000)
+    except ValueError:
+        return jsonify({"status": "error", "msg": "bad min_freq or limit"})
+    load_general_frequencies()
+    with connection(DB_PATH) as conn:
+        rows = mismatched_words(conn, min_freq=min_freq, limit=limit)
+    return jsonify(
+        [
+            {
+                "word": word,
+                "general": general,
+                "mine": mine,
+                "rank": rank,
+                "pinyin": pinyin,
+                "gloss": gloss,
+            }
+            for word, general, mine, rank, pinyin, gloss in rows
+        ]
+    )
+
+
+@app.route("/search")
+def search_route():
+    """Search the dictionary by characters, pinyin, bopomofo or gloss.
+
+    ``q`` is matched as a prefix (``ni``, ``xian zai``, ``ㄨㄛ``, ``我``,
+    ``know``); ``limit`` (default 20, at most 100) caps the result.  The
+    index is kept current by the migrations and imports, so searching
+    only reads.
+    """
+    query = request.args.get("q", "")
+    try:
+        limit = min(max(int(request.args.get("limit", 20)), 1), 100)
+    except ValueError:
+        return jsonify({"status": "error", "msg": "bad limit"})
+    load_general_frequencies()
+    with connection(DB_PATH) as conn:
+        vocab = vocabulary(DB_PATH).get(conn)
+        with metrics.timer("search"):
+            results = search(conn, query, vocab, limit)
+    return jsonify(results)
+
+
 @app.route("/recalculate", methods=["POST"])
 def recalculate_probabilities():
-    """Recompute known probabilities using the WordPredictor algorithm."""
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.row_factory = sqlite3.Row
-        rows = conn.execute(
-            "SELECT simplified, interaction, known, timestamp "
-            "FROM word_interactions ORDER BY simplified, timestamp"
-        ).fetchall()
+    """Rebuild every word's predictor state from the full interaction log.
 
-        events: dict[str, list[sqlite3.Row]] = {}
-        for row in rows:
-            events.setdefault(row["simplified"], []).append(row)
-
-        now = time.time()
-        for word, evs in events.items():
-            wp = WordPredictor()
-            for ev in evs:
-                mode = ev["interaction"].split("_")[0]
-                outcome = int(ev["known"] or 0)
-                wp.update(mode, outcome, ev["timestamp"])
-            prob = float(wp.probability(now))
-            conn.execute(
-                "UPDATE user_words SET known_probability = ? WHERE simplified = ?",
-                (prob, word),
-            )
-        conn.commit()
+    Probabilities are kept current by :func:`record_interaction`; a full
+    replay is only needed after hyper-parameter changes or manual edits
+    of ``word_interactions``.
+    """
+    run_write("recalculate", time.time())
     return jsonify({"status": "ok"})
 
 
@@ -245,7 +516,7 @@ def database_js():
 def db_schema():
     """Return list of tables and their columns."""
     schema = {}
-    with sqlite3.connect(DB_PATH) as conn:
+    with connection(DB_PATH) as conn:
         tables = conn.execute(
             "SELECT name FROM sqlite_master WHERE type='table' ORDER BY name"
         ).fetchall()
@@ -255,16 +526,115 @@ def db_schema():
     return jsonify(schema)
 
 
+TABLE_PAGE_SIZE = 200
+TABLE_MAX_PAGE_SIZE = 1000
+
+
+def _pageable_tables(conn: sqlite3.Connection) -> set[str]:
+    """Return the tables ``/table/<name>`` can page by rowid.
+
+    ``WITHOUT ROWID`` tables and the shadow tables of virtual tables
+    (e.g. ``search_index_idx``) have no usable rowid and are left out.
+    """
+    listed = conn.execute("PRAGMA table_list").fetchall()
+    if listed:
+        return {
+            name
+            for schema, name, kind, _, without_rowid, _ in listed
+            if schema == "main" and kind in ("table", "virtual") and not without_rowid
+            and name != "sqlite_schema"
+        }
+    # SQLite before 3.37 has no table_list
+    rows = conn.execute("SELECT name, sql FROM sqlite_master WHERE type='table'").fetchall()
+    virtual = [n for n, sql in rows if (sql or "").upper().startswith("CREATE VIRTUAL TABLE")]
+    return {
+        n
+        for n, sql in rows
+        if "WITHOUT ROWID" not in (sql or "").upper()
+        and not any(n.startswith(v + "_") for v in virtual)
+    }
+
+
+def _table_row(columns: list[str], values) -> dict:
+    """Map a row to a JSON object; BLOBs become hex strings."""
+    return {
+        c: v.hex() if isinstance(v, bytes) else v for c, v in zip(columns, values)
+    }
+
+
+def _table_query(
+    conn: sqlite3.Connection, name: str, after: int, args
+) -> tuple[str, list, list[str]] | str:
+    """Build a keyset query for ``/table/<name>`` or return an error message."""
+    if name not in _pageable_tables(conn):
+        return f"unknown table {name!r}"
+    all_columns = [c[1] for c in conn.execute(f'PRAGMA table_info("{name}")')]
+    columns = all_columns
+    if args.get("columns"):
+        columns = [c for c in args["columns"].split(",") if c]
+        bad = [c for c in columns if c not in all_columns]
+        if bad:
+            return f"unknown column {bad[0]!r}"
+
+    where = ["rowid > ?"]
+    params: list = [after]
+    for spec in args.getlist("filter"):
+        column, sep, value = spec.partition(":")
+        if not sep or column not in all_columns:
+            return f"bad filter {spec!r}"
+        where.append(f'"{column}" = ?')
+        params.append(value)
+    select = ", ".join(f'"{c}"' for c in columns)
+    sql = (
+        f'SELECT rowid, {select} FROM "{name}" '
+        f"WHERE {' AND '.join(where)} ORDER BY rowid"
+    )
+    return sql, params, columns
+
+
 @app.route("/table/<name>")
 def table_data(name: str):
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.row_factory = sqlite3.Row
-        try:
-            rows = conn.execute(f"SELECT * FROM {name}").fetchall()
-        except sqlite3.Error:
-            return jsonify([])
-        data = [dict(row) for row in rows]
-    return jsonify(data)
+    """Return rows of a table one page at a time.
+
+    Pages are selected by rowid keyset: pass the ``next`` value of a
+    response as ``after`` to get the following page.  ``columns`` is a
+    comma-separated projection, each ``filter=column:value`` adds an
+    equality condition and ``limit`` sets the page size.  With
+    ``format=ndjson`` all remaining rows are streamed one JSON object per
+    line as they are read from the cursor.
+    """
+    try:
+        limit = min(max(int(request.args.get("limit", TABLE_PAGE_SIZE)), 1), TABLE_MAX_PAGE_SIZE)
+        after = int(request.args.get("after", 0))
+    except ValueError:
+        return jsonify({"status": "error", "msg": "bad limit or cursor"})
+
+    try:
+        with connection(DB_PATH) as conn:
+            query = _table_query(conn, name, after, request.args)
+            if isinstance(query, str):
+                return jsonify({"status": "error", "msg": query})
+            sql, params, columns = query
+            if request.args.get("format") != "ndjson":
+                rows = conn.execute(f"{sql} LIMIT ?", params + [limit]).fetchall()
+    except sqlite3.Error as e:
+        return jsonify({"status": "error", "msg": str(e)})
+
+    if request.args.get("format") == "ndjson":
+        def generate():
+            try:
+                with connection(DB_PATH) as conn:
+                    for row in conn.execute(sql, params):
+                        yield json.dumps(_table_row(columns, row[1:]), ensure_ascii=False) + "\n"
+            except sqlite3.Error as e:
+                # the status line is gone; the last line reports the error
+                yield json.dumps({"status": "error", "msg": str(e)}) + "\n"
+
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+    data = [_table_row(columns, row[1:]) for row in rows]
+    next_after = rows[-1][0] if len(rows) == limit else None
+    return jsonify({"rows": data, "columns": columns, "next": next_after})
 
 
 def probability_from_interactions(count: int) -> float:
@@ -288,34 +658,273 @@ def probability_from_interactions(count: int) -> float:
     return p
 
 
-def record_interaction(conn: sqlite3.Connection, word: str, interaction: str, known: int | None) -> None:
-    """Insert a single interaction entry into the database."""
-    ts = int(time.time())
-    conn.execute(
+def load_predictors(
+    conn: sqlite3.Connection, words: Iterable[str]
+) -> dict[str, WordPredictor]:
+    """Return the stored predictors for *words* in one query.
+
+    Words without stored state (e.g. logged before ``predictor_state``
+    existed) are replayed from their history (see ``replay_history``) once.
+    """
+    words_json = json.dumps(list(words), ensure_ascii=False)
+    predictors = {
+        word: WordPredictor.from_dict(json.loads(state))
+        for word, state in conn.execute(
+            "SELECT simplified, state FROM predictor_state "
+            "WHERE simplified IN (SELECT value FROM json_each(?))",
+            (words_json,),
+        )
+    }
+    with metrics.timer("predictor_replay"):
+        replayed, bp, _ = replay_history(
+            conn,
+            "WHERE simplified IN (SELECT value FROM json_each(?)) "
+            "AND simplified NOT IN (SELECT simplified FROM predictor_state)",
+            (words_json,),
+        )
+    for i, word in enumerate(replayed):
+        predictors[word] = bp.predictor(i)
+    return predictors
+
+
+def load_predictor(conn: sqlite3.Connection, word: str) -> WordPredictor:
+    """Return the stored predictor for *word*, or a fresh one."""
+    return load_predictors(conn, [word]).get(word) or WordPredictor()
+
+
+def save_predictors(
+    conn: sqlite3.Connection,
+    predictors: dict[str, WordPredictor],
+    now_ts: Optional[float] = None,
+) -> None:
+    """Store *predictors* and refresh the words' ``known_probability``.
+
+    ``known_probability`` is the recall probability at *now_ts* (default:
+    now), like after :func:`rebuild_predictor_state`; the stored state
+    itself stays at each word's last update.
+    """
+    now_ts = time.time() if now_ts is None else now_ts
+    states = {word: wp.to_dict() for word, wp in predictors.items()}
+    conn.executemany(
+        "INSERT OR REPLACE INTO predictor_state(simplified, state, last_update_ts) "
+        "VALUES (?,?,?)",
+        [(word, json.dumps(st), st["last_update_ts"]) for word, st in states.items()],
+    )
+    probs = BatchPredictor.from_states(states.values()).probability(now_ts)
+    recall = dict(zip(states, probs.tolist()))
+    conn.executemany(
+        "UPDATE user_words SET known_probability = ? WHERE simplified = ?",
+        [(p, word) for word, p in recall.items()],
+    )
+    # same time base as rebuild_queue, so queue keys stay comparable
+    update_recall(conn, recall)
+
+
+def save_predictor(conn: sqlite3.Connection, word: str, wp: WordPredictor) -> None:
+    """Store *wp* and refresh the word's ``known_probability``."""
+    save_predictors(conn, {word: wp})
+
+
+# (word, interaction, known, repeat, timestamp)
+Interaction = Tuple[str, str, Optional[int], int, int]
+
+
+def record_interactions(conn: sqlite3.Connection, events: list[Interaction]) -> None:
+    """Insert a batch of interactions and apply them to the predictors.
+
+    Each event is logged *repeat* times with its timestamp using a single
+    ``executemany``; the affected predictors are loaded and stored once
+    per batch, so ``known_probability`` stays current without replaying
+    the history.
+    """
+    if not events:
+        return
+    predictors = load_predictors(conn, {e[0] for e in events})
+    conn.executemany(
         "INSERT INTO word_interactions(simplified, interaction, known, timestamp) VALUES (?,?,?,?)",
-        (word, interaction, known, ts),
+        [
+            (word, interaction, known, ts)
+            for word, interaction, known, repeat, ts in events
+            for _ in range(repeat)
+        ],
+    )
+    for word, interaction, known, repeat, ts in events:
+        wp = predictors.setdefault(word, WordPredictor())
+        mode = interaction.split("_")[0]
+        outcome = int(known or 0)
+        for _ in range(repeat):
+            wp.update(mode, outcome, ts)
+    save_predictors(conn, predictors)
+
+
+def record_interaction(
+    conn: sqlite3.Connection,
+    word: str,
+    interaction: str,
+    known: int | None,
+    repeat: int = 1,
+) -> None:
+    """Insert *repeat* identical interactions with the current timestamp."""
+    record_interactions(conn, [(word, interaction, known, repeat, int(time.time()))])
+
+
+def rebuild_predictor_state(conn: sqlite3.Connection, now_ts: float) -> None:
+    """Replay the log and overwrite ``predictor_state``.
+
+    Only needed after changing hyper-parameters or editing the log by
+    hand; ``known_probability`` is set to the recall probability at
+    *now_ts*.  The parameter file ``PREDICTOR_PARAMS`` is reloaded first
+    if it changed.  Words start from their ``predictor_checkpoint``;
+    checkpoints made with other parameters are recomputed and stored.
+    """
+    use_params(PREDICTOR_PARAMS)
+    with metrics.timer("predictor_replay"):
+        words, bp, refreshed = replay_history(conn)
+    probs = bp.probability(now_ts)
+    conn.execute("DELETE FROM predictor_state")
+    conn.executemany(
+        "INSERT INTO predictor_state(simplified, state, last_update_ts) VALUES (?,?,?)",
+        (
+            (word, json.dumps(bp.predictor(i).to_dict()), float(bp.last_update_ts[i]))
+            for i, word in enumerate(words)
+        ),
+    )
+    conn.executemany(
+        "UPDATE user_words SET known_probability = ? WHERE simplified = ?",
+        zip(probs.tolist(), words),
     )
+    conn.executemany(
+        "UPDATE predictor_checkpoint SET state = ?, params = ? WHERE simplified = ?",
+        [(json.dumps(st), params_key(), word) for word, st in refreshed.items()],
+    )
+
+
+def _apply_batches(conn: sqlite3.Connection, batches: list[list[Interaction]]) -> None:
+    # spilled batches come back from JSON with lists for tuples
+    record_interactions(conn, [tuple(e) for batch in batches for e in batch])
+
+
+_writer: WriteBehindQueue | None = None
+
+
+def enable_write_behind(flush_interval: float = 0.5, db_path: str | None = None) -> None:
+    """Group-commit interactions from many requests on a background thread.
+
+    Requests return once their events are queued; a flush happens at most
+    *flush_interval* seconds after the first queued event and on exit.
+    ``known_probability`` therefore lags behind by up to that interval.
+    """
+    global _writer
+    if _writer is None:
+        _writer = WriteBehindQueue(db_path or DB_PATH, _apply_batches, flush_interval)
+
+
+def submit_interactions(events: list[Interaction], db_path: str | None = None) -> None:
+    """Record *events* through the shared writer, the write-behind queue or directly."""
+    db_path = db_path or DB_PATH
+    if _writer is not None and _writer.db_path == db_path and _remote is None:
+        # plain tuples, so a batch that cannot be committed can be spilled
+        _writer.submit([tuple(e) for e in events])
+        return
+    run_write("interactions", events, db_path=db_path)
+
+
+def _record_events(conn: sqlite3.Connection, events: list[list]) -> None:
+    # events arrive as JSON lists when sent to the writer process
+    record_interactions(conn, [tuple(e) for e in events])
+
 
+def _current_params(op):
+    """Wrap a write operation to reload ``PREDICTOR_PARAMS`` first.
 
-def update_user_progress(known: list[str], unknown: list[str], db_path: str = DB_PATH) -> None:
-    """Record reading interactions without modifying user progress directly."""
+    The writer process serves no requests, so the ``before_request`` hook
+    that keeps the parameters current never runs there.
+    """
+    @functools.wraps(op)
+    def run(conn: sqlite3.Connection, *args):
+        use_params(PREDICTOR_PARAMS)
+        return op(conn, *args)
+    return run
+
+
+# Every database write made on behalf of a request, by name.  In
+# multi-worker mode they all run in the single writer process; request
+# handlers themselves only read (the schema is migrated at start-up).
+WRITE_OPS = {
+    "interactions": _current_params(_record_events),
+    "mark_answered": mark_answered,
+    "rebuild_queue": _current_params(rebuild_queue),
+    "recalculate": rebuild_predictor_state,
+    "frequency_list": load_frequency_list,
+    "story_tokens": store_story_tokens,
+    "forget_stories": forget_stories,
+    "char_counts": store_char_counts,
+}
+
+_remote: WriterClient | None = None
+
+
+def use_writer(socket_path: str, db_path: str | None = None) -> None:
+    """Send the writes for *db_path* to the writer listening on *socket_path*.
+
+    Enabled by ``CHINESE_WRITER_SOCKET``, which ``gunicorn.conf.py`` sets
+    for its workers.
+    """
+    global _remote
+    _remote = WriterClient(socket_path, db_path or DB_PATH)
+
+
+def run_write(op: str, *args, db_path: str | None = None):
+    """Run the write operation *op* from ``WRITE_OPS`` and return its result.
+
+    Without a shared writer the operation runs in-process in a
+    ``BEGIN IMMEDIATE`` transaction, so it waits for the write lock up to
+    the busy timeout instead of failing on a lock upgrade.  *db_path*
+    defaults to ``DB_PATH`` as it is when called.
+    """
+    db_path = db_path or DB_PATH
+    if _remote is not None and _remote.db_path == db_path:
+        return _remote.call(op, *args)
+    with connection(db_path, immediate=True) as conn:
+        return WRITE_OPS[op](conn, *args)
+
+
+def update_user_progress(known: list[str], unknown: list[str], db_path: str | None = None) -> None:
+    """Record reading interactions and advance each word's predictor."""
+    db_path = db_path or DB_PATH
     counts = Counter(known + unknown)
     known_set = set(known)
-    unknown_set = set(unknown)
-    with sqlite3.connect(db_path) as conn:
-        for word, count in counts.items():
-            # ensure the word exists in the vocabulary list
-            exists = conn.execute(
-                "SELECT 1 FROM user_words WHERE simplified = ?",
-                (word,),
-            ).fetchone()
-            if not exists:
-                continue
-            interaction = "read_known" if word in known_set else "read_unknown"
-            flag = 1 if word in known_set else 0
-            for _ in range(count):
-                record_interaction(conn, word, interaction, flag)
-        conn.commit()
+    if not counts:
+        return
+    with connection(db_path) as conn:
+        # ensure the words exist in the vocabulary list
+        existing = {
+            row[0]
+            for row in conn.execute(
+                "SELECT simplified FROM user_words "
+                "WHERE simplified IN (SELECT value FROM json_each(?))",
+                (json.dumps(list(counts), ensure_ascii=False),),
+            )
+        }
+    ts = int(time.time())
+    events = [
+        (
+            word,
+            "read_known" if word in known_set else "read_unknown",
+            1 if word in known_set else 0,
+            count,
+            ts,
+        )
+        for word, count in counts.items()
+        if word in existing
+    ]
+    submit_interactions(events, db_path)
+
+
+if os.environ.get("CHINESE_WRITER_SOCKET"):
+    use_writer(os.environ["CHINESE_WRITER_SOCKET"])
+elif os.environ.get("CHINESE_WRITE_BEHIND") == "1":
+    enable_write_behind()
 
 
 if __name__ == "__main__":
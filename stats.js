@@ -12,11 +12,82 @@ async function loadStats() {
     });
 }
 
+async function loadMismatched() {
+    const minFreq = document.getElementById('min-freq').value;
+    const limit = document.getElementById('mismatch-limit').value;
+    const res = await fetch(`/mismatched_words?min_freq=${minFreq}&limit=${limit}`);
+    const data = await res.json();
+    if (data.status === 'error') return;
+    const tbody = document.querySelector('#mismatched tbody');
+    tbody.innerHTML = '';
+    data.forEach(entry => {
+        const tr = document.createElement('tr');
+        tr.innerHTML = `<td>${entry.rank}</td>` +
+            `<td>${entry.word}</td>` +
+            `<td>${entry.pinyin || ''}</td>` +
+            `<td>${entry.gloss || ''}</td>` +
+            `<td>${entry.general}</td>` +
+            `<td>${entry.mine}</td>`;
+        tbody.append(tr);
+    });
+}
+
+function drawForecast(data) {
+    const canvas = document.getElementById('forecast');
+    const ctx = canvas.getContext('2d');
+    const pad = 30;
+    const w = canvas.width - 2 * pad;
+    const h = canvas.height - 2 * pad;
+    const n = data.times.length;
+    const top = Math.max(data.words_total, 1);
+    ctx.clearRect(0, 0, canvas.width, canvas.height);
+    ctx.strokeStyle = '#999';
+    ctx.strokeRect(pad, pad, w, h);
+    ctx.fillStyle = '#333';
+    ctx.fillText(String(top), 2, pad + 4);
+    ctx.fillText('0', 2, pad + h);
+    const series = [
+        [data.expected_known, '#4a90b8'],
+        [data.above_threshold, '#d9534f'],
+    ];
+    series.forEach(([values, color]) => {
+        ctx.strokeStyle = color;
+        ctx.beginPath();
+        values.forEach((v, i) => {
+            const x = pad + (n > 1 ? i / (n - 1) : 0) * w;
+            const y = pad + h - (v / top) * h;
+            if (i === 0) ctx.moveTo(x, y); else ctx.lineTo(x, y);
+        });
+        ctx.stroke();
+    });
+    const last = n - 1;
+    document.getElementById('forecast-legend').textContent =
+        `Blue: expected known words (${data.expected_known[0].toFixed(0)} now, ` +
+        `${data.expected_known[last].toFixed(0)} at the end). ` +
+        `Red: words at or above ${Math.round(data.threshold * 100)}% recall ` +
+        `(${data.above_threshold[0]} now, ${data.above_threshold[last]} at the end) ` +
+        `of ${data.words_total} practised words.`;
+}
+
+async function loadForecast() {
+    const days = document.getElementById('forecast-days').value;
+    const res = await fetch(`/forecast?days=${days}`);
+    const data = await res.json();
+    if (data.status === 'error') return;
+    drawForecast(data);
+}
+
 async function recalc() {
     await fetch('/recalculate', { method: 'POST' });
     loadStats();
+    loadForecast();
 }
 
 document.getElementById('recalc').addEventListener('click', recalc);
+document.getElementById('min-freq').addEventListener('change', loadMismatched);
+document.getElementById('mismatch-limit').addEventListener('change', loadMismatched);
+document.getElementById('forecast-days').addEventListener('change', loadForecast);
 
 loadStats();
+loadMismatched();
+loadForecast();
@@ -0,0 +1,159 @@
+"""Everything the reading page needs for one story, in one cached response."""
+
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, NamedTuple, Optional
+
+from db import connection
+from schema import progress_version
+from search_words import contains_chinese, vocab_version
+from token_cache import TokenCache
+from vocab_snapshot import VocabSnapshot, vocabulary
+
+
+DEFAULT_MAXSIZE = 64
+UNKNOWN_THRESHOLD = 0.30
+
+
+class Bundle(NamedTuple):
+    etag: str
+    body: bytes
+    gzipped: bytes
+
+
+def encode_tokens(tokens: list[str]) -> tuple[list[str], list[int]]:
+    """Split *tokens* into a table of distinct tokens and an index array.
+
+    ``[words[i] for i in index]`` gives back the original list.
+    """
+    ids: dict[str, int] = {}
+    index = [ids.setdefault(token, len(ids)) for token in tokens]
+    return list(ids), index
+
+
+def build_bundle(
+    conn: sqlite3.Connection,
+    name: str,
+    tokens: list[str],
+    audio: Optional[str],
+    vocab: VocabSnapshot,
+) -> dict:
+    """Assemble the bundle of story *name* from its tokens and the database.
+
+    The result holds the tokens encoded with :func:`encode_tokens`, the
+    bopomofo of every dictionary word in the story from the snapshot
+    *vocab*, the audio URL (or ``None``) and the words at or below
+    :data:`UNKNOWN_THRESHOLD` in story order, i.e. what ``/story_tokens``, ``/bopomofo_mapping``,
+    ``/unknown_words`` and the audio probe return separately.
+    """
+    words, index = encode_tokens(tokens)
+    bopomofo = vocab.lookup((w for w in words if contains_chinese(w)), "bopomofo")
+    unknown = [
+        {"word": word, "pinyin": pinyin, "meaning": gloss}
+        for word, pinyin, gloss in conn.execute(
+            "SELECT v.simplified, v.pinyin, v.gloss "
+            "FROM story_vocab AS v JOIN user_words AS u ON u.simplified = v.simplified "
+            "WHERE v.name = ? AND u.known_probability <= ? "
+            "ORDER BY v.first_pos",
+            (name, UNKNOWN_THRESHOLD),
+        )
+    ]
+    return {
+        "name": name,
+        "words": words,
+        "tokens": index,
+        "bopomofo": bopomofo,
+        "audio": audio,
+        "unknown": unknown,
+    }
+
+
+class StoryBundles:
+    """Precomputed, gzip-compressed story bundles with strong ETags.
+
+    The ETag of a bundle is derived from the SHA-1 of the story file, the
+    ``vocab_version`` and ``progress_version`` stamps of the database and
+    the story's audio URL, so it changes exactly when the bundle content
+    may change.  The audio is ``<audio_dir>/<name>.wav`` if present and
+    otherwise whatever *audio_lookup* returns for the story.  Checking the
+    tag costs a ``stat`` and a few queries; the bundle itself is only
+    rebuilt when the tag differs from the cached one.  At most *maxsize*
+    stories are kept.
+    """
+
+    def __init__(
+        self,
+        token_cache: TokenCache,
+        audio_dir: Path | str = "audio",
+        maxsize: int = DEFAULT_MAXSIZE,
+        audio_lookup: Optional[Callable[[str], Optional[str]]] = None,
+    ) -> None:
+        self.token_cache = token_cache
+        self.audio_dir = Path(audio_dir)
+        self.audio_lookup = audio_lookup
+        self.maxsize = maxsize
+        self._cache: OrderedDict[str, Bundle] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _audio_url(self, name: str) -> Optional[str]:
+        if (self.audio_dir / f"{name}.wav").is_file():
+            return f"/{self.audio_dir.name}/{name}.wav"
+        if self.audio_lookup is not None:
+            return self.audio_lookup(name)
+        return None
+
+    def _tag(self, conn: sqlite3.Connection, digest: str, audio: Optional[str]) -> str:
+        key = f"{digest}:{vocab_version(conn)}:{progress_version(conn)}:{audio}"
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def etag(self, name: str) -> Optional[str]:
+        """Return the current ETag of story *name*, or None if it does not exist."""
+        digest = self.token_cache.content_hash(name)
+        if digest is None:
+            return None
+        with connection(self.token_cache.db_path) as conn:
+            return self._tag(conn, digest, self._audio_url(name))
+
+    def get(self, name: str, etag: Optional[str] = None) -> Optional[Bundle]:
+        """Return the bundle of story *name*, rebuilding it if it is stale.
+
+        *etag* is the story's current :meth:`etag` if the caller already
+        computed it.  A rebuilt bundle is tagged from the same read of the
+        file as its tokens, so its ETag may be newer than *etag* when the
+        story was edited in between; callers must send ``bundle.etag``.
+        """
+        etag = etag or self.etag(name)
+        if etag is None:
+            return None
+        with self._lock:
+            cached = self._cache.get(name)
+            if cached is not None and cached.etag == etag:
+                self._cache.move_to_end(name)
+                return cached
+        tokens, digest = self.token_cache.tokens_with_hash(name)
+        if digest is None:
+            return None
+        audio = self._audio_url(name)
+        with connection(self.token_cache.db_path) as conn:
+            tag = self._tag(conn, digest, audio)
+            vocab = vocabulary(self.token_cache.db_path).get(conn)
+            data = build_bundle(conn, name, tokens, audio, vocab)
+        body = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        bundle = Bundle(tag, body, gzip.compress(body, compresslevel=6, mtime=0))
+        with self._lock:
+            self._cache[name] = bundle
+            self._cache.move_to_end(name)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return bundle
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
@@ -1,13 +1,7 @@
 let stories = [];
 let currentIndex = 0;
 
-async function loadTokens(name) {
-    const [tokenRes, bpmfRes] = await Promise.all([
-        fetch(`/story_tokens/${name}`),
-        fetch(`/bopomofo_mapping/${name}`)
-    ]);
-    const tokens = await tokenRes.json();
-    const bpmfMap = await bpmfRes.json();
+function renderTokens(tokens, bpmfMap) {
     const container = document.getElementById('text');
     container.innerHTML = '';
     const chineseRE = /[\u4e00-\u9fff]/;
@@ -50,9 +44,7 @@ async function loadTokens(name) {
     });
 }
 
-async function loadUnknownWords(name) {
-    const res = await fetch(`/unknown_words/${name}`);
-    const words = await res.json();
+function renderUnknownWords(words) {
     const list = document.getElementById('unknown-list');
     list.innerHTML = '';
     words.forEach(w => {
@@ -91,19 +83,12 @@ async function showResults() {
 
 document.getElementById('submit').addEventListener('click', showResults);
 
-async function loadAudio(name) {
+function showAudio(url) {
     const audio = document.getElementById('player');
-    const url = `/audio/${name}.wav`;
-    try {
-        const res = await fetch(url, { method: 'HEAD' });
-        if (res.ok) {
-            audio.src = url;
-            audio.style.display = 'block';
-        } else {
-            audio.removeAttribute('src');
-            audio.style.display = 'none';
-        }
-    } catch {
+    if (url) {
+        audio.src = url;
+        audio.style.display = 'block';
+    } else {
         audio.removeAttribute('src');
         audio.style.display = 'none';
     }
@@ -118,9 +103,13 @@ async function loadStory(index) {
     currentIndex = index;
     const name = stories[index];
     document.getElementById('story-name').textContent = name;
-    await loadTokens(name);
-    await loadUnknownWords(name);
-    await loadAudio(name);
+    // one request; the browser revalidates it with the bundle's ETag
+    const res = await fetch(`/story_bundle/${name}`);
+    const bundle = await res.json();
+    if (bundle.status === 'error') return;
+    renderTokens(bundle.tokens.map(i => bundle.words[i]), bundle.bopomofo);
+    renderUnknownWords(bundle.unknown);
+    showAudio(bundle.audio);
 }
 
 document.getElementById('prev').addEventListener('click', () => loadStory(currentIndex - 1));
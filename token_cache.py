@@ -0,0 +1,286 @@
+"""Persistent, bounded cache of segmented story tokens."""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Optional
+
+import metrics
+from db import connection
+from search_words import Segmenter, contains_chinese, vocab_version
+from vocab_snapshot import vocabulary
+
+
+DEFAULT_DB_PATH = "chinese_words.db"
+DEFAULT_MAXSIZE = 128
+
+
+class TokenCache:
+    """Serve story tokens from memory, then SQLite, then the segmenter.
+
+    Tokens are stored in the ``story_tokens`` table together with the
+    SHA-1 of the story file and the ``vocab_version`` they were produced
+    with, so every worker process shares them and they survive restarts.
+    An entry is only used while both stamps still match: editing a story
+    or changing the ``words`` table makes it stale and the story is
+    segmented again.  A small in-process LRU in front of the table avoids
+    rehashing unchanged files; it is keyed by file mtime/size and the
+    vocabulary version and holds at most *maxsize* stories.  Missing
+    stories are never cached, and looking one up forgets what was stored
+    for it, so ``story_vocab`` never outlives a deleted or renamed file.
+
+    Rows are stored under ``prefix + name`` so several text directories
+    (e.g. stories and lessons) can share the tables; *pattern* selects
+    the files that :meth:`refresh` indexes.
+
+    Lookups only read.  Stores and deletions go through *write*, called
+    as ``write(op, *args)`` with an operation of :data:`WRITE_OPS`; the
+    server passes its ``run_write`` so they reach the writer process.
+    Without it they run here in a ``BEGIN IMMEDIATE`` transaction.
+    """
+
+    def __init__(
+        self,
+        stories_dir: Path | str,
+        db_path: str = DEFAULT_DB_PATH,
+        maxsize: int = DEFAULT_MAXSIZE,
+        pattern: str = "*.txt",
+        prefix: str = "",
+        write: Optional[Callable[..., object]] = None,
+    ) -> None:
+        self.stories_dir = Path(stories_dir)
+        self.db_path = db_path
+        self.maxsize = maxsize
+        self.pattern = pattern
+        self.prefix = prefix
+        # key -> (tokens, SHA-1 of the file they were built from)
+        self._lru: OrderedDict[tuple, tuple[list[str], str]] = OrderedDict()
+        # name -> (mtime_ns, size, vocab_version) known to be stored
+        self._indexed: dict[str, tuple[int, int, int]] = {}
+        self._lock = threading.Lock()
+        self._compiled: Optional[tuple[int, Segmenter]] = None
+        self._write = write or self._write_local
+
+    # ------------------------------------------------------------------
+
+    def segmenter(self, conn: Optional[sqlite3.Connection] = None) -> Segmenter:
+        """Return a segmenter compiled from the current vocabulary."""
+        if conn is None:
+            with connection(self.db_path) as conn:
+                return self._segmenter_for(conn, vocab_version(conn))
+        return self._segmenter_for(conn, vocab_version(conn))
+
+    def tokens(self, name: str) -> list[str]:
+        """Return the token list for story *name* (without extension)."""
+        return self.tokens_with_hash(name)[0]
+
+    def tokens_with_hash(self, name: str) -> tuple[list[str], Optional[str]]:
+        """Return the tokens of story *name* and the SHA-1 of the bytes they came from.
+
+        Both stem from the same read of the file, so the hash identifies
+        exactly these tokens.  A missing story yields ``([], None)``.
+        """
+        path = self.stories_dir / f"{name}.txt"
+        try:
+            st = path.stat()
+        except OSError:
+            self._forget_missing(name)
+            return [], None
+        with connection(self.db_path) as conn:
+            version = vocab_version(conn)
+            key = (name, st.st_mtime_ns, st.st_size, version)
+            with self._lock:
+                cached = self._lru.get(key)
+                if cached is not None:
+                    self._lru.move_to_end(key)
+                    return cached
+            entry = self._load(conn, name, path, key[1:], want_tokens=True)
+
+        with self._lock:
+            self._lru[key] = entry
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.maxsize:
+                self._lru.popitem(last=False)
+        return entry
+
+    def content_hash(self, name: str) -> Optional[str]:
+        """Return the SHA-1 of story *name* as tokenised now, or None if it is missing."""
+        return self.tokens_with_hash(name)[1]
+
+    def refresh(self) -> list[str]:
+        """Index every matching file and forget files that disappeared.
+
+        Afterwards ``story_tokens`` and ``story_vocab`` describe exactly the
+        current files.  Unchanged files cost one ``stat``.  Returns the
+        stored names (including the prefix).
+        """
+        current = {}
+        for path in self.stories_dir.glob(self.pattern):
+            try:
+                current[path.stem] = (path, path.stat())
+            except OSError:
+                continue
+        with connection(self.db_path) as conn:
+            version = vocab_version(conn)
+            for name, (path, st) in current.items():
+                state = (st.st_mtime_ns, st.st_size, version)
+                if self._indexed.get(name) != state:
+                    self._load(conn, name, path, state, want_tokens=False)
+            stale = [
+                stored
+                for (stored,) in conn.execute("SELECT name FROM story_tokens")
+                if self._owns(stored) and stored[len(self.prefix):] not in current
+            ]
+        if stale:
+            self._write("forget_stories", stale)
+        for stored in stale:
+            self._indexed.pop(stored[len(self.prefix):], None)
+        return [self.prefix + name for name in current]
+
+    def clear(self) -> None:
+        """Drop the in-process entries; the SQLite table is left intact."""
+        with self._lock:
+            self._lru.clear()
+            self._indexed.clear()
+            self._compiled = None
+
+    # ------------------------------------------------------------------
+
+    def _forget_missing(self, name: str) -> None:
+        """Drop what is stored for *name*, whose file no longer exists."""
+        self._indexed.pop(name, None)
+        stored = self.prefix + name
+        with connection(self.db_path) as conn:
+            row = conn.execute(
+                "SELECT 1 FROM story_tokens WHERE name = ? "
+                "UNION ALL SELECT 1 FROM story_vocab WHERE name = ? LIMIT 1",
+                (stored, stored),
+            ).fetchone()
+        if row:
+            self._write("forget_stories", [stored])
+
+    def _owns(self, stored: str) -> bool:
+        if self.prefix:
+            return stored.startswith(self.prefix)
+        return "/" not in stored
+
+    def _load(
+        self,
+        conn: sqlite3.Connection,
+        name: str,
+        path: Path,
+        state: tuple[int, int, int],
+        want_tokens: bool,
+    ) -> tuple[list[str], str]:
+        """Validate or rebuild the stored entry for *name*; return its tokens and hash."""
+        stored = self.prefix + name
+        version = state[2]
+        data = path.read_bytes()
+        digest = hashlib.sha1(data).hexdigest()
+        column = "tokens" if want_tokens else "1"
+        row = conn.execute(
+            f"SELECT {column} FROM story_tokens "
+            "WHERE name = ? AND content_hash = ? AND vocab_version = ?",
+            (stored, digest, version),
+        ).fetchone()
+        if row:
+            tokens = json.loads(row[0]) if want_tokens else []
+        else:
+            text = data.decode("utf-8")
+            segmenter = self._segmenter_for(conn, version)
+            with metrics.timer("segment"):
+                tokens = segmenter.segment(text)
+            self._write("story_tokens", stored, digest, version, tokens)
+        self._indexed[name] = state
+        return tokens, digest
+
+    def _segmenter_for(self, conn: sqlite3.Connection, version: int) -> Segmenter:
+        with self._lock:
+            compiled = self._compiled
+        if compiled is not None and compiled[0] == version:
+            return compiled[1]
+        with metrics.timer("segmenter_compile"):
+            segmenter = Segmenter(vocabulary(self.db_path).get(conn).words())
+        with self._lock:
+            self._compiled = (version, segmenter)
+        return segmenter
+
+    def _write_local(self, op: str, *args) -> None:
+        with connection(self.db_path, immediate=True) as conn:
+            WRITE_OPS[op](conn, *args)
+
+
+def first_gloss(meaning: Optional[str]) -> str:
+    """Return the first gloss of a ``words.meaning`` entry."""
+    if not meaning:
+        return ""
+    return meaning.split(';')[0].split(',')[0].strip().rstrip('.')
+
+
+def store_story_vocab(conn: sqlite3.Connection, name: str, tokens: list[str]) -> None:
+    """Replace the ``story_vocab`` rows of *name* with the words in *tokens*.
+
+    Every distinct Chinese token is stored once with the index of its
+    first token, its number of occurrences and, for dictionary words, its
+    pinyin and first gloss.
+    """
+    first: dict[str, int] = {}
+    counts: dict[str, int] = {}
+    for pos, token in enumerate(tokens):
+        if not contains_chinese(token):
+            continue
+        if token not in first:
+            first[token] = pos
+            counts[token] = 0
+        counts[token] += 1
+    details = {
+        word: (pinyin, first_gloss(meaning))
+        for word, pinyin, meaning in conn.execute(
+            "SELECT simplified, pinyin, meaning FROM words "
+            "WHERE simplified IN (SELECT value FROM json_each(?))",
+            (json.dumps(list(first), ensure_ascii=False),),
+        )
+    }
+    conn.execute("DELETE FROM story_vocab WHERE name = ?", (name,))
+    conn.executemany(
+        "INSERT INTO story_vocab(name, first_pos, simplified, count, pinyin, gloss) "
+        "VALUES (?,?,?,?,?,?)",
+        [
+            (name, pos, word, counts[word], *details.get(word, (None, None)))
+            for word, pos in first.items()
+        ],
+    )
+
+
+def store_story_tokens(
+    conn: sqlite3.Connection, name: str, digest: str, version: int, tokens: list[str]
+) -> None:
+    """Store the *tokens* of text *name* and its ``story_vocab`` rows.
+
+    *digest* is the SHA-1 of the file and *version* the ``vocab_version``
+    the tokens were segmented with.
+    """
+    conn.execute(
+        "INSERT OR REPLACE INTO story_tokens"
+        "(name, content_hash, vocab_version, tokens) VALUES (?,?,?,?)",
+        (name, digest, version, json.dumps(tokens, ensure_ascii=False)),
+    )
+    store_story_vocab(conn, name, tokens)
+
+
+def forget_stories(conn: sqlite3.Connection, names: list[str]) -> None:
+    """Delete the stored tokens and vocabulary of the texts *names*."""
+    conn.executemany("DELETE FROM story_tokens WHERE name = ?", [(n,) for n in names])
+    conn.executemany("DELETE FROM story_vocab WHERE name = ?", [(n,) for n in names])
+
+
+# Every write the cache makes, by name; ``server.WRITE_OPS`` includes them.
+WRITE_OPS = {
+    "story_tokens": store_story_tokens,
+    "forget_stories": forget_stories,
+}
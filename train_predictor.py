@@ -0,0 +1,418 @@
+"""Fit the shared ``WordPredictor`` hyper-parameters offline.
+
+The decay rates ``lambda`` per mode, the priors ``theta_S``/``theta_F``
+per mode and ``theta_0`` every word starts from, and the SGD learning
+rate are fitted to the ``word_interactions`` log by minimising the
+log-loss of the prediction made *before* each event, i.e. exactly what
+the app would have predicted at that moment.
+
+Evaluations are batched: one lock-step replay (see
+:class:`batch_predictor.BatchPredictor`) runs many parameter sets at
+once along an extra axis, so a central-difference gradient or a whole
+line search costs a single pass over the log.  Words are independent, so
+the log is split into word shards that are replayed in a process pool.
+Cross-validation is time-ordered: each fold fits on the events before a
+cutoff and scores the events of the following window.
+
+``python train_predictor.py`` writes ``predictor_params.json``, which
+the server loads (``CHINESE_PREDICTOR_PARAMS``) and ``/recalculate``
+applies to the whole log.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+from algo import WordPredictor
+from batch_predictor import InteractionLog
+
+
+DEFAULT_DB_PATH = "chinese_words.db"
+DEFAULT_PARAMS_PATH = "predictor_params.json"
+DEFAULT_FOLDS = 3
+# central-difference step in parameter space (log-rates and coefficients)
+GRAD_STEP = 1e-3
+# candidate step lengths of the line search, evaluated in one replay
+LINE_STEPS = np.array([1.0, 0.5, 0.25, 0.1, 0.05, 0.02, 0.01, 0.003, 0.001])
+
+
+# ----------------------------------------------------------------------
+# Parameter vectors
+# ----------------------------------------------------------------------
+
+class Space:
+    """Maps a flat parameter vector to predictor hyper-parameters.
+
+    The vector holds ``log(lambda)`` per mode, then ``theta_S`` and
+    ``theta_F`` per mode, ``theta_0`` and ``log(learning_rate)``; logs keep
+    rates positive and make their steps relative.
+    """
+
+    def __init__(self, modes: Sequence[str]) -> None:
+        self.modes = list(modes)
+
+    @property
+    def size(self) -> int:
+        return 3 * len(self.modes) + 2
+
+    def initial(self) -> np.ndarray:
+        """Return the vector of the currently configured ``WordPredictor``."""
+        wp = WordPredictor(modes=list(self.modes))
+        for m in self.modes:
+            # what update() uses for a mode it has not seen before
+            wp.lambda_.setdefault(m, 1 / (60 * 60 * 24))
+        return np.concatenate([
+            np.log([wp.lambda_[m] for m in self.modes]),
+            [wp.theta_S[m] for m in self.modes],
+            [wp.theta_F[m] for m in self.modes],
+            [wp.theta_0, np.log(WordPredictor.LEARNING_RATE)],
+        ])
+
+    def split(self, x: np.ndarray):
+        """Return ``(lambda, theta_S, theta_F, theta_0, lr)`` for a ``(K, size)`` batch."""
+        n = len(self.modes)
+        return (
+            np.exp(x[:, :n]),
+            x[:, n:2 * n],
+            x[:, 2 * n:3 * n],
+            x[:, 3 * n],
+            np.exp(x[:, 3 * n + 1]),
+        )
+
+    def to_params(self, x: np.ndarray) -> Dict[str, object]:
+        """Return the parameter file layout understood by ``WordPredictor.configure``."""
+        lam, theta_S, theta_F, theta_0, lr = (a[0] for a in self.split(x[None, :]))
+        return {
+            "lambda": dict(zip(self.modes, lam.tolist())),
+            "theta_S": dict(zip(self.modes, theta_S.tolist())),
+            "theta_F": dict(zip(self.modes, theta_F.tolist())),
+            "theta_0": float(theta_0),
+            "learning_rate": float(lr),
+        }
+
+
+# ----------------------------------------------------------------------
+# Batched replay of one shard
+# ----------------------------------------------------------------------
+
+class Lockstep(NamedTuple):
+    """Events of some words laid out for a lock-step replay.
+
+    Words are ordered busiest first, so the words taking part in step
+    ``k`` are the first ``n_active[k]``; ``event[k]`` holds the indices of
+    their ``k``-th events.
+    """
+
+    n_words: int
+    n_active: List[int]
+    event: List[np.ndarray]
+    mode_idx: np.ndarray
+    outcome: np.ndarray
+    timestamp: np.ndarray
+
+
+def lockstep(word_idx: np.ndarray, mode_idx: np.ndarray, outcome: np.ndarray,
+             timestamp: np.ndarray) -> Lockstep:
+    """Lay out events like :meth:`BatchPredictor.replay` replays them."""
+    order = np.lexsort((np.arange(len(word_idx)), timestamp, word_idx))
+    word_idx = word_idx[order]
+    _, word_idx, counts = np.unique(word_idx, return_inverse=True, return_counts=True)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    perm = np.argsort(-counts, kind="stable")
+    counts_p, starts_p = counts[perm], starts[perm]
+    steps = int(counts_p[0]) if len(counts_p) else 0
+    n_active = np.searchsorted(-counts_p, -np.arange(steps), side="left").tolist()
+    return Lockstep(
+        len(counts),
+        n_active,
+        [starts_p[:n] + k for k, n in enumerate(n_active)],
+        mode_idx[order],
+        outcome[order],
+        timestamp[order],
+    )
+
+
+def replay_loss(events: Lockstep, space: Space, x: np.ndarray,
+                score_from: float) -> tuple[np.ndarray, int]:
+    """Replay *events* for every parameter vector in the batch *x*.
+
+    Returns the summed log-loss of each vector over the events at or
+    after *score_from*, and the number of those events.  The prediction
+    scored for an event is the recall probability at its timestamp before
+    it is counted, like ``WordPredictor.probability`` followed by
+    ``update``.
+    """
+    lam, theta_S0, theta_F0, theta_00, lr = space.split(x)
+    K, M, W = len(x), len(space.modes), events.n_words
+    S = np.zeros((K, W, M))
+    F = np.zeros((K, W, M))
+    theta_S = np.repeat(theta_S0[:, None, :], W, axis=1)
+    theta_F = np.repeat(theta_F0[:, None, :], W, axis=1)
+    theta_0 = np.repeat(theta_00[:, None], W, axis=1)
+    last = np.zeros(W)
+    lr = lr[:, None]
+    loss = np.zeros(K)
+    scored = 0
+
+    with np.errstate(over="ignore"):
+        for n, ev in zip(events.n_active, events.event):
+            ts = events.timestamp[ev]
+            out = events.outcome[ev]
+            m = events.mode_idx[ev]
+            r = np.arange(n)
+            s, f = S[:, :n], F[:, :n]
+            tS, tF, t0 = theta_S[:, :n], theta_F[:, :n], theta_0[:, :n]
+
+            dt = ts - last[:n]
+            fwd = dt > 0
+            factor = np.exp(-lam[:, None, :] * np.where(fwd, dt, 0.0)[None, :, None])
+            s *= factor
+            f *= factor
+            last[:n] = np.where(fwd, ts, last[:n])
+
+            hit = out == 1
+            score = ts >= score_from
+            if score.any():
+                logit = t0 + (tS * s).sum(axis=2) - (tF * f).sum(axis=2)
+                # -log p for hits, -log(1 - p) for misses
+                nll = np.logaddexp(0.0, np.where(hit, -logit, logit))
+                loss += nll[:, score].sum(axis=1)
+                scored += int(score.sum())
+
+            s[:, r, m] += hit
+            f[:, r, m] += ~hit
+            logit = t0 + (tS * s).sum(axis=2) - (tF * f).sum(axis=2)
+            step = lr * (out - 1.0 / (1.0 + np.exp(-logit)))
+            t0 += step
+            tS += step[:, :, None] * s
+            tF -= step[:, :, None] * f
+    return loss, scored
+
+
+# ----------------------------------------------------------------------
+# Sharded evaluation
+# ----------------------------------------------------------------------
+
+_log: Optional[InteractionLog] = None
+_shard_of: Optional[np.ndarray] = None
+
+
+def _init_worker(log: InteractionLog, shard_of: np.ndarray) -> None:
+    global _log, _shard_of
+    _log, _shard_of = log, shard_of
+    _shard_events.cache_clear()
+
+
+@lru_cache(maxsize=None)
+def _shard_events(shard: int, end: float) -> Lockstep:
+    keep = (_shard_of[_log.word_idx] == shard) & (_log.timestamp < end)
+    return lockstep(_log.word_idx[keep], _log.mode_idx[keep],
+                    _log.outcome[keep], _log.timestamp[keep])
+
+
+def _shard_loss(shard: int, modes: List[str], x: np.ndarray,
+                score_from: float, end: float) -> tuple[np.ndarray, int]:
+    return replay_loss(_shard_events(shard, end), Space(modes), x, score_from)
+
+
+def shard_words(log: InteractionLog, shards: int) -> np.ndarray:
+    """Assign words to *shards* so every shard gets a similar share of events.
+
+    Words are dealt round-robin in order of event count, which also
+    spreads the busiest words (the length of a lock-step replay) evenly.
+    """
+    counts = np.bincount(log.word_idx, minlength=len(log.words))
+    shard_of = np.empty(len(counts), dtype=np.int64)
+    shard_of[np.argsort(-counts, kind="stable")] = np.arange(len(counts)) % shards
+    return shard_of
+
+
+class Evaluator:
+    """Mean log-loss of parameter batches over a log, shard by shard.
+
+    With more than one worker the shards are replayed in a process pool
+    whose workers receive the log once; otherwise everything runs
+    in-process.  Use as a context manager to shut the pool down.
+    """
+
+    def __init__(self, log: InteractionLog, space: Space, workers: Optional[int] = None) -> None:
+        self.space = space
+        self.workers = workers or os.cpu_count() or 1
+        self.shards = self.workers
+        shard_of = shard_words(log, self.shards)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        if self.workers > 1:
+            self._pool = ProcessPoolExecutor(
+                self.workers, initializer=_init_worker, initargs=(log, shard_of)
+            )
+        else:
+            _init_worker(log, shard_of)
+
+    def __enter__(self) -> "Evaluator":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self._pool is not None:
+            self._pool.shutdown()
+
+    def loss(self, x: np.ndarray, score_from: float = -np.inf,
+             end: float = np.inf) -> np.ndarray:
+        """Return the mean log-loss of each row of *x*.
+
+        Events before *end* are replayed and those from *score_from* on
+        are scored.
+        """
+        args = [(s, self.space.modes, x, score_from, end) for s in range(self.shards)]
+        if self._pool is None:
+            results = [_shard_loss(*a) for a in args]
+        else:
+            results = list(self._pool.map(_shard_loss, *zip(*args)))
+        total = sum(r[0] for r in results)
+        scored = sum(r[1] for r in results)
+        return total / max(scored, 1)
+
+
+# ----------------------------------------------------------------------
+# Fitting
+# ----------------------------------------------------------------------
+
+def fit(evaluator: Evaluator, x0: np.ndarray, end: float = np.inf,
+        max_iter: int = 50, tol: float = 1e-6) -> tuple[np.ndarray, float]:
+    """Minimise the log-loss of the events before *end*, starting at *x0*.
+
+    Each iteration takes one replay for the central-difference gradient
+    of every parameter and one for a line search over
+    :data:`LINE_STEPS` along the normalised negative gradient.  Stops
+    when no step improves the loss by more than *tol*.  Returns the best
+    vector and its loss.
+    """
+    x = np.asarray(x0, dtype=np.float64)
+    eye = np.eye(len(x)) * GRAD_STEP
+    best = float(evaluator.loss(x[None, :], end=end)[0])
+    for _ in range(max_iter):
+        probes = np.concatenate([x + eye, x - eye])
+        losses = evaluator.loss(probes, end=end)
+        grad = (losses[:len(x)] - losses[len(x):]) / (2 * GRAD_STEP)
+        norm = np.linalg.norm(grad)
+        if not np.isfinite(norm) or norm == 0:
+            break
+        candidates = x - LINE_STEPS[:, None] * (grad / norm)
+        losses = evaluator.loss(candidates, end=end)
+        i = int(np.nanargmin(losses))
+        if not losses[i] < best - tol:
+            break
+        x, best = candidates[i], float(losses[i])
+    return x, best
+
+
+def time_folds(timestamp: np.ndarray, folds: int) -> List[tuple[float, float]]:
+    """Return ``(cutoff, end)`` windows splitting the log into ``folds + 1`` parts.
+
+    Fold ``k`` trains on the events before ``cutoff`` and validates on
+    the events from ``cutoff`` up to ``end``.  Events sharing a timestamp
+    stay in one window, so a log with few distinct timestamps yields
+    fewer folds.
+    """
+    edges = np.quantile(timestamp, np.linspace(0, 1, folds + 2))[1:-1]
+    edges = np.unique(edges[edges > timestamp.min()]).tolist() + [np.inf]
+    return [(edges[k], edges[k + 1]) for k in range(len(edges) - 1)]
+
+
+def cross_validate(evaluator: Evaluator, log: InteractionLog, x0: np.ndarray,
+                   folds: int = DEFAULT_FOLDS, max_iter: int = 50) -> List[Dict[str, float]]:
+    """Time-ordered cross-validation of :func:`fit` against the start point *x0*."""
+    report = []
+    for cutoff, end in time_folds(log.timestamp, folds):
+        x, train = fit(evaluator, x0, end=cutoff, max_iter=max_iter)
+        valid = evaluator.loss(np.stack([x, x0]), score_from=cutoff, end=end)
+        report.append({
+            "cutoff": cutoff,
+            "train_log_loss": train,
+            "valid_log_loss": float(valid[0]),
+            "baseline_log_loss": float(valid[1]),
+        })
+    return report
+
+
+def train(log: InteractionLog, folds: int = DEFAULT_FOLDS, max_iter: int = 50,
+          workers: Optional[int] = None) -> Dict[str, object]:
+    """Fit on the whole log and return the parameter file contents.
+
+    The starting point is the current ``WordPredictor`` configuration;
+    the result records the cross-validation report next to the fitted
+    parameters.
+    """
+    # only modes that occur can be fitted
+    modes = [m for i, m in enumerate(log.modes) if np.any(log.mode_idx == i)]
+    remap = np.full(len(log.modes), -1)
+    remap[[log.modes.index(m) for m in modes]] = np.arange(len(modes))
+    log = InteractionLog(log.words, modes, log.word_idx, remap[log.mode_idx],
+                         log.outcome, log.timestamp)
+    space = Space(modes)
+    x0 = space.initial()
+    with Evaluator(log, space, workers) as evaluator:
+        cv = cross_validate(evaluator, log, x0, folds, max_iter) if folds else []
+        x, loss = fit(evaluator, x0, max_iter=max_iter)
+        baseline = float(evaluator.loss(x0[None, :])[0])
+    params = space.to_params(x)
+    params["trained"] = {
+        "created": int(time.time()),
+        "events": len(log),
+        "words": len(log.words),
+        "log_loss": loss,
+        "baseline_log_loss": baseline,
+        "cv": cv,
+    }
+    return params
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Fit WordPredictor hyper-parameters")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="Path to words database")
+    parser.add_argument("-o", "--output", default=DEFAULT_PARAMS_PATH,
+                        help="Parameter file to write")
+    parser.add_argument("--folds", type=int, default=DEFAULT_FOLDS,
+                        help="Time-ordered cross-validation folds (0 to skip)")
+    parser.add_argument("--max-iter", type=int, default=50, help="Iterations per fit")
+    parser.add_argument("-w", "--workers", type=int, help="Replay processes")
+    args = parser.parse_args()
+
+    with sqlite3.connect(args.db) as conn:
+        log = InteractionLog.from_db(conn)
+    if not len(log):
+        parser.error("word_interactions is empty")
+    start = time.perf_counter()
+    params = train(log, args.folds, args.max_iter, args.workers)
+    elapsed = time.perf_counter() - start
+
+    trained = params["trained"]
+    for k, fold in enumerate(trained["cv"], start=1):
+        print(f"fold {k}: train {fold['train_log_loss']:.4f}  "
+              f"valid {fold['valid_log_loss']:.4f}  (current {fold['baseline_log_loss']:.4f})")
+    print(f"{trained['events']} events, {trained['words']} words: log-loss "
+          f"{trained['baseline_log_loss']:.4f} -> {trained['log_loss']:.4f} in {elapsed:.1f}s")
+    # replaced atomically: the server may reload the file at any moment
+    directory = os.path.dirname(os.path.abspath(args.output))
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(params, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, args.output)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
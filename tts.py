@@ -0,0 +1,281 @@
+"""Pre-synthesised story and word audio in a content-addressed cache.
+
+Audio is generated ahead of time by ``python tts.py`` and never on the
+request path.  Every clip is stored under the SHA-256 of its voice and
+text, so editing a story produces a new clip while unchanged texts are
+skipped, and the server can serve clips with a year-long cache lifetime.
+The ``audio_clips`` table lists what has been generated; the server's
+``/audio_manifest/<name>`` endpoint reads it.
+
+Synthesizers are pluggable: anything with a ``voice`` id and a
+``synthesize(text) -> bytes`` method returning a WAV file works.
+:class:`PiperSynthesizer` wraps a Piper model and :class:`StubSynthesizer`
+produces deterministic tones without any model, for tests and demos.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import io
+import itertools
+import math
+import os
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+import wave
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, NamedTuple, Optional, Protocol
+
+from db import connection
+from schema import ensure_migrated
+from token_cache import TokenCache
+
+
+DEFAULT_DB_PATH = "chinese_words.db"
+DEFAULT_CACHE_DIR = "audio_cache"
+DEFAULT_VOICE = os.environ.get("CHINESE_TTS_VOICE", "voices/zh_CN-huayan-medium.onnx")
+DEFAULT_WORKERS = 2
+
+
+class Synthesizer(Protocol):
+    voice: str
+
+    def synthesize(self, text: str) -> bytes:
+        """Return a WAV file speaking *text*."""
+        ...
+
+
+class PiperSynthesizer:
+    """Piper text-to-speech with the model at *model_path*."""
+
+    def __init__(self, model_path: str) -> None:
+        from piper import PiperVoice
+
+        self.voice = Path(model_path).stem
+        self._voice = PiperVoice.load(model_path)
+
+    def synthesize(self, text: str) -> bytes:
+        return self._voice.synthesize(text)
+
+
+class StubSynthesizer:
+    """Deterministic stand-in voice: one short tone per character."""
+
+    voice = "stub"
+
+    def __init__(self, sample_rate: int = 16000, seconds_per_char: float = 0.12) -> None:
+        self.sample_rate = sample_rate
+        self.seconds_per_char = seconds_per_char
+
+    def synthesize(self, text: str) -> bytes:
+        n = int(self.sample_rate * self.seconds_per_char)
+        frames = bytearray()
+        for ch in text:
+            if ch.isspace():
+                frames += bytes(2 * n)
+                continue
+            freq = 220 + ord(ch) % 440
+            step = 2 * math.pi * freq / self.sample_rate
+            frames += struct.pack(
+                f"<{n}h", *(int(8000 * math.sin(step * i)) for i in range(n))
+            )
+        buf = io.BytesIO()
+        with wave.open(buf, "wb") as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(self.sample_rate)
+            w.writeframes(bytes(frames))
+        return buf.getvalue()
+
+
+def make_synthesizer(voice: str = DEFAULT_VOICE) -> Synthesizer:
+    """Return the stub for ``"stub"`` and a Piper voice for a model path."""
+    if voice == "stub":
+        return StubSynthesizer()
+    return PiperSynthesizer(voice)
+
+
+def voice_id(voice: str) -> str:
+    """Return the id under which clips of *voice* (``make_synthesizer`` argument) are cached."""
+    return "stub" if voice == "stub" else Path(voice).stem
+
+
+def clip_key(voice: str, text: str) -> str:
+    """Return the cache key of *text* spoken by *voice* (a voice id)."""
+    return hashlib.sha256(f"{voice}\0{text}".encode("utf-8")).hexdigest()
+
+
+class AudioCache:
+    """WAV files stored as ``<root>/<key[:2]>/<key>.wav``."""
+
+    def __init__(self, root: Path | str = DEFAULT_CACHE_DIR) -> None:
+        self.root = Path(root)
+
+    def path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.wav"
+
+    def __contains__(self, key: str) -> bool:
+        return self.path(key).is_file()
+
+    def put(self, key: str, data: bytes) -> Path:
+        """Store *data* atomically, so readers never see a partial file."""
+        path = self.path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        return path
+
+
+class Job(NamedTuple):
+    kind: str  # "story" or "word"
+    label: str  # story name or word
+    text: str
+
+
+def story_jobs(stories_dir: Path | str = "stories", pattern: str = "*.txt") -> Iterator[Job]:
+    for path in sorted(Path(stories_dir).glob(pattern)):
+        yield Job("story", path.stem, path.read_text(encoding="utf-8"))
+
+
+def word_jobs(db_path: str = DEFAULT_DB_PATH) -> Iterator[Job]:
+    """One job per dictionary word occurring in any indexed story or lesson."""
+    with connection(db_path) as conn:
+        words = [
+            w for (w,) in conn.execute(
+                "SELECT DISTINCT v.simplified FROM story_vocab AS v "
+                "JOIN words AS w ON w.simplified = v.simplified ORDER BY v.simplified"
+            )
+        ]
+    for word in words:
+        yield Job("word", word, word)
+
+
+def pregenerate(
+    jobs: Iterable[Job],
+    make: Callable[[], Synthesizer],
+    voice: str,
+    cache: AudioCache,
+    db_path: str = DEFAULT_DB_PATH,
+    workers: int = DEFAULT_WORKERS,
+) -> tuple[int, int]:
+    """Synthesise every job whose clip is not cached yet.
+
+    At most *workers* clips are synthesised at once and at most twice as
+    many jobs are queued, so memory stays bounded for any number of jobs.
+    Each worker thread builds its own synthesizer with *make*, whose clips
+    are cached under the voice id *voice*.  Clips are recorded in
+    ``audio_clips`` as they finish.  Returns the number of synthesised and
+    already cached clips.
+    """
+    local = threading.local()
+
+    def run(job: Job, key: str) -> tuple[Job, str, int]:
+        synth = getattr(local, "synth", None)
+        if synth is None:
+            synth = local.synth = make()
+        data = synth.synthesize(job.text)
+        cache.put(key, data)
+        return job, key, len(data)
+
+    done_count = 0
+
+    def record(futures: Iterable[Future]) -> None:
+        nonlocal done_count
+        rows = []
+        for fut in futures:
+            job, key, size = fut.result()
+            rows.append((key, voice, job.kind, job.label, size, int(time.time())))
+        with connection(db_path) as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO audio_clips(key, voice, kind, label, size, created) "
+                "VALUES (?,?,?,?,?,?)",
+                rows,
+            )
+        done_count += len(rows)
+
+    pending: set[Future] = set()
+    # clips found in the cache but possibly missing from audio_clips
+    known = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for job in jobs:
+            key = clip_key(voice, job.text)
+            if key in cache:
+                size = cache.path(key).stat().st_size
+                known.append((key, voice, job.kind, job.label, size, int(time.time())))
+                continue
+            pending.add(pool.submit(run, job, key))
+            if len(pending) >= 2 * workers:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                record(finished)
+        finished, _ = wait(pending)
+        record(finished)
+    with connection(db_path) as conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO audio_clips(key, voice, kind, label, size, created) "
+            "VALUES (?,?,?,?,?,?)",
+            known,
+        )
+    return done_count, len(known)
+
+
+def story_clip(conn: sqlite3.Connection, voice: str, text: str) -> Optional[str]:
+    """Return the key of the cached clip of a story with the current *text*."""
+    key = clip_key(voice, text)
+    row = conn.execute(
+        "SELECT key FROM audio_clips WHERE key = ? AND kind = 'story'", (key,)
+    ).fetchone()
+    return row[0] if row else None
+
+
+def word_clips(conn: sqlite3.Connection, voice: str, story: str) -> dict[str, str]:
+    """Return ``{word: key}`` for the cached clips of the words of *story*."""
+    return dict(
+        conn.execute(
+            "SELECT c.label, c.key FROM story_vocab AS v "
+            "JOIN audio_clips AS c ON c.voice = ? AND c.kind = 'word' AND c.label = v.simplified "
+            "WHERE v.name = ?",
+            (voice, story),
+        )
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Pre-generate story and word audio")
+    parser.add_argument("--voice", default=DEFAULT_VOICE,
+                        help='Piper model path, or "stub" for the test voice')
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="Path to words database")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_DIR, help="Audio cache directory")
+    parser.add_argument("--stories", default="stories", help="Story directory")
+    parser.add_argument("--lessons", default="lessons", help="Lesson directory")
+    parser.add_argument("--no-words", action="store_true", help="Skip per-word clips")
+    parser.add_argument("-w", "--workers", type=int, default=DEFAULT_WORKERS,
+                        help="Concurrent synthesis workers")
+    args = parser.parse_args()
+
+    ensure_migrated(args.db)
+    jobs: Iterable[Job] = story_jobs(args.stories)
+    if not args.no_words:
+        # make sure story_vocab lists the words of every current text
+        TokenCache(args.stories, args.db).refresh()
+        TokenCache(args.lessons, args.db, pattern="Lesson*.txt", prefix="lessons/").refresh()
+        jobs = itertools.chain(jobs, word_jobs(args.db))
+    made, cached = pregenerate(
+        jobs,
+        lambda: make_synthesizer(args.voice),
+        voice_id(args.voice),
+        AudioCache(args.cache),
+        args.db,
+        args.workers,
+    )
+    print(f"Synthesised {made} clips, {cached} already cached")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,7 @@
 import sqlite3
-import re
-from pathlib import Path
 from collections import Counter
 
-from search_words import load_words, segment_text
+from corpus import process_corpus, store_text_counts
 
 DB_PATH = "chinese_words.db"
 LESSON_DIR = "lessons"
@@ -11,28 +9,11 @@ USER = "Kosmos1"
 
 
 def count_lesson_words(lesson_dir: str, db_path: str) -> Counter:
-    words = load_words(db_path)
-    chinese_re = re.compile(r"[\u4e00-\u9fff]+")
-    counter: Counter[str] = Counter()
-    for path in Path(lesson_dir).glob("Lesson*.txt"):
-        with open(path, "r", encoding="utf-8") as f:
-            text = f.read()
-        segments = segment_text(text, words)
-        for seg in segments:
-            if chinese_re.search(seg):
-                counter[seg] += 1
-    return counter
+    return process_corpus(lesson_dir, "Lesson*.txt", db_path).counts
 
 
 def update_database(word_counts: Counter, db_path: str) -> None:
-    with sqlite3.connect(db_path) as conn:
-        conn.execute("UPDATE user_words SET number_in_texts = 0")
-        for word, count in word_counts.items():
-            conn.execute(
-                "UPDATE user_words SET number_in_texts = ? WHERE simplified = ?",
-                (count, word),
-            )
-        conn.commit()
+    store_text_counts(word_counts, db_path)
 
 
 def fetch_statistics(db_path: str) -> list[tuple[str, int]]:
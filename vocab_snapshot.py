@@ -0,0 +1,281 @@
+"""Read-only, memory-mapped snapshot of the ``words`` table.
+
+Every server process used to keep the vocabulary as Python strings and
+went back to SQLite for each pinyin, bopomofo or meaning lookup.  The
+snapshot stores each column as one contiguous UTF-8 blob with an offset
+array, plus a hash table and a sorted index over ``simplified``, in a
+single file next to the database.  Processes ``mmap`` the file, so all
+gunicorn workers share one copy in the page cache and opening it costs
+no query beyond the ``vocab_version`` check.
+
+File layout (little-endian)::
+
+    header   magic, word count, hash table size, vocab_version,
+             then (offsets, blob, blob length) positions per field
+             and the positions of the sorted index and the hash table
+    per field: uint32 offsets[n + 1], UTF-8 blob
+    uint32 order[n]        ids sorted by the UTF-8 bytes of simplified
+    uint32 table[size]     open-addressing hash table of ids, EMPTY = 2**32 - 1
+
+The file is rebuilt whenever ``vocab_version`` changes and replaced
+atomically, so readers never see a partial snapshot; a process that
+still maps the old file keeps a consistent view until it reopens.
+"""
+
+from __future__ import annotations
+
+import bisect
+import hashlib
+import mmap
+import os
+import sqlite3
+import struct
+import tempfile
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+from db import connection
+from search_words import vocab_version
+
+
+MAGIC = b"CWVOCAB1"
+FIELDS = ("simplified", "pinyin", "bopomofo", "meaning")
+EMPTY = 0xFFFFFFFF
+_HEADER = struct.Struct("<8sIIq")
+_FIELD = struct.Struct("<QQQ")
+_TAIL = struct.Struct("<QQ")
+
+
+def snapshot_path(db_path: str) -> str:
+    """Return where the snapshot of *db_path* is kept."""
+    return f"{db_path}.vocab"
+
+
+def _hash(key: bytes) -> int:
+    # stable across processes, unlike hash()
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+
+
+def _align(n: int) -> int:
+    return (n + 7) & ~7
+
+
+# ----------------------------------------------------------------------
+# Writing
+# ----------------------------------------------------------------------
+
+def build_snapshot(conn: sqlite3.Connection, path: str) -> int:
+    """Write the snapshot of the ``words`` table to *path*; return its word count.
+
+    Words appearing more than once keep their first row.  NULL values are
+    stored as empty strings.
+    """
+    # read the stamp first: a write landing in between makes the snapshot
+    # newer than its stamp, which only causes an extra rebuild
+    version = vocab_version(conn)
+    seen = set()
+    columns: List[List[bytes]] = [[] for _ in FIELDS]
+    for row in conn.execute(
+        f"SELECT {', '.join(FIELDS)} FROM words WHERE simplified IS NOT NULL ORDER BY rowid"
+    ):
+        if row[0] in seen:
+            continue
+        seen.add(row[0])
+        for col, value in zip(columns, row):
+            col.append(str(value).encode("utf-8") if value is not None else b"")
+    n = len(columns[0])
+    keys = columns[0]
+
+    size = 8
+    while size < 2 * n:
+        size *= 2
+    table = np.full(size, EMPTY, dtype=np.uint32)
+    for i, key in enumerate(keys):
+        slot = _hash(key) & (size - 1)
+        while table[slot] != EMPTY:
+            slot = (slot + 1) & (size - 1)
+        table[slot] = i
+    order = np.array(sorted(range(n), key=keys.__getitem__), dtype=np.uint32)
+
+    pos = _align(_HEADER.size + len(FIELDS) * _FIELD.size + _TAIL.size)
+    parts: List[tuple[int, bytes]] = []
+    field_pos = []
+    for col in columns:
+        offsets = np.zeros(n + 1, dtype=np.uint32)
+        np.cumsum([len(v) for v in col], out=offsets[1:])
+        blob = b"".join(col)
+        parts.append((pos, offsets.tobytes()))
+        offsets_pos = pos
+        pos = _align(pos + offsets.nbytes)
+        parts.append((pos, blob))
+        field_pos.append((offsets_pos, pos, len(blob)))
+        pos = _align(pos + len(blob))
+    order_pos = pos
+    parts.append((pos, order.tobytes()))
+    pos = _align(pos + order.nbytes)
+    table_pos = pos
+    parts.append((pos, table.tobytes()))
+
+    header = _HEADER.pack(MAGIC, n, size, version)
+    header += b"".join(_FIELD.pack(*fp) for fp in field_pos)
+    header += _TAIL.pack(order_pos, table_pos)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(header)
+            for offset, data in parts:
+                f.seek(offset)
+                f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return n
+
+
+# ----------------------------------------------------------------------
+# Reading
+# ----------------------------------------------------------------------
+
+class VocabSnapshot:
+    """A mapped snapshot file; ids are positions in the ``words`` table.
+
+    The offset arrays, the sorted index and the hash table are NumPy views
+    of the mapping, so opening the file copies nothing.  Lookups decode
+    only the strings they return.
+    """
+
+    def __init__(self, path: str) -> None:
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        mm = self._mm
+        magic, self.size, self._table_size, self.vocab_version = _HEADER.unpack_from(mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a vocabulary snapshot")
+        self._offsets: Dict[str, np.ndarray] = {}
+        self._blob: Dict[str, int] = {}
+        at = _HEADER.size
+        for name in FIELDS:
+            offsets_pos, blob_pos, _ = _FIELD.unpack_from(mm, at)
+            at += _FIELD.size
+            self._offsets[name] = np.frombuffer(mm, np.uint32, self.size + 1, offsets_pos)
+            self._blob[name] = blob_pos
+        order_pos, table_pos = _TAIL.unpack_from(mm, at)
+        self._order = np.frombuffer(mm, np.uint32, self.size, order_pos)
+        self._table = np.frombuffer(mm, np.uint32, self._table_size, table_pos)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def _raw(self, name: str, i: int) -> bytes:
+        offsets = self._offsets[name]
+        base = self._blob[name]
+        return self._mm[base + int(offsets[i]):base + int(offsets[i + 1])]
+
+    def get(self, name: str, i: int) -> Optional[str]:
+        """Return column *name* of word id *i* (None for empty values)."""
+        raw = self._raw(name, i)
+        return raw.decode("utf-8") if raw else None
+
+    def id(self, word: str) -> Optional[int]:
+        """Return the id of *word*, or None if it is not in the vocabulary."""
+        key = word.encode("utf-8")
+        mask = self._table_size - 1
+        slot = _hash(key) & mask
+        table = self._table
+        while True:
+            i = int(table[slot])
+            if i == EMPTY:
+                return None
+            if self._raw("simplified", i) == key:
+                return i
+            slot = (slot + 1) & mask
+
+    def __contains__(self, word: str) -> bool:
+        return self.id(word) is not None
+
+    def lookup(self, words: Iterable[str], name: str) -> Dict[str, str]:
+        """Return ``{word: value}`` of column *name* for the known words with a value."""
+        result = {}
+        for word in words:
+            i = self.id(word)
+            if i is not None:
+                value = self.get(name, i)
+                if value is not None:
+                    result[word] = value
+        return result
+
+    def words(self) -> Iterator[str]:
+        """Yield every word in id order."""
+        offsets = self._offsets["simplified"].tolist()
+        base = self._blob["simplified"]
+        blob = self._mm[base:base + offsets[-1]]
+        for start, end in zip(offsets, offsets[1:]):
+            yield blob[start:end].decode("utf-8")
+
+    def prefix(self, prefix: str) -> List[int]:
+        """Return the ids of all words starting with *prefix*, in sorted order."""
+        key = prefix.encode("utf-8")
+        order = self._order
+        lo = bisect.bisect_left(order, key, key=lambda i: self._raw("simplified", int(i)))
+        hi = lo
+        while hi < self.size and self._raw("simplified", int(order[hi])).startswith(key):
+            hi += 1
+        return order[lo:hi].tolist()
+
+
+class Vocabulary:
+    """The current snapshot of one database, rebuilt when ``words`` changes.
+
+    :meth:`get` checks ``vocab_version`` and reuses the mapped snapshot
+    while it matches; otherwise it maps the file another process may
+    already have rebuilt, and only writes a new one if that is stale too.
+    """
+
+    def __init__(self, db_path: str, path: Optional[str] = None) -> None:
+        self.db_path = db_path
+        self.path = path or snapshot_path(db_path)
+        self._snapshot: Optional[VocabSnapshot] = None
+        self._lock = threading.Lock()
+
+    def get(self, conn: Optional[sqlite3.Connection] = None) -> VocabSnapshot:
+        if conn is None:
+            with connection(self.db_path) as conn:
+                return self.get(conn)
+        version = vocab_version(conn)
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.vocab_version == version:
+            return snapshot
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None or snapshot.vocab_version != version:
+                snapshot = self._open()
+                if snapshot is None or snapshot.vocab_version != version:
+                    build_snapshot(conn, self.path)
+                    snapshot = self._open()
+                # older snapshots stay valid for threads still using them
+                self._snapshot = snapshot
+        return snapshot
+
+    def _open(self) -> Optional[VocabSnapshot]:
+        try:
+            return VocabSnapshot(self.path)
+        except (OSError, ValueError, struct.error):
+            return None
+
+
+_vocabularies: Dict[str, Vocabulary] = {}
+_vocabularies_lock = threading.Lock()
+
+
+def vocabulary(db_path: str) -> Vocabulary:
+    """Return the shared :class:`Vocabulary` of *db_path* for this process."""
+    with _vocabularies_lock:
+        vocab = _vocabularies.get(db_path)
+        if vocab is None:
+            vocab = _vocabularies[db_path] = Vocabulary(db_path)
+        return vocab
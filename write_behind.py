@@ -0,0 +1,156 @@
+"""Background queue that group-commits database writes."""
+
+from __future__ import annotations
+
+import atexit
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, List, Optional
+
+from db import connection
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_FLUSH_INTERVAL = 0.5
+DEFAULT_MAX_PENDING = 10000
+DEFAULT_RETRIES = 5
+RETRY_DELAY = 0.05
+
+
+class WriteBehindQueue:
+    """Collect write batches from many threads and commit them together.
+
+    ``submit`` only enqueues an item.  A daemon thread waits for the first
+    item, keeps collecting for at most *flush_interval* seconds and then
+    passes everything it gathered to ``apply(conn, items)`` inside one
+    transaction.  At most *max_pending* items may wait; further
+    submissions block until the writer catches up.  The queue is flushed
+    when the interpreter exits, and :meth:`flush` waits for everything
+    submitted so far to be committed.
+
+    A failed commit is retried *retries* times with exponential backoff
+    starting at ``RETRY_DELAY`` seconds.  A batch that still fails is
+    never dropped: it is appended as one JSON line to *spill_path*
+    (default ``<db_path>.write-behind.jsonl``), so items must be JSON
+    serialisable, and spilled batches are applied again when the next
+    queue for the database starts.  With ``spill=False`` nothing is
+    written to or replayed from *spill_path*; together with
+    ``retries=0`` every batch is attempted exactly once, which callers
+    that report each outcome to a client (see ``writer.serve``) need.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        apply: Callable[[sqlite3.Connection, List[Any]], None],
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+        max_pending: int = DEFAULT_MAX_PENDING,
+        retries: int = DEFAULT_RETRIES,
+        spill_path: Optional[str] = None,
+        spill: bool = True,
+    ) -> None:
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self.spill_path = spill_path or f"{db_path}.write-behind.jsonl"
+        self.spill = spill
+        self._apply = apply
+        self._max_batch = max_pending
+        self._queue: queue.Queue = queue.Queue(maxsize=max_pending)
+        self._closed = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="write-behind", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, item: Any) -> None:
+        """Queue *item* for the next group commit."""
+        if self._closed.is_set():
+            raise RuntimeError("write-behind queue is closed")
+        self._queue.put(item)
+
+    def flush(self) -> None:
+        """Block until every submitted item has been committed."""
+        self._queue.join()
+
+    def close(self) -> None:
+        """Flush outstanding items and stop the writer thread."""
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._thread.join()
+
+    # ------------------------------------------------------------------
+
+    def _commit(self, batch: List[Any]) -> bool:
+        """Apply *batch* in one transaction, retrying with backoff."""
+        delay = RETRY_DELAY
+        for attempt in range(self.retries + 1):
+            try:
+                with connection(self.db_path, immediate=True) as conn:
+                    self._apply(conn, batch)
+                return True
+            except Exception as exc:
+                if attempt == self.retries:
+                    log.exception("write-behind flush of %d items failed", len(batch))
+                    return False
+                log.warning("write-behind flush failed (%s), retrying in %.2fs", exc, delay)
+                time.sleep(delay)
+                delay *= 2
+        return False
+
+    def _spill(self, batch: List[Any]) -> None:
+        try:
+            with open(self.spill_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(batch, ensure_ascii=False) + "\n")
+        except (OSError, TypeError, ValueError):
+            log.exception("could not spill %d items to %s", len(batch), self.spill_path)
+            return
+        log.error("spilled %d items to %s", len(batch), self.spill_path)
+
+    def _replay_spilled(self) -> None:
+        """Apply the batches an earlier queue could not commit."""
+        try:
+            with open(self.spill_path, "r", encoding="utf-8") as f:
+                batches = [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return
+        failed = [batch for batch in batches if not self._commit(batch)]
+        os.remove(self.spill_path)
+        for batch in failed:
+            self._spill(batch)
+
+    def _run(self) -> None:
+        if self.spill:
+            self._replay_spilled()
+        while True:
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                if self._closed.is_set():
+                    return
+                continue
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self._max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining > 0 and not self._closed.is_set():
+                        batch.append(self._queue.get(timeout=remaining))
+                    else:
+                        batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                if not self._commit(batch) and self.spill:
+                    self._spill(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
@@ -0,0 +1,196 @@
+"""Single writer process shared by all server workers.
+
+With several gunicorn workers every process would otherwise write to
+SQLite on its own and the workers would fight over the write lock.  In
+multi-worker mode one writer process owns all writes instead: workers
+send ``(op, args)`` requests over a Unix socket, the writer runs them
+through a :class:`~write_behind.WriteBehindQueue` so requests arriving
+together share one ``BEGIN IMMEDIATE`` transaction and one commit, and
+replies once the commit is durable.  Readers keep their own connections
+and run in parallel under WAL.
+
+Operations are plain functions ``op(conn, *args)`` registered by name;
+``server.WRITE_OPS`` holds the server's.  See ``gunicorn.conf.py`` for
+how the writer is started next to the workers.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from write_behind import WriteBehindQueue
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_FLUSH_INTERVAL = 0.002
+
+WriteOp = Callable[..., Any]
+
+
+class WriterError(RuntimeError):
+    """An operation failed inside the writer process."""
+
+
+class _Request:
+    __slots__ = ("op", "args", "result", "error", "done")
+
+    def __init__(self, op: str, args: List[Any]) -> None:
+        self.op = op
+        self.args = args
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.done = threading.Event()
+
+
+def _make_apply(ops: Dict[str, WriteOp]) -> Callable[[sqlite3.Connection, List[_Request]], None]:
+    def apply(conn: sqlite3.Connection, batch: List[_Request]) -> None:
+        """Run *batch* in one transaction; a failing op only rolls back itself."""
+        try:
+            if not conn.in_transaction:
+                conn.execute("BEGIN IMMEDIATE")
+            for req in batch:
+                fn = ops.get(req.op)
+                if fn is None:
+                    req.error = f"unknown operation {req.op!r}"
+                    continue
+                conn.execute("SAVEPOINT writer_op")
+                try:
+                    req.result = fn(conn, *req.args)
+                except Exception as exc:
+                    conn.execute("ROLLBACK TO writer_op")
+                    req.error = f"{type(exc).__name__}: {exc}"
+                    log.exception("writer operation %s failed", req.op)
+                conn.execute("RELEASE writer_op")
+            conn.commit()
+        except Exception as exc:
+            for req in batch:
+                if req.error is None:
+                    req.error = f"{type(exc).__name__}: {exc}"
+            raise
+        finally:
+            for req in batch:
+                req.done.set()
+
+    return apply
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    server: "_WriterServer"
+
+    def handle(self) -> None:
+        for line in self.rfile:
+            try:
+                msg = json.loads(line)
+                req = _Request(msg["op"], msg.get("args", []))
+            except (ValueError, KeyError) as exc:
+                reply = {"ok": False, "error": f"bad request: {exc}"}
+            else:
+                self.server.queue.submit(req)
+                req.done.wait()
+                if req.error is None:
+                    reply = {"ok": True, "result": req.result}
+                else:
+                    reply = {"ok": False, "error": req.error}
+            self.wfile.write(json.dumps(reply, ensure_ascii=False).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+class _WriterServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, queue: WriteBehindQueue) -> None:
+        self.queue = queue
+        super().__init__(path, _Handler)
+
+
+def serve(
+    socket_path: str,
+    db_path: str,
+    ops: Dict[str, WriteOp],
+    flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+    ready: Optional[threading.Event] = None,
+) -> None:
+    """Accept write requests on *socket_path* until SIGTERM or SIGINT.
+
+    Pending requests are committed before the function returns.
+    """
+    try:
+        os.unlink(socket_path)
+    except FileNotFoundError:
+        pass
+    # one attempt per batch: apply() answers every request when it
+    # returns, so a retry could commit a write its client saw fail
+    queue = WriteBehindQueue(
+        db_path, _make_apply(ops), flush_interval, retries=0, spill=False
+    )
+    server = _WriterServer(socket_path, queue)
+
+    def stop(signum, frame) -> None:
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+    if ready is not None:
+        ready.set()
+    log.info("writer for %s listening on %s", db_path, socket_path)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        queue.close()
+        try:
+            os.unlink(socket_path)
+        except FileNotFoundError:
+            pass
+
+
+class WriterClient:
+    """Send operations to the writer; one socket per calling thread."""
+
+    def __init__(self, socket_path: str, db_path: str) -> None:
+        self.socket_path = socket_path
+        self.db_path = db_path
+        self._local = threading.local()
+
+    def _stream(self):
+        stream = getattr(self._local, "stream", None)
+        # sockets must not cross a fork
+        if stream is None or self._local.pid != os.getpid():
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self.socket_path)
+            stream = self._local.stream = sock.makefile("rwb")
+            self._local.pid = os.getpid()
+        return stream
+
+    def call(self, op: str, *args: Any) -> Any:
+        """Run *op* in the writer and return its result once committed."""
+        payload = json.dumps({"op": op, "args": args}, ensure_ascii=False).encode("utf-8") + b"\n"
+        try:
+            stream = self._stream()
+            stream.write(payload)
+            stream.flush()
+        except OSError:
+            # a connection left over from before a writer restart; nothing
+            # was sent, so retrying once cannot apply the operation twice
+            self._local.stream = None
+            stream = self._stream()
+            stream.write(payload)
+            stream.flush()
+        line = stream.readline()
+        if not line:
+            self._local.stream = None
+            raise ConnectionError("writer closed the connection")
+        reply = json.loads(line)
+        if not reply["ok"]:
+            raise WriterError(reply["error"])
+        return reply.get("result")